@@ -0,0 +1,113 @@
+"""
+Background file appends.
+
+Journal records and metric events are appended on every step and every call,
+mostly from the event loop, where a blocking write (and the journal's fsync)
+would stall every stream in flight. An ``Appender`` queues the lines and a
+writer thread appends them, writing everything that queued up meanwhile with
+one write and at most one fsync, in the order the lines were appended. The
+thread is started when there is something to write and exits once it is
+written; it is not a daemon, so lines queued before Ctrl-C or an error are still
+written before the interpreter exits.
+"""
+import os
+import threading
+import weakref
+
+# The appender of each file, shared so that every writer and reader of a file waits on the same queue
+_appenders = weakref.WeakValueDictionary()
+_appenders_lock = threading.Lock()
+
+
+def get_appender(path: str, fsync: bool = False) -> "Appender":
+    """
+    Returns the appender of a file, shared by everything that appends to or reads the file in this process.
+
+    Args:
+        path (str): The file.
+        fsync (bool, optional): Fsync the file after each write, when the appender is created. Defaults to False.
+
+    Returns:
+        Appender: The file's appender; it is dropped once nothing holds it and its writes are done.
+    """
+    path = os.path.abspath(path)
+    with _appenders_lock:
+        appender = _appenders.get(path)
+        if appender is None:
+            appender = _appenders[path] = Appender(path, fsync)
+        return appender
+
+
+class Appender:
+    """
+    Appends lines to a file from a background thread.
+
+    Args:
+        path (str): The file; it and its directory are created on the first write. A relative path is resolved
+            against the current directory when the appender is created.
+        fsync (bool, optional): Fsync the file after each write. Defaults to False.
+    """
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = os.path.abspath(path)
+        self.fsync = fsync
+        self._pending = []
+        self._writer = None
+        self._error = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def append(self, line: str) -> None:
+        """
+        Queues a line (including its newline) to be appended.
+
+        Raises:
+            OSError: If an earlier write failed; the lines queued since are dropped.
+        """
+        with self._lock:
+            self._raise_error()
+            self._pending.append(line.encode())
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write, name=f"append-{os.path.basename(self.path)}")
+                self._writer.start()
+
+    def flush(self) -> None:
+        """
+        Blocks until every queued line is written (and fsynced).
+
+        Raises:
+            OSError: If a write failed.
+        """
+        with self._lock:
+            while self._writer is not None:
+                self._idle.wait()
+            self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            self._pending.clear()
+            raise error
+
+    def _write(self):
+        while True:
+            with self._lock:
+                if not self._pending or self._error is not None:
+                    self._writer = None
+                    self._idle.notify_all()
+                    return
+                data = b"".join(self._pending)
+                self._pending.clear()
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                descriptor = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                try:
+                    # One write per batch, so lines never interleave with another process appending to the file
+                    os.write(descriptor, data)
+                    if self.fsync:
+                        os.fsync(descriptor)
+                finally:
+                    os.close(descriptor)
+            except OSError as e:
+                with self._lock:
+                    self._error = e
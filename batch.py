@@ -0,0 +1,235 @@
+"""
+Headless batch mode: run many objectives from a JSONL file concurrently.
+
+Each input line is a JSON object with an ``objective`` (or a ``title`` and
+``body``), an optional ``id`` (or ``request_id``) and optional ``file``,
+``search`` and ``plan`` settings. Sessions run with a concurrency limit and one
+JSONL record is appended to the output as each session finishes, including its
+exchange log and per-role call metrics. Objectives that already have a successful record in the output
+are skipped, so an interrupted batch resumes where it stopped; an objective
+that was cut short or failed continues its session's journal instead of paying
+for its finished calls again.
+
+Usage:
+    python batch.py objectives.jsonl --output results.jsonl --concurrency 8
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+
+from rich.console import Console
+from rich.panel import Panel
+
+import maestro
+import utils
+from config import MAX_WORKERS
+from journal import RunJournal
+from metrics import get_recorder
+from providers import close_providers, set_cache_mode
+from search import get_search_service
+
+console = Console()
+
+
+def objective_id(record: dict) -> str:
+    """
+    Returns the stable id of an input record, derived from its objective when it has none.
+
+    Args:
+        record (dict): The parsed input line.
+
+    Returns:
+        str: The record id.
+    """
+    if record.get("id") or record.get("request_id"):
+        return str(record.get("id") or record.get("request_id"))
+    return hashlib.sha256(objective_text(record).encode()).hexdigest()[:16]
+
+
+def objective_text(record: dict) -> str:
+    if record.get("objective"):
+        return record["objective"]
+    return "\n\n".join(part for part in (record.get("title"), record.get("body")) if part)
+
+
+def session_run_id(record_id: str, objective: str, settings: dict) -> tuple:
+    """
+    Picks the run id an objective's session is journaled under, and whether it continues an earlier attempt.
+
+    The record id is made safe to use as a file name. An earlier attempt's journal is resumed when it was started
+    for the same objective and settings; when the id was reused for something else, the session gets an id of
+    its own instead of mixing two histories in one journal.
+
+    Args:
+        record_id (str): The record's id.
+        objective (str): The objective text.
+        settings (dict): The session's ``file_path``, ``use_search`` and ``plan``.
+
+    Returns:
+        tuple: The run id and whether to resume its journal.
+    """
+    run_id = re.sub(r'[^\w.-]+', '_', record_id).strip('.') or hashlib.sha256(record_id.encode()).hexdigest()[:16]
+    for candidate in (run_id, f"{run_id}-{hashlib.sha256(json.dumps([objective, settings], sort_keys=True).encode()).hexdigest()[:8]}"):
+        journal = RunJournal(candidate)
+        if not journal.exists():
+            return candidate, False
+        records = journal.records()
+        if records and records[0]["type"] == "start" and records[0]["objective"] == objective and all(records[0].get(key) == value for key, value in settings.items()):
+            return candidate, True
+    return candidate, False
+
+
+def read_finished(output_path: str) -> set:
+    """
+    Collects the ids of objectives that already finished successfully.
+
+    Args:
+        output_path (str): The output JSONL file, which may not exist yet.
+
+    Returns:
+        set: The finished ids.
+    """
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interruption
+                continue
+            if record.get("status") == "ok":
+                finished.add(record["id"])
+    return finished
+
+
+def read_objectives(input_path: str, finished: set):
+    """Yields the input records that still have to run, reading the file lazily."""
+    with open(input_path, 'r') as file:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                console.print(f"[bold red]Skipping line {line_number}:[/bold red] {e}")
+                continue
+            if objective_id(record) not in finished:
+                yield record
+
+
+async def run_record(record: dict, args) -> dict:
+    record_id = objective_id(record)
+    settings = {"file_path": record.get("file"), "use_search": record.get("search", args.search), "plan": record.get("plan", args.plan)}
+    run_id, resume = session_run_id(record_id, objective_text(record), settings)
+    log_filename = os.path.join(args.log_dir, f"{run_id}.md")
+    started = time.perf_counter()
+    try:
+        file_content = None
+        if record.get("file"):
+            file_content = maestro.load_input_file(record["file"])
+        result = await maestro.run_objective(
+            objective_text(record),
+            file_content,
+            use_search=settings["use_search"],
+            run_id=run_id,
+            resume=resume,
+            plan=settings["plan"],
+            max_workers=args.max_workers,
+            log_filename=log_filename,
+            file_path=settings["file_path"],
+            # Each session gets its own folder, since different objectives may pick the same project name
+            output_dir=os.path.join(args.project_dir, run_id),
+        )
+        output = {"id": record_id, "status": "ok", **result}
+    except Exception as e:
+        output = {"id": record_id, "status": "error", "error": f"{type(e).__name__}: {e}", "exchange_log": log_filename}
+    output["objective"] = objective_text(record)
+    output["duration"] = round(time.perf_counter() - started, 3)
+    # The session's calls are labelled with its run id; once summarized, their events are dropped from memory so a
+    # long batch does not keep every call it made
+    output["metrics"] = get_recorder().summarize(run_id)
+    get_recorder().forget(run_id)
+    if os.path.exists(log_filename):
+        with open(log_filename, 'r') as file:
+            output["exchange_log_text"] = file.read()
+    return output
+
+
+def add_metrics(totals: dict, summary: dict) -> None:
+    """Adds the calls, tokens and cost per role of one session's metric summary to the batch totals."""
+    for role, stats in summary.items():
+        role_totals = totals.setdefault(role, dict.fromkeys(("calls", "input_tokens", "output_tokens", "cached_tokens", "cost"), 0))
+        for name in role_totals:
+            role_totals[name] += stats[name]
+
+
+async def run_batch(args) -> None:
+    os.makedirs(args.log_dir, exist_ok=True)
+    os.makedirs(args.project_dir, exist_ok=True)
+    finished = read_finished(args.output)
+    if finished:
+        console.print(f"Resuming: {len(finished)} objectives already finished")
+
+    records = read_objectives(args.input, finished)
+    counts = {"ok": 0, "error": 0}
+    totals = {}
+    started = time.perf_counter()
+
+    with open(args.output, 'a') as output_file:
+        async def worker():
+            # Workers pull from the shared generator, so the input is never loaded into memory at once
+            for record in records:
+                output = await run_record(record, args)
+                output_file.write(json.dumps(output) + "\n")
+                output_file.flush()
+                counts[output["status"]] += 1
+                add_metrics(totals, output["metrics"])
+                status = "[green]done[/green]" if output["status"] == "ok" else f"[red]failed[/red] ({output['error']})"
+                console.print(f"{output['id']}: {status} in {output['duration']:.1f}s")
+
+        await asyncio.gather(*(worker() for _ in range(max(1, args.concurrency))))
+
+    lines = [
+        f"{role}: {stats['calls']} calls, tokens {stats['input_tokens']} in / {stats['output_tokens']} out / {stats['cached_tokens']} cached, ${stats['cost']:.4f}"
+        for role, stats in sorted(totals.items())
+    ]
+    # Latency percentiles are in each result's metrics
+    console.print(Panel("\n".join(lines), title="[bold]Calls per role[/bold]", title_align="left", border_style="white"))
+    get_recorder().export()
+    console.print(f"\nFinished {counts['ok']} objectives ({counts['error']} failed) in {time.perf_counter() - started:.1f}s, results in {args.output}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Run many maestro objectives from a JSONL file concurrently")
+    parser.add_argument('input', help='JSONL file with one objective per line')
+    parser.add_argument('--output', default='results.jsonl', help='JSONL file results are appended to as sessions finish')
+    parser.add_argument('--concurrency', type=int, default=4, help='Maximum number of sessions running at once')
+    parser.add_argument('--log-dir', default='batch_logs', help='Directory for the per-objective exchange logs')
+    parser.add_argument('--project-dir', default='batch_projects', help='Directory the project folders are created in')
+    parser.add_argument('--plan', action='store_true', help='Run every objective in plan mode unless its line says otherwise')
+    parser.add_argument('--search', action='store_true', help='Let sub-agents search the web unless an objective\'s line says otherwise')
+    parser.add_argument('--max-workers', type=int, default=MAX_WORKERS, help='Maximum number of sub-agents running at once per session in plan mode')
+    parser.add_argument('--cache', choices=['on', 'off', 'refresh'], help='Use the on-disk response cache, bypass it, or refresh it with new responses')
+    args = parser.parse_args()
+    if args.cache:
+        set_cache_mode(args.cache)
+
+    # Sessions run side by side, so their streamed output would interleave on the console
+    maestro.console.quiet = True
+    utils.console.quiet = True
+    try:
+        await run_batch(args)
+    finally:
+        if args.search:
+            console.print(get_search_service().stats())
+        await close_providers()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,380 @@
+"""
+A local stand-in for the LLM APIs maestro talks to, for offline benchmarks.
+
+The server speaks enough of the Anthropic Messages API, the OpenAI and Groq
+chat-completions APIs and Ollama's ``/api/chat`` to drive every maestro variant,
+streamed and non-streamed. Its replies follow a scripted scenario: the
+orchestrator asks for a fixed number of sub-tasks and then declares the task
+complete, plan requests get a task graph of a fixed width, and the refiner
+returns a small project. Latency, token rate, truncation and failures are
+configurable, and the server counts the requests and prompt tokens it receives.
+
+Usage:
+    python benchmarks/fake_llm_server.py --port 8765 --ttft 0.2 --tokens-per-second 200
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+# Appended to every sub-agent result, so the orchestrator's replies can count the results it has seen
+RESULT_MARKER = "[[sub-task result]]"
+
+
+@dataclass
+class Scenario:
+    """
+    How the fake server behaves.
+
+    Attributes:
+        subtasks (int): Sub-tasks the orchestrator hands out before declaring the task complete.
+        plan_width (int): Independent tasks per level of a plan; plans have two levels plus a final task.
+        output_tokens (int): Tokens in each sub-agent result.
+        files (int): Code files in the refined output.
+        ttft (float): Seconds before the first token (or the whole response when not streamed).
+        tokens_per_second (float): Generation speed of streamed and non-streamed responses.
+        truncate_rate (float): Probability that a sub-agent result is cut off at ``max_tokens``.
+        truncate_refine (bool): Whether a structured refiner reply is cut off at ``max_tokens`` in the middle of
+            its ``output`` string (continuations get the rest of the JSON).
+        failure_rate (float): Probability that a request fails instead of being answered.
+        failure_status (int): HTTP status of injected failures (429 sends a ``retry-after``).
+        fail_first (int): Number of requests at the start that fail with ``failure_status`` whatever the rate.
+        seed (int): Seed for the truncation and failure draws, so runs are repeatable.
+    """
+    subtasks: int = 3
+    plan_width: int = 3
+    output_tokens: int = 200
+    files: int = 3
+    ttft: float = 0.05
+    tokens_per_second: float = 500.0
+    truncate_rate: float = 0.0
+    truncate_refine: bool = False
+    failure_rate: float = 0.0
+    failure_status: int = 429
+    fail_first: int = 0
+    seed: int = 0
+
+
+@dataclass
+class Stats:
+    """Request counters, shared by all handler threads."""
+    requests: int = 0
+    failures: int = 0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    # Wall-clock time the first request arrived, for the start-up time of a run
+    first_request_at: Optional[float] = None
+    by_path: dict = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def as_dict(self) -> dict:
+        return {"requests": self.requests, "failures": self.failures, "prompt_tokens": self.prompt_tokens, "output_tokens": self.output_tokens, "by_path": dict(self.by_path)}
+
+
+def flatten_content(content) -> str:
+    """Flattens a message content string or list of text blocks."""
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content or [] if isinstance(block, dict))
+
+
+def request_text(body: dict) -> str:
+    """Flattens the system prompt and messages of a request of any of the supported protocols."""
+    parts = [flatten_content(body.get("system"))] if body.get("system") else []
+    parts.extend(flatten_content(message.get("content")) for message in body.get("messages", []))
+    return "\n".join(parts)
+
+
+def filler(tokens: int) -> str:
+    """Returns roughly ``tokens`` tokens of text."""
+    return " ".join("lorem" for _ in range(tokens))
+
+
+def scripted_reply(text: str, scenario: Scenario, rng: random.Random, structured: bool = False, continuation: str = None) -> tuple:
+    """
+    Chooses the reply to a request from the role it plays in the maestro loop.
+
+    Args:
+        text (str): The flattened request.
+        scenario (Scenario): The scenario being played.
+        rng (random.Random): Source of the truncation draws.
+        structured (bool, optional): Whether the request asked for schema-constrained JSON output, in which case
+            the orchestrator and refiner replies are JSON objects. Defaults to False.
+        continuation (str, optional): The truncated reply the request continues, given as an assistant message.
+            The rest of a structured reply is returned, or else the rest of a sub-agent result. Defaults to None.
+
+    Returns:
+        tuple: The reply text and whether it was truncated.
+    """
+    if continuation is not None:
+        # Continuations are never truncated again
+        if continuation.startswith("{"):
+            reply, _ = scripted_reply(text, replace(scenario, truncate_refine=False), rng, structured=True)
+            if reply.startswith(continuation):
+                return reply[len(continuation):], False
+        return filler(scenario.output_tokens) + " " + RESULT_MARKER, False
+    lowered = text.lower()
+    if "<plan>" in lowered or "break down the whole objective" in lowered:
+        tasks = [{"id": f"a{index}", "prompt": f"Research part {index}", "depends_on": []} for index in range(scenario.plan_width)]
+        tasks += [{"id": f"b{index}", "prompt": f"Build part {index}", "depends_on": [f"a{index}"]} for index in range(scenario.plan_width)]
+        tasks.append({"id": "final", "prompt": "Combine all parts", "depends_on": [f"b{index}" for index in range(scenario.plan_width)]})
+        return (json.dumps({"tasks": tasks}) if structured else "<plan>" + json.dumps({"tasks": tasks}) + "</plan>"), False
+    if "new results:" in lowered and "summary" in lowered:
+        # Summaries keep the result markers, so the orchestrator still counts summarized results
+        return "Summary of the results so far. " + RESULT_MARKER * text.count(RESULT_MARKER), False
+    if "refine the sub-task results" in lowered:
+        names = [f"module_{index}.py" for index in range(scenario.files)]
+        structure = {"src": {name: None for name in names}, "README.md": None}
+        if structured:
+            files = [{"path": name, "language": "python", "code": f"def run_{index}():\n    return {index}"} for index, name in enumerate(names)]
+            files.append({"path": "README.md", "language": "markdown", "code": "# Benchmark project"})
+            reply = json.dumps({"output": "The benchmark project.", "project_name": "bench_project", "folder_structure": structure, "files": files})
+            if scenario.truncate_refine:
+                # Cut inside the first string, which a partial JSON parse drops altogether
+                return reply[:reply.index('"output": "') + len('"output": "The bench')], True
+            return reply, False
+        files = "\n\n".join(f"Filename: {name}\n```python\ndef run_{index}():\n    return {index}\n```" for index, name in enumerate(names))
+        return f"Project Name: bench_project\n<folder_structure>{json.dumps(structure)}</folder_structure>\n\n{files}\n\nFilename: README.md\n```markdown\n# Benchmark project\n```", False
+    if "previous sub-task results" in lowered:
+        completed = text.count(RESULT_MARKER)
+        if completed >= scenario.subtasks:
+            if structured:
+                return json.dumps({"status": "complete", "prompt": "Every sub-task has been carried out."}), False
+            return "The task is complete: every sub-task has been carried out.", False
+        if structured:
+            return json.dumps({"status": "continue", "prompt": f"Sub-task {completed + 1}: implement part {completed + 1} of the objective and explain the result."}), False
+        return f"Sub-task {completed + 1}: implement part {completed + 1} of the objective and explain the result.", False
+    # Anything else is a sub-agent call
+    if rng.random() < scenario.truncate_rate:
+        return filler(max(scenario.output_tokens, 1000)), True
+    return filler(scenario.output_tokens) + " " + RESULT_MARKER, False
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeLLM/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def scenario(self) -> Scenario:
+        return self.server.scenario
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None) -> None:
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("content-length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("content-type", content_type)
+        self.send_header("transfer-encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self) -> None:
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _pieces(self, text: str):
+        """Yields the reply in small pieces at the scenario's token rate."""
+        words = [word + " " for word in text.split(" ")]
+        words[-1] = words[-1][:-1]
+        # Roughly 20 pieces per second keeps the overhead of the stream itself small
+        per_piece = max(1, int(self.scenario.tokens_per_second / 20))
+        for start in range(0, len(words), per_piece):
+            piece = words[start:start + per_piece]
+            yield "".join(piece)
+            time.sleep(len(piece) / self.scenario.tokens_per_second)
+
+    def do_GET(self):
+        if self.path == "/api/tags" or self.path == "/api/ps":
+            return self._send_json(200, {"models": []})
+        self._send_json(404, {"error": "not found"})
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("content-length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("content-length") or 0)) or b"{}")
+        stats = self.server.stats
+        path = self.path.split("?")[0]
+        if path in ("/api/show", "/api/pull"):
+            return self._send_json(200, {"status": "success", "modelfile": "", "parameters": "", "template": "", "details": {}, "model_info": {}})
+        if path == "/api/generate" and not body.get("prompt"):
+            # An empty prompt only loads the model
+            return self._send_json(200, {"model": body.get("model", "fake"), "created_at": "2024-01-01T00:00:00Z", "response": "", "done": True, "done_reason": "load"})
+
+        text = request_text(body)
+        with self.server.rng_lock:
+            fail = self.server.rng.random() < self.scenario.failure_rate
+            reply, truncated = scripted_reply(
+                text, self.scenario, self.server.rng,
+                structured=bool(body.get("tools") or isinstance(body.get("format"), dict)),
+                # maestro only sends assistant messages to continue a truncated reply
+                continuation=next((flatten_content(message.get("content")) for message in body.get("messages", []) if message.get("role") == "assistant"), None),
+            )
+        with stats.lock:
+            stats.requests += 1
+            stats.first_request_at = stats.first_request_at or time.time()
+            stats.by_path[path] = stats.by_path.get(path, 0) + 1
+            stats.prompt_tokens += len(text) // 4
+            fail = fail or stats.requests <= self.scenario.fail_first
+        if fail:
+            with stats.lock:
+                stats.failures += 1
+            return self._send_json(self.scenario.failure_status, {"type": "error", "error": {"type": "rate_limit_error" if self.scenario.failure_status == 429 else "api_error", "message": "Injected failure"}}, {"retry-after": "0.1"})
+
+        output_tokens = (body.get("max_tokens") or 4096) if truncated else len(reply.split(" "))
+        with stats.lock:
+            stats.output_tokens += output_tokens
+        time.sleep(self.scenario.ttft)
+        input_tokens = len(text) // 4
+        model = body.get("model", "fake")
+
+        if path.endswith("/messages"):
+            return self._anthropic(body, model, reply, truncated, input_tokens, output_tokens)
+        if path.endswith("/chat/completions"):
+            return self._chat_completions(body, model, reply, truncated, input_tokens, output_tokens)
+        if path == "/api/chat":
+            return self._ollama(body, model, reply, truncated, input_tokens, output_tokens)
+        self._send_json(404, {"error": f"unknown endpoint {path}"})
+
+    def _anthropic(self, body, model, reply, truncated, input_tokens, output_tokens):
+        # A forced tool call answers with a tool_use block whose input is the JSON reply
+        tool = (body.get("tools") or [None])[0]
+        stop_reason = "max_tokens" if truncated else "tool_use" if tool else "end_turn"
+        usage = {"input_tokens": input_tokens, "output_tokens": output_tokens, "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+        if not body.get("stream"):
+            time.sleep(output_tokens / self.scenario.tokens_per_second)
+            # Like the API, a tool call cut off at max_tokens comes back without the JSON it could not finish
+            content = {"type": "tool_use", "id": "toolu_fake", "name": tool["name"], "input": {} if truncated else json.loads(reply)} if tool else {"type": "text", "text": reply}
+            return self._send_json(200, {"id": "msg_fake", "type": "message", "role": "assistant", "model": model, "content": [content], "stop_reason": stop_reason, "stop_sequence": None, "usage": usage})
+
+        def event(name, payload):
+            self._write_chunk(f"event: {name}\ndata: {json.dumps(payload)}\n\n".encode())
+
+        self._start_stream("text/event-stream")
+        event("message_start", {"type": "message_start", "message": {"id": "msg_fake", "type": "message", "role": "assistant", "model": model, "content": [], "stop_reason": None, "stop_sequence": None, "usage": {**usage, "output_tokens": 0}}})
+        if tool:
+            event("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "tool_use", "id": "toolu_fake", "name": tool["name"], "input": {}}})
+        else:
+            event("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        for piece in self._pieces(reply):
+            delta = {"type": "input_json_delta", "partial_json": piece} if tool else {"type": "text_delta", "text": piece}
+            event("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": delta})
+        event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        event("message_delta", {"type": "message_delta", "delta": {"stop_reason": stop_reason, "stop_sequence": None}, "usage": {"output_tokens": output_tokens}})
+        event("message_stop", {"type": "message_stop"})
+        self._end_stream()
+
+    def _chat_completions(self, body, model, reply, truncated, input_tokens, output_tokens):
+        # A forced function call answers with the JSON reply as the call's arguments
+        tool = (body.get("tools") or [None])[0]
+        finish_reason = "length" if truncated else "stop"
+        usage = {"prompt_tokens": input_tokens, "completion_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+        if not body.get("stream"):
+            time.sleep(output_tokens / self.scenario.tokens_per_second)
+            message = {"role": "assistant", "content": None, "tool_calls": [{"id": "call_fake", "type": "function", "function": {"name": tool["function"]["name"], "arguments": reply}}]} if tool else {"role": "assistant", "content": reply}
+            return self._send_json(200, {"id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model, "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}], "usage": usage})
+
+        def chunk(payload):
+            self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode())
+
+        base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        self._start_stream("text/event-stream")
+        for number, piece in enumerate(self._pieces(reply)):
+            if tool:
+                call = {"index": 0, "function": {"arguments": piece}}
+                if number == 0:
+                    call.update(id="call_fake", type="function", function={"name": tool["function"]["name"], "arguments": piece})
+                delta = {"tool_calls": [call]}
+            else:
+                delta = {"content": piece}
+            chunk({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        # Groq reports usage in x_groq on the last choice chunk, OpenAI in a trailing chunk without choices
+        chunk({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}], "x_groq": {"id": "req_fake", "usage": usage}})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunk({**base, "choices": [], "usage": usage})
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._end_stream()
+
+    def _ollama(self, body, model, reply, truncated, input_tokens, output_tokens):
+        done_reason = "length" if truncated else "stop"
+        final = {"model": model, "created_at": "2024-01-01T00:00:00Z", "done": True, "done_reason": done_reason, "prompt_eval_count": input_tokens, "eval_count": output_tokens}
+        if body.get("stream") is False:
+            time.sleep(output_tokens / self.scenario.tokens_per_second)
+            return self._send_json(200, {**final, "message": {"role": "assistant", "content": reply}})
+        self._start_stream("application/x-ndjson")
+        for piece in self._pieces(reply):
+            self._write_chunk((json.dumps({"model": model, "created_at": "2024-01-01T00:00:00Z", "message": {"role": "assistant", "content": piece}, "done": False}) + "\n").encode())
+        self._write_chunk((json.dumps({**final, "message": {"role": "assistant", "content": ""}}) + "\n").encode())
+        self._end_stream()
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    """
+    The fake API server, playing one scenario at a time.
+
+    Args:
+        port (int, optional): Port to listen on; 0 picks a free one. Defaults to 0.
+        scenario (Scenario, optional): The initial scenario. Defaults to ``Scenario()``.
+    """
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, scenario: Scenario = None):
+        super().__init__(("127.0.0.1", port), FakeLLMHandler)
+        self.rng_lock = threading.Lock()
+        self.reset(scenario or Scenario())
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def reset(self, scenario: Scenario) -> None:
+        """Switches to a new scenario and clears the counters."""
+        self.scenario = scenario
+        self.rng = random.Random(scenario.seed)
+        self.stats = Stats()
+
+    def start(self) -> "FakeLLMServer":
+        """Serves requests on a background thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake Anthropic, OpenAI, Groq and Ollama APIs for offline benchmarks")
+    parser.add_argument("--port", type=int, default=8765)
+    for name, default in vars(Scenario()).items():
+        if isinstance(default, bool):
+            parser.add_argument(f"--{name.replace('_', '-')}", action="store_true")
+        else:
+            parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    args = parser.parse_args()
+    scenario = Scenario(**{name: getattr(args, name) for name in vars(Scenario())})
+    server = FakeLLMServer(args.port, scenario)
+    print(f"Fake LLM server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.stats.as_dict()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Offline benchmark suite for the maestro orchestration loop.
+
+Runs ``maestro.py`` and each variant against the local fake LLM server on fixed
+scenarios and reports wall time, time to the first request, number of calls,
+prompt tokens sent and peak resident memory per run. Results are saved as JSON, and a saved baseline can be
+compared against to see whether a change made the loop faster or cheaper.
+
+Usage:
+    python benchmarks/run.py                          # run everything, save to benchmarks/results/latest.json
+    python benchmarks/run.py --save-baseline          # also store the results as the baseline
+    python benchmarks/run.py --compare                # compare against benchmarks/results/baseline.json
+    python benchmarks/run.py --scenario long --variant maestro
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict
+
+from fake_llm_server import FakeLLMServer, Scenario
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+OBJECTIVE = "Build a command line todo app in Python"
+
+# Each variant's script, extra arguments and the answers it reads from stdin
+VARIANTS = {
+    "maestro": {"script": "maestro.py", "args": [], "stdin": f"{OBJECTIVE}\nn\n"},
+    "maestro-plan": {"script": "maestro.py", "args": ["--plan"], "stdin": f"{OBJECTIVE}\nn\n"},
+    "groq": {"script": "maestro-groq.py", "args": [], "stdin": f"{OBJECTIVE}\n"},
+    "gpt": {"script": "maestro-gpt.py", "args": [], "stdin": f"GPT-4\n{OBJECTIVE}\n"},
+    "ollama": {"script": "maestro-ollama.py", "args": ["--prompt", OBJECTIVE], "stdin": ""},
+    "cli": {"script": "maestro", "args": [OBJECTIVE], "stdin": ""},
+    "cli-ollama": {"script": "maestro", "args": [OBJECTIVE, "--provider", "ollama"], "stdin": ""},
+}
+
+SCENARIOS = {
+    "short": Scenario(subtasks=2, output_tokens=100),
+    "long": Scenario(subtasks=8, output_tokens=400),
+    "slow": Scenario(subtasks=3, ttft=0.5, tokens_per_second=80),
+    "truncated": Scenario(subtasks=3, truncate_rate=0.5, truncate_refine=True, seed=1),
+    "flaky": Scenario(subtasks=3, failure_rate=0.15, failure_status=429, seed=2),
+}
+
+# Metrics compared against the baseline; lower is better for all of them
+COMPARED_METRICS = ("wall_time", "time_to_first_request", "calls", "prompt_tokens", "peak_rss_mb")
+
+
+def run_variant(server: FakeLLMServer, variant: str, scenario_name: str, timeout: float) -> dict:
+    """
+    Runs one variant against the fake server playing one scenario.
+
+    Args:
+        server (FakeLLMServer): The running fake server.
+        variant (str): Key of ``VARIANTS``.
+        scenario_name (str): Key of ``SCENARIOS``.
+        timeout (float): Seconds before the run is killed.
+
+    Returns:
+        dict: The measurements, with ``ok`` False if the run failed or timed out.
+    """
+    spec = VARIANTS[variant]
+    server.reset(SCENARIOS[scenario_name])
+    workdir = tempfile.mkdtemp(prefix=f"maestro-bench-{variant}-")
+    env = {
+        **os.environ,
+        "ANTHROPIC_BASE_URL": server.url,
+        "OPENAI_BASE_URL": f"{server.url}/v1",
+        "GROQ_BASE_URL": server.url,
+        "OLLAMA_HOST": server.url,
+        "ANTHROPIC_API_KEY": "benchmark",
+        "OPENAI_API_KEY": "benchmark",
+        "GROQ_API_KEY": "benchmark",
+        # Every run must reach the server, and should not touch the user's files
+        "MAESTRO_CACHE": "off",
+        "MAESTRO_METRICS_FILE": "",
+        "MAESTRO_METRICS_PROMETHEUS_FILE": "",
+        "PYTHONWARNINGS": "ignore",
+    }
+    log_path = os.path.join(workdir, "output.log")
+    started = time.perf_counter()
+    launched = time.time()
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_ROOT, spec["script"]), *spec["args"]],
+            cwd=workdir, env=env, stdin=subprocess.PIPE, stdout=log, stderr=subprocess.STDOUT, text=True,
+        )
+        process.stdin.write(spec["stdin"])
+        process.stdin.close()
+        killer = threading.Timer(timeout, process.kill)
+        killer.start()
+        # Reaping the child with wait4 gives its own peak RSS rather than the maximum over all runs
+        _, status, rusage = os.wait4(process.pid, 0)
+        killer.cancel()
+        process.returncode = os.waitstatus_to_exitcode(status)
+    wall_time = time.perf_counter() - started
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = rusage.ru_maxrss * (1 if platform.system() == "Darwin" else 1024)
+
+    result = {
+        "variant": variant,
+        "scenario": scenario_name,
+        # A run killed at the timeout exits with a negative return code
+        "ok": process.returncode == 0,
+        "returncode": process.returncode,
+        "wall_time": round(wall_time, 3),
+        # Start-up: from launching the process to its first request reaching the server
+        "time_to_first_request": round(server.stats.first_request_at - launched, 3) if server.stats.first_request_at else None,
+        "calls": server.stats.requests,
+        "failures_injected": server.stats.failures,
+        "prompt_tokens": server.stats.prompt_tokens,
+        "output_tokens": server.stats.output_tokens,
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+    }
+    if result["ok"]:
+        shutil.rmtree(workdir, ignore_errors=True)
+    else:
+        result["log"] = log_path
+    return result
+
+
+def compare(results: list, baseline: list) -> list:
+    """
+    Compares results with a baseline run of the same variants and scenarios.
+
+    Args:
+        results (list): The current results.
+        baseline (list): The baseline results.
+
+    Returns:
+        list: One line per variant and scenario with the relative change of each metric.
+    """
+    baseline_by_key = {(entry["variant"], entry["scenario"]): entry for entry in baseline}
+    lines = []
+    for entry in results:
+        previous = baseline_by_key.get((entry["variant"], entry["scenario"]))
+        if not previous:
+            lines.append(f"{entry['variant']}/{entry['scenario']}: no baseline")
+            continue
+        changes = []
+        for metric in COMPARED_METRICS:
+            old, new = previous.get(metric), entry.get(metric)
+            if old and new is not None:
+                changes.append(f"{metric} {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+        lines.append(f"{entry['variant']}/{entry['scenario']}: " + ", ".join(changes))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark maestro and its variants against a local fake LLM server")
+    parser.add_argument("--variant", action="append", choices=list(VARIANTS), help="Variant to run (repeatable, defaults to all)")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="Scenario to run (repeatable, defaults to all)")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "latest.json"), help="Where to save the results")
+    parser.add_argument("--baseline", default=os.path.join(RESULTS_DIR, "baseline.json"), help="Baseline results file")
+    parser.add_argument("--save-baseline", action="store_true", help="Also save the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="Compare the results with the baseline")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds before a single run is killed")
+    args = parser.parse_args()
+
+    server = FakeLLMServer().start()
+    results = []
+    for scenario_name in args.scenario or SCENARIOS:
+        for variant in args.variant or VARIANTS:
+            result = run_variant(server, variant, scenario_name, args.timeout)
+            results.append(result)
+            status = "ok" if result["ok"] else f"FAILED (exit {result['returncode']}, see {result['log']})"
+            print(f"{variant:>13} / {scenario_name:<9} {result['wall_time']:8.2f}s {result['time_to_first_request'] or 0:6.2f}s to first {result['calls']:4d} calls {result['prompt_tokens']:8d} prompt tokens {result['peak_rss_mb']:7.1f} MB  {status}")
+    server.shutdown()
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "scenarios": {name: asdict(SCENARIOS[name]) for name in args.scenario or SCENARIOS},
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nResults saved to {args.output}")
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+    elif args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}; run with --save-baseline first")
+        else:
+            with open(args.baseline, "r") as file:
+                baseline = json.load(file)["results"]
+            print("\nCompared with the baseline:")
+            print("\n".join(compare(results, baseline)))
+
+    if not all(result["ok"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
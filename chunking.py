@@ -0,0 +1,94 @@
+"""
+Lazy, structure-aware chunking of large input files.
+
+A file given with the objective used to be read whole and pasted into the first
+prompts, which fails once it is bigger than the context window. For large files
+the file is memory-mapped instead and cut into chunks of roughly a token budget
+each, preferring to cut at blank lines, then at top-level definitions and
+headings, then at line ends. Chunks are described by byte offsets and only
+decoded when a sub-agent reads them, so the file is never held in memory whole.
+"""
+import mmap
+import os
+import re
+from contextlib import contextmanager
+from typing import Iterator
+
+from context import CHARS_PER_TOKEN
+
+# Cut points, best first: a paragraph or block break, a top-level definition or heading, any line end
+BOUNDARIES = (
+    re.compile(rb'\n[ \t]*\n'),
+    re.compile(rb'\n(?=(?:def |class |async def |#|function |export |public |private |[A-Za-z_][\w]* ?[({=:]))'),
+    re.compile(rb'\n'),
+)
+
+
+def estimate_file_tokens(path: str) -> int:
+    """Estimates the number of tokens in a file from its size, without reading it."""
+    return os.path.getsize(path) // CHARS_PER_TOKEN
+
+
+@contextmanager
+def mapped_file(path: str):
+    """
+    Memory-maps a file read-only.
+
+    Yields:
+        mmap.mmap | bytes: The mapped file (an empty ``bytes`` for an empty file, which cannot be mapped).
+    """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            yield b""
+            return
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapped
+        finally:
+            mapped.close()
+
+
+def _cut_point(data, start: int, end: int) -> int:
+    """Returns the best place to end a chunk that starts at ``start`` and may not go past ``end``."""
+    window = data[start:end]
+    # Never cut in the first half of the window, so chunks stay close to the budget
+    minimum = len(window) // 2
+    for boundary in BOUNDARIES:
+        last = None
+        for match in boundary.finditer(window, minimum):
+            last = match
+        if last:
+            return start + last.end()
+    # No line break at all: cut anywhere, but not inside a UTF-8 sequence
+    cut = end
+    while cut > start + 1 and data[cut] & 0xC0 == 0x80:
+        cut -= 1
+    return cut
+
+
+def iter_chunks(data, chunk_tokens: int) -> Iterator[tuple]:
+    """
+    Splits mapped file data into chunks of about ``chunk_tokens`` tokens.
+
+    Args:
+        data (mmap.mmap | bytes): The file data.
+        chunk_tokens (int): Target size of a chunk in tokens.
+
+    Yields:
+        tuple: ``(start, end)`` byte offsets of each chunk, in file order.
+    """
+    chunk_bytes = max(chunk_tokens * CHARS_PER_TOKEN, 1)
+    start = 0
+    while start < len(data):
+        end = start + chunk_bytes
+        if end >= len(data):
+            end = len(data)
+        else:
+            end = _cut_point(data, start, end)
+        yield start, end
+        start = end
+
+
+def read_chunk(data, start: int, end: int) -> str:
+    """Decodes one chunk of the mapped file."""
+    return data[start:end].decode('utf-8', errors='replace')
@@ -0,0 +1,205 @@
+"""
+The ``maestro`` command.
+
+Each backend used to have its own script (maestro.py, maestro-gpt.py,
+maestro-groq.py, maestro-ollama.py), each importing its SDKs and rich before
+asking for the objective, and none could mix backends across roles. The
+``maestro`` command runs the orchestration loop of maestro.py on any backend:
+
+- ``--provider`` picks the backend, with its default model for each role, and
+  ``--model ROLE=[provider:]MODEL`` overrides the model of one role (``all``
+  for every role); the choices become the role's route (see ``routing.py``), so
+  a ``MAESTRO_ROUTE_<ROLE>`` set in the environment still wins unless
+  overridden on the command line.
+- Only the SDKs of the backends the routes use are imported, and ``--help``
+  imports none. When the objective is typed in, they are imported on a
+  background thread in the meantime.
+- The objective can be given as an argument and search with ``--search``, so
+  scripted runs need no input, and every run reports its time to the first
+  request.
+"""
+import argparse
+import asyncio
+import time
+
+import config
+
+# The size of model each role runs on
+ROLE_TIERS = {
+    "orchestrator": "large",
+    "planner": "large",
+    "refiner": "large",
+    "sub_agent": "medium",
+    "mapper": "medium",
+    "reducer": "medium",
+    "drafter": "medium",
+    "summarizer": "small",
+}
+
+# The model of each size, per backend
+DEFAULT_MODELS = {
+    "anthropic": {"large": "claude-3-opus-20240229", "medium": "claude-3-sonnet-20240229", "small": "claude-3-haiku-20240307"},
+    "openai": {"large": "gpt-4-0125-preview", "medium": "gpt-3.5-turbo-0125", "small": "gpt-3.5-turbo-0125"},
+    "groq": {"large": "llama3-70b-8192", "medium": "mixtral-8x7b-32768", "small": "llama3-8b-8192"},
+    "ollama": {"large": "llama3:70b-instruct", "medium": "llama3:instruct", "small": "llama3:instruct"},
+}
+
+
+def parse_model(value: str, provider: str, providers: list) -> tuple:
+    """
+    Parses a ``--model`` value such as ``sub_agent=groq:llama3-8b-8192`` or ``all=llama3:8b``.
+
+    Args:
+        value (str): ``ROLE=`` followed by one or more comma-separated ``[provider:]model`` tiers, cheapest first.
+        provider (str): The backend of a tier without a provider.
+        providers (list): The known backend names. A prefix that is not one of them is part of the model name,
+            as in Ollama's ``llama3:8b``.
+
+    Returns:
+        tuple: The role and its route, as ``provider:model`` tiers joined by commas.
+
+    Raises:
+        ValueError: If the role is unknown or no model is given.
+    """
+    role, _, route = value.partition("=")
+    if role != "all" and role not in ROLE_TIERS:
+        raise ValueError(f"Unknown role: {role}. Expected all or one of: {', '.join(ROLE_TIERS)}")
+    tiers = []
+    for tier in filter(None, (part.strip() for part in route.split(","))):
+        prefix, separator, model = tier.partition(":")
+        tiers.append(tier if separator and prefix in providers else f"{provider}:{tier}")
+    if not tiers:
+        raise ValueError(f"No model given for {role}. Expected ROLE=[provider:]MODEL")
+    return role, ",".join(tiers)
+
+
+def resolve_routes(provider: str, overrides: list) -> dict:
+    """
+    Sets the route of every role for the run.
+
+    Args:
+        provider (str): The backend whose default models the roles run on.
+        overrides (list): ``(role, route)`` pairs from ``--model``, later ones winning.
+
+    Returns:
+        dict: The ``(provider, model)`` tiers of each role; a role left without a model (on a plugin backend with
+            no ``--model`` for it) is missing.
+    """
+    from routing import parse_route, route_for
+
+    for role, tier in ROLE_TIERS.items():
+        if role not in config.ROUTES and tier in DEFAULT_MODELS.get(provider, {}):
+            # Joined back into a route so the role's cascade is kept, see routing.route_for
+            config.ROUTES[role] = ",".join(f"{name}:{model}" for name, model in route_for(role, provider, DEFAULT_MODELS[provider][tier]))
+    for role, route in overrides:
+        for name in ROLE_TIERS if role == "all" else [role]:
+            config.ROUTES[name] = route
+    return {role: parse_route(config.ROUTES[role]) for role in ROLE_TIERS if role in config.ROUTES}
+
+
+def time_to_first_request(run_id: str, started: float, imported: float):
+    """
+    Describes how long a run took to send its first provider request.
+
+    Args:
+        run_id (str): The run.
+        started (float): ``time.time()`` when the process started.
+        imported (float): ``time.time()`` once maestro had been imported.
+
+    Returns:
+        str: The time to the first request and where it went, or None if every response came from the cache.
+    """
+    from metrics import get_recorder
+    from providers import get_provider
+
+    calls = [event for event in get_recorder().run_events(run_id) if event["kind"] == "llm" and not event.get("cached")]
+    if not calls:
+        return None
+    first = min(calls, key=lambda event: event["timestamp"] - event["latency"])
+    # The call waits for its provider's client, and so for its SDK, before the request goes out
+    ready = get_provider(first["provider"]).ready_at or 0
+    sent = max(first["timestamp"] - first["latency"], ready)
+    return f"Time to first request: {sent - started:.2f}s (maestro loaded after {imported - started:.2f}s, the {first['provider']} client after {ready - started:.2f}s)"
+
+
+async def run(args, routes: dict, started: float) -> None:
+    import maestro
+    imported = time.time()
+    from journal import RunJournal
+    from providers import get_provider
+    from rich.panel import Panel
+
+    console = maestro.console
+    ollama_models = {}
+    for role, tiers in routes.items():
+        for name, model in tiers:
+            if name == "ollama":
+                ollama_models.setdefault(model, role)
+    if ollama_models:
+        # Pulled and loaded in the background; a call only waits for its own model
+        get_provider("ollama").pool.start(ollama_models)
+
+    if args.resume:
+        journal = RunJournal(args.resume)
+        if not journal.exists():
+            console.print(Panel(f"No journal found for run {args.resume} in {journal.directory}", title="[bold red]Resume Error[/bold red]", title_align="left", border_style="red"))
+            return
+        start = journal.records()[0]
+        console.print(Panel(f"Resuming run {args.resume}: {start['objective']}", title="[bold blue]Resuming Run[/bold blue]", title_align="left", border_style="blue"))
+        result = await maestro.run_objective(start["objective"], start["file_content"], start["use_search"], start["plan"], args.max_workers, start["log_filename"], start["output_dir"], run_id=args.resume, resume=True, file_path=start.get("file_path"))
+        use_search = start["use_search"]
+    else:
+        objective = args.objective or input("Please enter your objective: ")
+        file_content = maestro.load_input_file(args.file) if args.file else None
+        result = await maestro.run_objective(objective, file_content, args.search, args.plan, args.max_workers, output_dir=args.output_dir, file_path=args.file)
+        use_search = args.search
+
+    first_request = time_to_first_request(result["run_id"], started, imported)
+    await maestro.finish_run(result, use_search)
+    if first_request:
+        console.print(first_request)
+
+
+def main(started: float = None) -> None:
+    """
+    Runs the ``maestro`` command.
+
+    Args:
+        started (float, optional): ``time.time()`` when the process started, before its imports, which the time to
+            the first request is measured from. Defaults to now.
+    """
+    started = started or time.time()
+    from providers import preload_providers, provider_names
+
+    providers = provider_names()
+    parser = argparse.ArgumentParser(prog="maestro", description="Break an objective into sub-tasks, run them with sub-agents and refine the results into a final output")
+    parser.add_argument('objective', nargs='?', help='The objective (asked for when not given)')
+    parser.add_argument('--file', help='A text file to work on with the objective')
+    parser.add_argument('--search', action='store_true', help='Let sub-agents search the web')
+    parser.add_argument('--provider', default="anthropic", choices=providers, help='The backend every role runs on, with its default models (defaults to anthropic)')
+    parser.add_argument('--model', action='append', default=[], metavar='ROLE=[PROVIDER:]MODEL',
+                        help=f"Run a role on another model, or on comma-separated models cheapest first (repeatable; ROLE is all or one of {', '.join(ROLE_TIERS)})")
+    parser.add_argument('--plan', action='store_true', help='Plan the whole objective as a dependency graph in one orchestrator call and run independent sub-tasks concurrently')
+    parser.add_argument('--max-workers', type=int, default=config.MAX_WORKERS, help='Maximum number of sub-agents running at once in plan mode')
+    parser.add_argument('--output-dir', default=".", help='Directory the project folder is created in')
+    parser.add_argument('--cache', choices=['on', 'off', 'refresh'], help='Use the on-disk response cache, bypass it, or refresh it with new responses (defaults to MAESTRO_CACHE or on)')
+    parser.add_argument('--resume', metavar='RUN_ID', help='Continue an interrupted run from its journal instead of starting a new one')
+    args = parser.parse_args()
+
+    try:
+        overrides = [parse_model(value, args.provider, providers) for value in args.model]
+    except ValueError as e:
+        parser.error(str(e))
+    routes = resolve_routes(args.provider, overrides)
+    missing = [role for role in ROLE_TIERS if role not in routes]
+    if missing:
+        parser.error(f"{args.provider} has no default models; choose them with --model all=MODEL (missing: {', '.join(missing)})")
+    if not args.objective and not args.resume:
+        # The SDKs load while the objective is typed in; with nothing to wait on, a second importing thread only
+        # competes with the first one for the interpreter
+        preload_providers({name for tiers in routes.values() for name, _ in tiers})
+    if args.cache:
+        from providers import set_cache_mode
+        set_cache_mode(args.cache)
+
+    asyncio.run(run(args, routes, started))
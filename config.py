@@ -7,6 +7,122 @@ load_dotenv()
 # API keys
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+
+# Provider endpoints (override to point maestro at a proxy or a local fake server)
+ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL")
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+
+# Extra provider backends loaded on first use, as comma-separated name=module:factory entries
+PROVIDER_PLUGINS = dict(entry.strip().split("=", 1) for entry in os.getenv("MAESTRO_PROVIDER_PLUGINS", "").split(",") if "=" in entry)
+
+# Seconds to wait on a single provider request before giving up
+REQUEST_TIMEOUT = float(os.getenv("MAESTRO_REQUEST_TIMEOUT", "600"))
+
+# Maximum number of sub-agents running at once in plan mode
+MAX_WORKERS = int(os.getenv("MAESTRO_MAX_WORKERS", "4"))
+
+# Per-role token budgets for the history sent with each call; older results beyond these are summarized
+ORCHESTRATOR_CONTEXT_TOKENS = int(os.getenv("MAESTRO_ORCHESTRATOR_CONTEXT_TOKENS", "16000"))
+SUB_AGENT_CONTEXT_TOKENS = int(os.getenv("MAESTRO_SUB_AGENT_CONTEXT_TOKENS", "16000"))
+# Number of most recent results always kept verbatim
+KEEP_RECENT_RESULTS = int(os.getenv("MAESTRO_KEEP_RECENT_RESULTS", "2"))
+
+# Input files estimated above this many tokens are read chunk by chunk in map-reduce mode instead of pasted into the prompts
+LARGE_FILE_TOKENS = int(os.getenv("MAESTRO_LARGE_FILE_TOKENS", "12000"))
+# Target size of the chunk each sub-agent reads in map-reduce mode
+CHUNK_TOKENS = int(os.getenv("MAESTRO_CHUNK_TOKENS", "6000"))
+# Number of partial results merged by one reduce call
+REDUCE_FAN_IN = int(os.getenv("MAESTRO_REDUCE_FAN_IN", "4"))
+
+# Merge each sub-task result into a running draft while the run goes on, so the final refine only sees the draft ("0" disables)
+INCREMENTAL_REFINE = os.getenv("MAESTRO_INCREMENTAL_REFINE", "1") != "0"
+
+# Retrieval index over the input files: each sub-agent gets the top-k passages of about PASSAGE_TOKENS tokens for its prompt
+RETRIEVAL_TOP_K = int(os.getenv("MAESTRO_RETRIEVAL_TOP_K", "5"))
+PASSAGE_TOKENS = int(os.getenv("MAESTRO_PASSAGE_TOKENS", "400"))
+# Ollama embedding model ranked alongside BM25, e.g. "nomic-embed-text" (empty uses BM25 only)
+EMBED_MODEL = os.getenv("MAESTRO_EMBED_MODEL", "")
+
+# On-disk response cache: "on", "off" (bypass) or "refresh" (ignore cached entries but store new ones)
+RESPONSE_CACHE = os.getenv("MAESTRO_CACHE", "on")
+RESPONSE_CACHE_PATH = os.getenv("MAESTRO_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".maestro_cache.sqlite"))
+# Seconds before a cached response expires (0 keeps entries until evicted for size)
+RESPONSE_CACHE_TTL = float(os.getenv("MAESTRO_CACHE_TTL", str(7 * 24 * 3600)))
+# Maximum size of the cached responses in megabytes, least recently used entries are evicted first
+RESPONSE_CACHE_MAX_MB = int(os.getenv("MAESTRO_CACHE_MAX_MB", "256"))
+
+# Web search backend for sub-agents: "tavily" or "stub" (canned local answers for tests and offline runs)
+SEARCH_BACKEND = os.getenv("MAESTRO_SEARCH_BACKEND", "tavily")
+# Seconds a search answer is reused for the same (or a near-duplicate) query
+SEARCH_CACHE_TTL = float(os.getenv("MAESTRO_SEARCH_CACHE_TTL", "3600"))
+
+# Rate limiting per provider model: request and token limits used until the provider reports its own in
+# response headers (unset means unlimited), the ceiling for the adaptive concurrency limit, and the retry budget
+REQUESTS_PER_MINUTE = float(os.getenv("MAESTRO_REQUESTS_PER_MINUTE", "0")) or None
+TOKENS_PER_MINUTE = float(os.getenv("MAESTRO_TOKENS_PER_MINUTE", "0")) or None
+MAX_CONCURRENCY = int(os.getenv("MAESTRO_MAX_CONCURRENCY", "16"))
+MAX_RETRIES = int(os.getenv("MAESTRO_MAX_RETRIES", "6"))
+# Follow-up calls that continue an answer cut off at the output limit, each prefilled with the answer so far
+MAX_CONTINUATIONS = int(os.getenv("MAESTRO_MAX_CONTINUATIONS", "3"))
+
+# Per-call metrics: JSONL event log and Prometheus textfile (set either to an empty string to disable it)
+METRICS_FILE = os.getenv("MAESTRO_METRICS_FILE", "maestro_metrics.jsonl")
+METRICS_PROMETHEUS_FILE = os.getenv("MAESTRO_METRICS_PROMETHEUS_FILE", "maestro_metrics.prom")
+
+# Orchestration server retention: finished jobs kept in memory (the oldest are evicted beyond this count or once
+# finished longer than the number of seconds), and the most recent events buffered per job for its event stream
+SERVER_MAX_FINISHED_JOBS = int(os.getenv("MAESTRO_SERVER_MAX_FINISHED_JOBS", "100"))
+SERVER_JOB_RETENTION = float(os.getenv("MAESTRO_SERVER_JOB_RETENTION", "3600"))
+SERVER_MAX_JOB_EVENTS = int(os.getenv("MAESTRO_SERVER_MAX_JOB_EVENTS", "1000"))
+
+# Directory holding the run journals used by --resume
+RUN_JOURNAL_DIR = os.getenv("MAESTRO_RUN_DIR", ".maestro_runs")
+
+# SQLite index of past runs, searchable with "python runlog.py search" (empty disables it)
+RUN_INDEX_PATH = os.getenv("MAESTRO_RUN_INDEX", os.path.join(RUN_JOURNAL_DIR, "index.sqlite"))
+# Persistent passage index over the input files, re-indexed only when a file changes
+RETRIEVAL_INDEX_PATH = os.getenv("MAESTRO_RETRIEVAL_INDEX", os.path.join(RUN_JOURNAL_DIR, "retrieval.sqlite"))
+
+# Per-role model cascades, cheapest first, from MAESTRO_ROUTE_<ROLE>="provider:model,provider:model"
+ROUTES = {key[len("MAESTRO_ROUTE_"):].lower(): value for key, value in os.environ.items() if key.startswith("MAESTRO_ROUTE_") and value}
+# Roles without a route of their own that try their provider's cheap model first
+CASCADE_ROLES = set(filter(None, os.getenv("MAESTRO_CASCADE_ROLES", "sub_agent").split(",")))
+
+# Ollama model residency: how long each role's model stays loaded after a call, as an Ollama duration such as
+# "30m" ("-1m" keeps it loaded), overridden with MAESTRO_KEEP_ALIVE_<ROLE>
+OLLAMA_KEEP_ALIVE = {
+    "orchestrator": "30m", "sub_agent": "30m", "refiner": "5m",
+    **{key[len("MAESTRO_KEEP_ALIVE_"):].lower(): value for key, value in os.environ.items() if key.startswith("MAESTRO_KEEP_ALIVE_") and value},
+}
+# Number of different models an Ollama host runs at once; calls for other models queue until one is idle
+OLLAMA_MAX_LOADED_MODELS = int(os.getenv("MAESTRO_OLLAMA_MAX_LOADED_MODELS", "1"))
+# Calls a loaded model may start while calls for other models wait, before it has to yield
+OLLAMA_MODEL_BURST = int(os.getenv("MAESTRO_OLLAMA_MODEL_BURST", "8"))
+# Cache of the models each Ollama host has (empty disables it) and how many seconds it is trusted
+OLLAMA_MODELS_CACHE = os.getenv("MAESTRO_OLLAMA_MODELS_CACHE", os.path.join(RUN_JOURNAL_DIR, "ollama_models.json"))
+OLLAMA_MODELS_TTL = float(os.getenv("MAESTRO_OLLAMA_MODELS_TTL", "86400"))
+# Ollama hosts calls are balanced over, comma-separated (defaults to OLLAMA_HOST alone)
+OLLAMA_HOSTS = list(filter(None, (host.strip() for host in os.getenv("MAESTRO_OLLAMA_HOSTS", "").split(",")))) or [OLLAMA_HOST]
+# Seconds between health probes (/api/ps) of the Ollama hosts, and how long a probe may take
+OLLAMA_PROBE_INTERVAL = float(os.getenv("MAESTRO_OLLAMA_PROBE_INTERVAL", "15"))
+OLLAMA_PROBE_TIMEOUT = float(os.getenv("MAESTRO_OLLAMA_PROBE_TIMEOUT", "2"))
+# Calls in flight a host counts as busier when it would first have to load the requested model
+OLLAMA_LOAD_PENALTY = int(os.getenv("MAESTRO_OLLAMA_LOAD_PENALTY", "2"))
+# Context windows (num_ctx) Ollama calls are rounded up to; the largest is the most a call may use
+OLLAMA_CTX_BUCKETS = sorted(int(size) for size in os.getenv("MAESTRO_OLLAMA_CTX_BUCKETS", "2048,4096,8192").split(",") if size.strip())
+# Most tokens an Ollama call of each role may generate (num_predict), overridden with MAESTRO_NUM_PREDICT_<ROLE>
+OLLAMA_NUM_PREDICT = {
+    "orchestrator": 1024, "sub_agent": 4096, "refiner": 4096,
+    **{key[len("MAESTRO_NUM_PREDICT_"):].lower(): int(value) for key, value in os.environ.items() if key.startswith("MAESTRO_NUM_PREDICT_") and value},
+}
+# The fixed num_ctx the KV-cache savings are measured against, and the KV-cache size of one token of context
+# (128 KiB for llama3 8B at fp16)
+OLLAMA_BASELINE_NUM_CTX = int(os.getenv("MAESTRO_OLLAMA_BASELINE_NUM_CTX", "8192"))
+OLLAMA_KV_BYTES_PER_TOKEN = int(os.getenv("MAESTRO_OLLAMA_KV_BYTES_PER_TOKEN", str(128 * 1024)))
 
 # Other configuration settings
 CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-3-opus-20240229")
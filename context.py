@@ -0,0 +1,79 @@
+"""
+Token-budgeted context compaction for long runs.
+
+Without compaction every orchestrator call resends all previous results and
+every sub-agent call resends all previous tasks, so total input tokens grow
+quadratically with the number of iterations. A ``ContextCompactor`` keeps the
+most recent entries verbatim and folds older ones into a rolling summary
+written by a cheap model whenever the history goes over its token budget.
+"""
+from typing import Awaitable, Callable, Optional
+
+# Rough characters-per-token ratio for English text and code
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens in a piece of text without a tokenizer.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The approximate token count.
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class ContextCompactor:
+    """
+    Keeps one role's history within a token budget using a rolling summary.
+
+    Args:
+        summarize (callable): Coroutine function called as ``summarize(previous_summary, texts, max_tokens)``
+            that returns a new summary covering the previous summary and the given texts.
+        budget_tokens (int): Token budget for the summary plus the verbatim entries.
+        keep_recent (int, optional): Number of most recent entries always kept verbatim. Defaults to 2.
+        to_text (callable, optional): Converts a history entry to text. Defaults to ``str``.
+    """
+
+    def __init__(self, summarize: Callable[[Optional[str], list, int], Awaitable[str]], budget_tokens: int, keep_recent: int = 2, to_text: Callable = str):
+        self.summarize = summarize
+        self.budget_tokens = budget_tokens
+        self.keep_recent = keep_recent
+        self.to_text = to_text
+        self.summary = None
+        self.summarized_count = 0
+        self.last_saved_tokens = 0
+        self.total_saved_tokens = 0
+
+    async def compact(self, entries: list) -> tuple:
+        """
+        Returns the context to send for the given full history.
+
+        Entries already folded into the summary are never re-summarized; new entries are
+        folded only when the history goes over budget, so the summary (and any prompt
+        cache built on it) stays stable between compactions.
+
+        Args:
+            entries (list): The complete history, oldest first.
+
+        Returns:
+            tuple: The rolling summary (or None) and the entries to keep verbatim.
+        """
+        verbatim = entries[self.summarized_count:]
+        if self._tokens(verbatim) > self.budget_tokens and len(verbatim) > self.keep_recent:
+            fold = verbatim[:len(verbatim) - self.keep_recent]
+            self.summary = await self.summarize(self.summary, [self.to_text(entry) for entry in fold], self.budget_tokens // 2)
+            self.summarized_count += len(fold)
+            verbatim = verbatim[len(fold):]
+
+        full_tokens = sum(estimate_tokens(self.to_text(entry)) for entry in entries)
+        self.last_saved_tokens = max(0, full_tokens - self._tokens(verbatim))
+        self.total_saved_tokens += self.last_saved_tokens
+        return self.summary, verbatim
+
+    def _tokens(self, verbatim: list) -> int:
+        summary_tokens = estimate_tokens(self.summary) if self.summary else 0
+        return summary_tokens + sum(estimate_tokens(self.to_text(entry)) for entry in verbatim)
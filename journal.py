@@ -0,0 +1,76 @@
+"""
+Crash-safe run journal.
+
+Each orchestration run appends one JSON record per finished step (orchestrator
+reply, sub-agent result, summary, refined output) to its own journal file.
+Records are written and fsynced in order by a background thread (see
+``appender.py``), so the event loop never waits on the disk; the thread finishes
+writing before the process exits, so after a crash, Ctrl-C or network error the
+journal holds every step that was paid for and ``--resume <run-id>`` can
+continue from the last one. Only a killed process or a power loss can lose the
+last few milliseconds of records. A record cut short by a crash is ignored when
+the journal is read back.
+"""
+import json
+import os
+
+import config
+from appender import get_appender
+
+
+class RunJournal:
+    """
+    The append-only journal of one run.
+
+    Args:
+        run_id (str): The run id, used as the journal's file name.
+        directory (str, optional): Directory holding the journals. Defaults to ``config.RUN_JOURNAL_DIR``.
+    """
+
+    def __init__(self, run_id: str, directory: str = None):
+        self.run_id = run_id
+        self.directory = directory or config.RUN_JOURNAL_DIR
+        self.path = os.path.join(self.directory, f"{run_id}.jsonl")
+        self._appender = get_appender(self.path, fsync=True)
+
+    def exists(self) -> bool:
+        self.flush()
+        return os.path.exists(self.path)
+
+    def append(self, record_type: str, **fields) -> None:
+        """
+        Queues a record to be written and fsynced without blocking.
+
+        Args:
+            record_type (str): The kind of step, stored as ``type``.
+            **fields: The step's data; must be JSON serializable.
+
+        Raises:
+            OSError: If writing an earlier record failed.
+        """
+        self._appender.append(json.dumps({"type": record_type, **fields}) + "\n")
+
+    def flush(self) -> None:
+        """Blocks until every appended record is on disk."""
+        self._appender.flush()
+
+    def records(self) -> list:
+        """
+        Reads every complete record back, oldest first.
+
+        Returns:
+            list: The records.
+
+        Raises:
+            FileNotFoundError: If the run has no journal.
+        """
+        self.flush()
+        records = []
+        with open(self.path, 'r') as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # The last record of a run that crashed mid-write
+                    break
+        return records
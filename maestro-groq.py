@@ -1,16 +1,14 @@
-import os
 import re
+import asyncio
 from rich.console import Console
 from rich.panel import Panel
 from datetime import datetime
-import json
-
-# Set up the Groq API client
-from groq import Groq
-from tavily import TavilyClient
-
-client = Groq(api_key="YOUR API KEY")
-tavily_client = TavilyClient(api_key="YOUR TAVILY API KEY")
+from utils import create_folder_structure
+from providers import get_provider, close_providers
+from runlog import ExchangeLog
+from streaming import stream_completion
+from structured import REFINER_SCHEMA, orchestrator_schema, parse_orchestrator, parse_refined, render_refined
+from metrics import get_recorder
 
 # Define the models to use for each agent
 ORCHESTRATOR_MODEL = "mixtral-8x7b-32768"
@@ -20,235 +18,158 @@ REFINER_MODEL = "llama3-70b-8192"
 # Initialize the Rich Console
 console = Console()
 
-def calculate_subagent_cost(model, input_tokens, output_tokens):
-    # Pricing information per model
-    pricing = {
-        "mixtral-8x7b-32768": {"input_cost_per_mtok": 15.00, "output_cost_per_mtok": 75.00},
-        "llama3-70b-8192": {"input_cost_per_mtok": 0.25, "output_cost_per_mtok": 1.25},
-    }
-
-    # Calculate cost
-    input_cost = (input_tokens / 1_000_000) * pricing[model]["input_cost_per_mtok"]
-    output_cost = (output_tokens / 1_000_000) * pricing[model]["output_cost_per_mtok"]
-    total_cost = input_cost + output_cost
-
-    return total_cost
-
-def opus_orchestrator(objective, file_content=None, previous_results=None, use_search=False):
+async def opus_orchestrator(objective, file_content=None, previous_results=None, exchange_log=None):
     console.print(f"\n[bold]Calling Orchestrator for your objective[/bold]")
     previous_results_text = "\n".join(previous_results) if previous_results else "None"
     if file_content:
         console.print(Panel(f"File content:\n{file_content}", title="[bold blue]File Content[/bold blue]", title_align="left", border_style="blue"))
     messages = [
-        {
-            "role": "system",
-            "content": "You are an AI orchestrator that breaks down objectives into sub-tasks."
-        },
         {
             "role": "user",
-            "content": f"Based on the following objective{' and file content' if file_content else ''}, and the previous sub-task results (if any), please break down the objective into the next sub-task, and create a concise and detailed prompt for a subagent so it can execute that task. IMPORTANT!!! when dealing with code tasks make sure you check the code for errors and provide fixes and support as part of the next sub-task. If you find any bugs or have suggestions for better code, please include them in the next sub-task prompt. Please assess if the objective has been fully achieved. If the previous sub-task results comprehensively address all aspects of the objective, include the phrase 'The task is complete:' at the beginning of your response. If the objective is not yet fully achieved, break it down into the next sub-task and create a concise and detailed prompt for a subagent to execute that task.:\n\nObjective: {objective}" + ('\\nFile content:\\n' + file_content if file_content else '') + f"\n\nPrevious sub-task results:\n{previous_results_text}"
+            "content": f"Based on the following objective{' and file content' if file_content else ''}, and the previous sub-task results (if any), please break down the objective into the next sub-task, and create a concise and detailed prompt for a subagent so it can execute that task. IMPORTANT!!! when dealing with code tasks make sure you check the code for errors and provide fixes and support as part of the next sub-task. If you find any bugs or have suggestions for better code, please include them in the next sub-task prompt. Please assess if the objective has been fully achieved. If the previous sub-task results comprehensively address all aspects of the objective, set the status to 'complete'. If the objective is not yet fully achieved, set the status to 'continue', break it down into the next sub-task and create a concise and detailed prompt for a subagent to execute that task.:\n\nObjective: {objective}" + ('\\nFile content:\\n' + file_content if file_content else '') + f"\n\nPrevious sub-task results:\n{previous_results_text}"
         }
     ]
 
-    opus_response = client.chat.completions.create(
+    opus_response = await stream_completion(
+        get_provider("groq"), console, "[bold green]Groq Orchestrator[/bold green]", exchange_log,
+        role="orchestrator",
+        schema=orchestrator_schema(),
         model=ORCHESTRATOR_MODEL,
         messages=messages,
+        system="You are an AI orchestrator that breaks down objectives into sub-tasks.",
         max_tokens=8000
     )
 
-    response_text = opus_response.choices[0].message.content
-    console.print(Panel(response_text, title=f"[bold green]Groq Orchestrator[/bold green]", title_align="left", border_style="green", subtitle="Sending task to Subagent Ã°ÂÂÂ"))
-    return response_text, file_content
+    response_text = opus_response.text
+    step = parse_orchestrator(response_text)
+    if exchange_log:
+        exchange_log.event("step", **step)
+    return step, file_content
 
-def haiku_sub_agent(prompt, previous_haiku_tasks=None, continuation=False):
+async def haiku_sub_agent(prompt, previous_haiku_tasks=None, exchange_log=None, log_heading=None):
     if previous_haiku_tasks is None:
         previous_haiku_tasks = []
 
-    continuation_prompt = "Continuing from the previous answer, please complete the response."
     system_message = "Previous Haiku tasks:\n" + "\n".join(f"Task: {task['task']}\nResult: {task['result']}" for task in previous_haiku_tasks)
-    if continuation:
-        prompt = continuation_prompt
 
     messages = [
-        {
-            "role": "system",
-            "content": system_message
-        },
         {
             "role": "user",
             "content": prompt
         }
     ]
 
-    haiku_response = client.chat.completions.create(
+    haiku_response = await stream_completion(
+        get_provider("groq"), console, "[bold blue]Groq Sub-agent Result[/bold blue]", exchange_log, log_heading,
+        role="sub_agent",
         model=SUB_AGENT_MODEL,
         messages=messages,
+        system=system_message,
         max_tokens=8000
     )
 
-    response_text = haiku_response.choices[0].message.content
-    console.print(Panel(response_text, title="[bold blue]Groq Sub-agent Result[/bold blue]", title_align="left", border_style="blue", subtitle="Task completed, sending result to Orchestrator Ã°ÂÂÂ"))
+    response_text = haiku_response.text
     return response_text
 
-def opus_refine(objective, sub_task_results, filename, projectname, continuation=False):
+async def opus_refine(objective, sub_task_results, filename, projectname, exchange_log=None):
     console.print("\nCalling Opus to provide the refined final output for your objective:")
     messages = [
-        {
-            "role": "system",
-            "content": "You are an AI assistant that refines sub-task results into a cohesive final output."
-        },
         {
             "role": "user",
-            "content": "Objective: " + objective + "\n\nSub-task results:\n" + "\n".join(sub_task_results) + "\n\nPlease review and refine the sub-task results into a cohesive final output. Add any missing information or details as needed. Make sure the code files are completed. When working on code projects, ONLY AND ONLY IF THE PROJECT IS CLEARLY A CODING ONE please provide the following:\n1. Project Name: Create a concise and appropriate project name that fits the project based on what it's creating. The project name should be no more than 20 characters long.\n2. Folder Structure: Provide the folder structure as a valid JSON object, where each key represents a folder or file, and nested keys represent subfolders. Use null values for files. Ensure the JSON is properly formatted without any syntax errors. Please make sure all keys are enclosed in double quotes, and ensure objects are correctly encapsulated with braces, separating items with commas as necessary.\nWrap the JSON object in <folder_structure> tags.\n3. Code Files: For each code file, include ONLY the file name in this format 'Filename: <filename>' NEVER EVER USE THE FILE PATH OR ANY OTHER FORMATTING YOU ONLY USE THE FOLLOWING format 'Filename: <filename>' followed by the code block enclosed in triple backticks, with the language identifier after the opening backticks, like this:\n\nÃ¢ÂÂpython\n<code>\nÃ¢ÂÂ"
+            "content": "Objective: " + objective + "\n\nSub-task results:\n" + "\n".join(sub_task_results) + "\n\nPlease review and refine the sub-task results into a cohesive final output. Add any missing information or details as needed. Make sure the code files are completed. When working on code projects, ONLY AND ONLY IF THE PROJECT IS CLEARLY A CODING ONE please also provide:\n1. Project Name: a concise and appropriate project name that fits the project based on what it's creating, no more than 20 characters long.\n2. Folder Structure: the folder structure, where each key represents a folder or file, and nested keys represent subfolders. Use null values for files.\n3. Code Files: every code file in full, each named by its path in the folder structure. Keep the code out of the final output text."
         }
     ]
 
-    opus_response = client.chat.completions.create(
+    opus_response = await stream_completion(
+        get_provider("groq"), console, "[bold green]Final Output[/bold green]", exchange_log,
+        role="refiner",
+        schema=REFINER_SCHEMA,
         model=REFINER_MODEL,
         messages=messages,
+        system="You are an AI assistant that refines sub-task results into a cohesive final output.",
         max_tokens=8000
     )
 
-    response_text = opus_response.choices[0].message.content
-    console.print(Panel(response_text, title="[bold green]Final Output[/bold green]", title_align="left", border_style="green"))
-    return response_text
+    return parse_refined(opus_response.text.strip())
+
+async def main():
+    # Get the objective from user input
+    objective = input("Please enter your objective with or without a text file path: ")
+
+    # Check if the input contains a file path
+    if "./" in objective or "/" in objective:
+        # Extract the file path from the objective
+        file_path = re.findall(r'[./\w]+\.[\w]+', objective)[0]
+        # Read the file content
+        with open(file_path, 'r') as file:
+            file_content = file.read()
+        # Update the objective string to remove the file path
+        objective = objective.split(file_path)[0].strip()
+    else:
+        file_content = None
+
+    # Create the .md filename
+    sanitized_objective = re.sub(r'\W+', '_', objective)
+    timestamp = datetime.now().strftime("%H-%M-%S")
+
+    # Truncate the sanitized_objective to a maximum of 50 characters
+    max_length = 25
+    truncated_objective = sanitized_objective[:max_length] if len(sanitized_objective) > max_length else sanitized_objective
+
+    # The exchange log is written while the run progresses, so it is on disk before the run ends
+    filename = f"{timestamp}_{truncated_objective}.md"
+    exchange_log = ExchangeLog(filename, objective)
 
-def create_folder_structure(project_name, folder_structure, code_blocks):
-    # Create the project folder
-    try:
-        os.makedirs(project_name, exist_ok=True)
-        console.print(Panel(f"Created project folder: [bold]{project_name}[/bold]", title="[bold green]Project Folder[/bold green]", title_align="left", border_style="green"))
-    except OSError as e:
-        console.print(Panel(f"Error creating project folder: [bold]{project_name}[/bold]\nError: {e}", title="[bold red]Project Folder Creation Error[/bold red]", title_align="left", border_style="red"))
-        return
-
-    # Recursively create the folder structure and files
-    create_folders_and_files(project_name, folder_structure, code_blocks)
-
-def create_folders_and_files(current_path, structure, code_blocks):
-    for key, value in structure.items():
-        path = os.path.join(current_path, key)
-        if isinstance(value, dict):
-            try:
-                os.makedirs(path, exist_ok=True)
-                console.print(Panel(f"Created folder: [bold]{path}[/bold]", title="[bold blue]Folder Creation[/bold blue]", title_align="left", border_style="blue"))
-                create_folders_and_files(path, value, code_blocks)
-            except OSError as e:
-                console.print(Panel(f"Error creating folder: [bold]{path}[/bold]\nError: {e}", title="[bold red]Folder Creation Error[/bold red]", title_align="left", border_style="red"))
+    task_exchanges = []
+    haiku_tasks = []
+
+    while True:
+        # Call Orchestrator to break down the objective into the next sub-task or provide the final output
+        previous_results = [result for _, result in task_exchanges]
+        if not task_exchanges:
+            # Pass the file content only in the first iteration if available
+            step, file_content_for_haiku = await opus_orchestrator(objective, file_content, previous_results, exchange_log=exchange_log)
         else:
-            code_content = next((code for file, code in code_blocks if file == key), None)
-            if code_content:
-                try:
-                    with open(path, 'w') as file:
-                        file.write(code_content)
-                    console.print(Panel(f"Created file: [bold]{path}[/bold]", title="[bold green]File Creation[/bold green]", title_align="left", border_style="green"))
-                except IOError as e:
-                    console.print(Panel(f"Error creating file: [bold]{path}[/bold]\nError: {e}", title="[bold red]File Creation Error[/bold red]", title_align="left", border_style="red"))
-            else:
-                console.print(Panel(f"Code content not found for file: [bold]{key}[/bold]", title="[bold yellow]Missing Code Content[/bold yellow]", title_align="left", border_style="yellow"))
-
-def read_file(file_path):
-    with open(file_path, 'r') as file:
-        content = file.read()
-    return content
-
-def search_query(query):
-    response = tavily_client.search(query)
-    return response
-
-# Get the objective from user input
-objective = input("Please enter your objective with or without a text file path: ")
-
-# Check if the input contains a file path
-if "./" in objective or "/" in objective:
-    # Extract the file path from the objective
-    file_path = re.findall(r'[./\w]+\.[\w]+', objective)[0]
-    # Read the file content
-    with open(file_path, 'r') as file:
-        file_content = file.read()
-    # Update the objective string to remove the file path
-    objective = objective.split(file_path)[0].strip()
-else:
-    file_content = None
-
-task_exchanges = []
-haiku_tasks = []
-
-while True:
-    # Call Orchestrator to break down the objective into the next sub-task or provide the final output
-    previous_results = [result for _, result in task_exchanges]
-    if not task_exchanges:
-        # Pass the file content only in the first iteration if available
-        opus_result, file_content_for_haiku = opus_orchestrator(objective, file_content, previous_results)
-    else:
-        opus_result, _ = opus_orchestrator(objective, previous_results=previous_results)
+            step, _ = await opus_orchestrator(objective, previous_results=previous_results, exchange_log=exchange_log)
 
-    if "The task is complete:" in opus_result:
-        # If Opus indicates the task is complete, exit the loop
-        final_output = opus_result.replace("The task is complete:", "").strip()
-        break
-    else:
-        sub_task_prompt = opus_result
-        # Append file content to the prompt for the initial call to haiku_sub_agent, if applicable
-        if file_content_for_haiku and not haiku_tasks:
-            sub_task_prompt = f"{sub_task_prompt}\n\nFile content:\n{file_content_for_haiku}"
-        # Call haiku_sub_agent with the prepared prompt and record the result
-        sub_task_result = haiku_sub_agent(sub_task_prompt, haiku_tasks)
-        # Log the task and its result for future reference
-        haiku_tasks.append({"task": sub_task_prompt, "result": sub_task_result})
-        # Record the exchange for processing and output generation
-        task_exchanges.append((sub_task_prompt, sub_task_result))
-        # Prevent file content from being included in future haiku_sub_agent calls
-        file_content_for_haiku = None
-
-# Create the .md filename
-sanitized_objective = re.sub(r'\W+', '_', objective)
-timestamp = datetime.now().strftime("%H-%M-%S")
-
-# Call Opus to review and refine the sub-task results
-refined_output = opus_refine(objective, [result for _, result in task_exchanges], timestamp, sanitized_objective)
-
-# Extract the project name from the refined output
-project_name_match = re.search(r'Project Name: (.*)', refined_output)
-project_name = project_name_match.group(1).strip() if project_name_match else sanitized_objective
-
-# Extract the folder structure from the refined output
-folder_structure_match = re.search(r'<folder_structure>(.*?)</folder_structure>', refined_output, re.DOTALL)
-folder_structure = {}
-if folder_structure_match:
-    json_string = folder_structure_match.group(1).strip()
-    try:
-        folder_structure = json.loads(json_string)
-    except json.JSONDecodeError as e:
-        console.print(Panel(f"Error parsing JSON: {e}", title="[bold red]JSON Parsing Error[/bold red]", title_align="left", border_style="red"))
-        console.print(Panel(f"Invalid JSON string: [bold]{json_string}[/bold]", title="[bold red]Invalid JSON String[/bold red]", title_align="left", border_style="red"))
-
-# Extract code files from the refined output
-code_blocks = re.findall(r'Filename: (\S+)\s*```[\w]*\n(.*?)\n```', refined_output, re.DOTALL)
-
-# Create the folder structure and code files
-create_folder_structure(project_name, folder_structure, code_blocks)
-
-# Truncate the sanitized_objective to a maximum of 50 characters
-max_length = 25
-truncated_objective = sanitized_objective[:max_length] if len(sanitized_objective) > max_length else sanitized_objective
-
-# Update the filename to include the project name
-filename = f"{timestamp}_{truncated_objective}.md"
-
-# Prepare the full exchange log
-exchange_log = f"Objective: {objective}\n\n"
-exchange_log += "=" * 40 + " Task Breakdown " + "=" * 40 + "\n\n"
-for i, (prompt, result) in enumerate(task_exchanges, start=1):
-    exchange_log += f"Task {i}:\n"
-    exchange_log += f"Prompt: {prompt}\n"
-    exchange_log += f"Result: {result}\n\n"
-
-exchange_log += "=" * 40 + " Refined Final Output " + "=" * 40 + "\n\n"
-exchange_log += refined_output
-
-console.print(f"\n[bold]Refined Final output:[/bold]\n{refined_output}")
-
-with open(filename, 'w') as file:
-    file.write(exchange_log)
-print(f"\nFull exchange log saved to {filename}")
+        if step["complete"]:
+            # If Opus indicates the task is complete, exit the loop
+            break
+        else:
+            sub_task_prompt = step["prompt"]
+            # Append file content to the prompt for the initial call to haiku_sub_agent, if applicable
+            if file_content_for_haiku and not haiku_tasks:
+                sub_task_prompt = f"{sub_task_prompt}\n\nFile content:\n{file_content_for_haiku}"
+            # Call haiku_sub_agent with the prepared prompt and record the result
+            sub_task_result = await haiku_sub_agent(sub_task_prompt, haiku_tasks, exchange_log=exchange_log, log_heading=f"Task {len(task_exchanges) + 1}:\nPrompt: {sub_task_prompt}\nResult: ")
+            # Log the task and its result for future reference
+            haiku_tasks.append({"task": sub_task_prompt, "result": sub_task_result})
+            # Record the exchange for processing and output generation
+            task_exchanges.append((sub_task_prompt, sub_task_result))
+            # Prevent file content from being included in future haiku_sub_agent calls
+            file_content_for_haiku = None
+
+    # Call Opus to review and refine the sub-task results
+    exchange_log.section("Refined Final Output")
+    project = await opus_refine(objective, [result for _, result in task_exchanges], timestamp, sanitized_objective, exchange_log=exchange_log)
+    # Rendered as readable text for the console and the log
+    refined_output = render_refined(project)
+    exchange_log.event("refined", text=refined_output)
+
+    if project["error"]:
+        console.print(Panel(f"Error parsing JSON: {project['error']}", title="[bold red]JSON Parsing Error[/bold red]", title_align="left", border_style="red"))
+
+    # Create the folder structure and code files
+    create_folder_structure(project["project_name"] or sanitized_objective, project["folder_structure"], project["files"])
+
+    console.print(f"\n[bold]Refined Final output:[/bold]\n{refined_output}")
+
+    exchange_log.close()
+    print(f"\nFull exchange log saved to {filename}")
+
+    console.print(Panel(get_recorder().format_summary(), title="[bold]Calls per role[/bold]", title_align="left", border_style="white"))
+    get_recorder().export()
+    await close_providers()
+
+if __name__ == "__main__":
+    asyncio.run(main())
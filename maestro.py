@@ -1,14 +1,26 @@
 import os
-from anthropic import Anthropic
 import re
+import asyncio
+import argparse
 from rich.console import Console
 from rich.panel import Panel
 from datetime import datetime
-import json
-from tavily import TavilyClient
-
-# Set up the Anthropic API client
-client = Anthropic(api_key="YOUR API KEY")
+import uuid
+from config import MAX_WORKERS, ORCHESTRATOR_CONTEXT_TOKENS, SUB_AGENT_CONTEXT_TOKENS, KEEP_RECENT_RESULTS, LARGE_FILE_TOKENS, CHUNK_TOKENS, REDUCE_FAN_IN, RETRIEVAL_TOP_K, INCREMENTAL_REFINE
+from utils import read_file, create_folder_structure
+from providers import get_provider, close_providers, text_block, set_cache_mode
+from planner import parse_plan, run_plan
+from runlog import ExchangeLog
+from streaming import stream_completion
+from context import ContextCompactor
+from chunking import estimate_file_tokens, iter_chunks, mapped_file, read_chunk
+from retrieval import format_passages, get_retrieval_index
+from refinement import IncrementalRefiner
+from search import get_search_service
+from journal import RunJournal
+from structured import REFINER_SCHEMA, orchestrator_schema, plan_schema, parse_orchestrator, parse_refined, render_refined
+from metrics import calculate_cost, get_recorder, metric_labels
+from routing import route_for
 
 # Available Claude models:
 # Claude 3 Opus	    claude-3-opus-20240229
@@ -18,28 +30,19 @@ client = Anthropic(api_key="YOUR API KEY")
 ORCHESTRATOR_MODEL = "claude-3-opus-20240229"
 SUB_AGENT_MODEL = "claude-3-sonnet-20240229"
 REFINER_MODEL = "claude-3-opus-20240229"
-
-def calculate_subagent_cost(model, input_tokens, output_tokens):
-    # Pricing information per model
-    pricing = {
-        "claude-3-opus-20240229": {"input_cost_per_mtok": 15.00, "output_cost_per_mtok": 75.00},
-        "claude-3-haiku-20240307": {"input_cost_per_mtok": 0.25, "output_cost_per_mtok": 1.25},
-        "claude-3-sonnet-20240229": {"input_cost_per_mtok": 3.00, "output_cost_per_mtok": 15.00},
-    }
-
-    # Calculate cost
-    input_cost = (input_tokens / 1_000_000) * pricing[model]["input_cost_per_mtok"]
-    output_cost = (output_tokens / 1_000_000) * pricing[model]["output_cost_per_mtok"]
-    total_cost = input_cost + output_cost
-
-    return total_costt
+# Cheap model used to summarize old results when the context goes over budget
+SUMMARY_MODEL = "claude-3-haiku-20240307"
 
 # Initialize the Rich Console
 console = Console()
 
-def opus_orchestrator(objective, file_content=None, previous_results=None, use_search=False):
+def print_usage(response, label):
+    console.print(f"Input Tokens: {response.input_tokens}, Output Tokens: {response.output_tokens}, Cache Write Tokens: {response.cache_creation_input_tokens}, Cache Read Tokens: {response.cache_read_input_tokens}")
+    total_cost = calculate_cost(response.model, response.input_tokens, response.output_tokens, response.cache_creation_input_tokens, response.cache_read_input_tokens)
+    console.print(f"{label} Cost: ${total_cost:.4f}" + (" (served from the response cache, not charged)" if response.cached else ""))
+
+async def opus_orchestrator(objective, file_content=None, previous_results=None, use_search=False, exchange_log=None):
     console.print(f"\n[bold]Calling Orchestrator for your objective[/bold]")
-    previous_results_text = "\n".join(previous_results) if previous_results else "None"
     if file_content:
         console.print(Panel(f"File content:\n{file_content}", title="[bold blue]File Content[/bold blue]", title_align="left", border_style="blue"))
     
@@ -47,59 +50,122 @@ def opus_orchestrator(objective, file_content=None, previous_results=None, use_s
         {
             "role": "user",
             "content": [
-                {"type": "text", "text": f"Based on the following objective{' and file content' if file_content else ''}, and the previous sub-task results (if any), please break down the objective into the next sub-task, and create a concise and detailed prompt for a subagent so it can execute that task. IMPORTANT!!! when dealing with code tasks make sure you check the code for errors and provide fixes and support as part of the next sub-task. If you find any bugs or have suggestions for better code, please include them in the next sub-task prompt. Please assess if the objective has been fully achieved. If the previous sub-task results comprehensively address all aspects of the objective, include the phrase 'The task is complete:' at the beginning of your response. If the objective is not yet fully achieved, break it down into the next sub-task and create a concise and detailed prompt for a subagent to execute that task.:\n\nObjective: {objective}" + ('\\nFile content:\\n' + file_content if file_content else '') + f"\n\nPrevious sub-task results:\n{previous_results_text}"}
+                text_block(f"Based on the following objective{' and file content' if file_content else ''}, and the previous sub-task results (if any), please break down the objective into the next sub-task, and create a concise and detailed prompt for a subagent so it can execute that task. IMPORTANT!!! when dealing with code tasks make sure you check the code for errors and provide fixes and support as part of the next sub-task. If you find any bugs or have suggestions for better code, please include them in the next sub-task prompt. Please assess if the objective has been fully achieved. If the previous sub-task results comprehensively address all aspects of the objective, set the status to 'complete'. If the objective is not yet fully achieved, set the status to 'continue', break it down into the next sub-task and create a concise and detailed prompt for a subagent to execute that task.{' Also give a search query for the next sub-task.' if use_search else ''}\n\nObjective: {objective}" + ('\\nFile content:\\n' + file_content if file_content else ''), cache=True),
+                text_block("\n\nPrevious sub-task results:\n" + ("" if previous_results else "None"))
+            ]
+        }
+    ]
+    # One block per result, so each iteration re-reads the history cached by the previous one
+    if previous_results:
+        messages[0]["content"].extend(text_block(result + "\n", cache=index == len(previous_results) - 1) for index, result in enumerate(previous_results))
+
+    # The step comes back as a small JSON object, so completion and the search query never depend on parsing prose
+    opus_response = await stream_completion(
+        get_provider("anthropic"), console, "[bold green]Opus Orchestrator[/bold green]", exchange_log,
+        role="orchestrator",
+        model=ORCHESTRATOR_MODEL,
+        max_tokens=4096,
+        messages=messages,
+        schema=orchestrator_schema(use_search)
+    )
+    print_usage(opus_response, "Orchestrator")
+
+    step = parse_orchestrator(opus_response.text)
+    if use_search and step["search_query"]:
+        console.print(Panel(f"Search Query: {step['search_query']}", title="[bold blue]Search Query[/bold blue]", title_align="left", border_style="blue"))
+        # Start the lookup now so it runs while the sub-agent call is being prepared
+        get_search_service().prefetch(step["search_query"])
+    elif not use_search:
+        step["search_query"] = None
+    if exchange_log:
+        exchange_log.event("step", **step)
+
+    return step, file_content
+
+
+async def opus_plan(objective, file_content=None, use_search=False, exchange_log=None):
+    console.print(f"\n[bold]Calling Orchestrator to plan your objective[/bold]")
+    if file_content:
+        console.print(Panel(f"File content:\n{file_content}", title="[bold blue]File Content[/bold blue]", title_align="left", border_style="blue"))
+
+    search_instructions = " Give each sub-task a specific search query that, when asked online, would yield important information for solving it." if use_search else ""
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": f"Based on the following objective{' and file content' if file_content else ''}, please break down the whole objective into sub-tasks, and create a concise and detailed prompt for a subagent to execute each one. IMPORTANT!!! when dealing with code tasks make sure you include sub-tasks that check the code for errors and provide fixes. Sub-tasks that do not need each other's output will run at the same time, so only list a dependency when a sub-task really needs the result of another one; a sub-task only sees the results of the sub-tasks it depends on.{search_instructions}\n\nObjective: {objective}" + ('\nFile content:\n' + file_content if file_content else '')}
             ]
         }
     ]
-    if use_search:
-        messages[0]["content"].append({"type": "text", "text": "Please also generate a JSON object containing a single 'search_query' key, which represents a question that, when asked online, would yield important information for solving the subtask. The question should be specific and targeted to elicit the most relevant and helpful resources. Format your JSON like this, with no additional text before or after:\n{\"search_query\": \"<question>\"}\n"})
 
-    opus_response = client.messages.create(
+    opus_response = await stream_completion(
+        get_provider("anthropic"), console, "[bold green]Opus Plan[/bold green]", exchange_log,
+        role="planner",
+        schema=plan_schema(use_search),
         model=ORCHESTRATOR_MODEL,
         max_tokens=4096,
         messages=messages
     )
 
-    response_text = opus_response.content[0].text
-    console.print(f"Input Tokens: {opus_response.usage.input_tokens}, Output Tokens: {opus_response.usage.output_tokens}")
-    total_cost = calculate_subagent_cost(ORCHESTRATOR_MODEL, opus_response.usage.input_tokens, opus_response.usage.output_tokens)
-    console.print(f"Orchestrator Cost: ${total_cost:.4f}")
+    response_text = opus_response.text
+    print_usage(opus_response, "Orchestrator")
 
-    search_query = None
+    tasks = parse_plan(response_text)
+    if exchange_log:
+        exchange_log.event("plan", tasks=tasks)
     if use_search:
-        # Extract the JSON from the response
-        json_match = re.search(r'{.*}', response_text, re.DOTALL)
-        if json_match:
-            json_string = json_match.group()
-            try:
-                search_query = json.loads(json_string)["search_query"]
-                console.print(Panel(f"Search Query: {search_query}", title="[bold blue]Search Query[/bold blue]", title_align="left", border_style="blue"))
-                response_text = response_text.replace(json_string, "").strip()
-            except json.JSONDecodeError as e:
-                console.print(Panel(f"Error parsing JSON: {e}", title="[bold red]JSON Parsing Error[/bold red]", title_align="left", border_style="red"))
-                console.print(Panel(f"Skipping search query extraction.", title="[bold yellow]Search Query Extraction Skipped[/bold yellow]", title_align="left", border_style="yellow"))
-        else:
-            search_query = None
-
-    console.print(Panel(response_text, title=f"[bold green]Opus Orchestrator[/bold green]", title_align="left", border_style="green", subtitle="Sending task to Haiku ð"))
-    return response_text, file_content, search_query
-
-
-def haiku_sub_agent(prompt, search_query=None, previous_haiku_tasks=None, use_search=False, continuation=False):
+        # Look up every task's query up front, so searches for later tasks run while earlier ones execute
+        for task in tasks:
+            if task["search_query"]:
+                get_search_service().prefetch(task["search_query"])
+    plan_summary = "\n".join(f"Task {task['id']}: depends on {', '.join(task['depends_on']) or 'nothing'}" for task in tasks)
+    console.print(Panel(plan_summary, title=f"[bold green]Opus Plan ({len(tasks)} sub-tasks)[/bold green]", title_align="left", border_style="green", subtitle="Sending tasks to Haiku 👇"))
+    return tasks
+
+async def execute_plan(tasks, file_content=None, use_search=False, max_workers=4, exchange_log=None, journal=None, finished=None, retrieve=None, refiner=None):
+    tasks_by_id = {task["id"]: task for task in tasks}
+    finished = finished or {}
+
+    async def execute(task, dependency_results):
+        # Tasks completed before a resume are not run again
+        if task["id"] in finished:
+            if refiner:
+                refiner.add(f"plan-{task['id']}", finished[task["id"]][1])
+            return finished[task["id"]]
+        sub_task_prompt = task["prompt"]
+        agent_prompt = sub_task_prompt
+        if retrieve:
+            # Every task gets the passages of the input files most relevant to it
+            agent_prompt = await retrieve(sub_task_prompt)
+        elif file_content and not task["depends_on"]:
+            # Tasks without dependencies start from the source material, the rest build on their dependencies
+            sub_task_prompt = agent_prompt = f"{sub_task_prompt}\n\nFile content:\n{file_content}"
+        dependency_tasks = [{"task": tasks_by_id[dependency]["prompt"], "result": result} for dependency, (_, result) in dependency_results.items()]
+        # Sub-agents run side by side, so each result is shown and logged once it is complete
+        sub_task_result = await haiku_sub_agent(agent_prompt, task["search_query"], dependency_tasks, use_search, stream=False)
+        if exchange_log:
+            exchange_log.event("task", id=task["id"], prompt=sub_task_prompt, result=sub_task_result)
+        if journal:
+            journal.append("plan_task", id=task["id"], prompt=sub_task_prompt, result=sub_task_result)
+        if refiner:
+            # Merged into the draft while the remaining tasks run
+            refiner.add(f"plan-{task['id']}", sub_task_result)
+        return sub_task_prompt, sub_task_result
+
+    results = await run_plan(tasks, execute, max_workers)
+    return [results[task["id"]] for task in tasks]
+
+async def haiku_sub_agent(prompt, search_query=None, previous_haiku_tasks=None, use_search=False, exchange_log=None, log_heading=None, stream=True):
     if previous_haiku_tasks is None:
         previous_haiku_tasks = []
 
-    continuation_prompt = "Continuing from the previous answer, please complete the response."
-    system_message = "Previous Haiku tasks:\n" + "\n".join(f"Task: {task['task']}\nResult: {task['result']}" for task in previous_haiku_tasks)
-    if continuation:
-        prompt = continuation_prompt
-
+    # One block per previous task with a cache breakpoint on the last, so the growing history is only paid for once
+    system_message = [text_block("Previous Haiku tasks:\n", cache=not previous_haiku_tasks)]
+    system_message += [text_block(f"Task: {task['task']}\nResult: {task['result']}\n", cache=index == len(previous_haiku_tasks) - 1) for index, task in enumerate(previous_haiku_tasks)]
     qna_response = None
     if search_query and use_search:
-        # Initialize the Tavily client
-        tavily = TavilyClient(api_key="YOUR API KEY HERE")
-        # Perform a QnA search based on the search query
-        qna_response = tavily.qna_search(query=search_query)
+        # Reuses the prefetched (or a cached) lookup for this query when there is one
+        qna_response = await get_search_service().search(search_query)
         console.print(f"QnA response: {qna_response}", style="yellow")
 
     # Prepare the messages array with only the prompt initially
@@ -114,191 +180,460 @@ def haiku_sub_agent(prompt, search_query=None, previous_haiku_tasks=None, use_se
     if qna_response:
         messages[0]["content"].append({"type": "text", "text": f"\nSearch Results:\n{qna_response}"})
 
-    haiku_response = client.messages.create(
+    haiku_response = await stream_completion(
+        get_provider("anthropic"), console, "[bold blue]Haiku Sub-agent Result[/bold blue]", exchange_log if stream else None, log_heading, echo=stream,
+        role="sub_agent",
         model=SUB_AGENT_MODEL,
         max_tokens=4096,
         messages=messages,
         system=system_message
     )
 
-    response_text = haiku_response.content[0].text
-    console.print(f"Input Tokens: {haiku_response.usage.input_tokens}, Output Tokens: {haiku_response.usage.output_tokens}")
-    total_cost = calculate_subagent_cost(SUB_AGENT_MODEL, haiku_response.usage.input_tokens, haiku_response.usage.output_tokens)
-    console.print(f"Sub-agent Cost: ${total_cost:.4f}")
+    response_text = haiku_response.text
+    print_usage(haiku_response, "Sub-agent")
 
-    if haiku_response.usage.output_tokens >= 4000:  # Threshold set to 4000 as a precaution
-        console.print("[bold yellow]Warning:[/bold yellow] Output may be truncated. Attempting to continue the response.")
-        continuation_response_text = haiku_sub_agent(prompt, search_query, previous_haiku_tasks, use_search, continuation=True)
-        response_text += continuation_response_text
-
-    console.print(Panel(response_text, title="[bold blue]Haiku Sub-agent Result[/bold blue]", title_align="left", border_style="blue", subtitle="Task completed, sending result to Opus ð"))
+    if not stream:
+        console.print(Panel(response_text, title="[bold blue]Haiku Sub-agent Result[/bold blue]", title_align="left", border_style="blue", subtitle="Task completed, sending result to Opus ð"))
     return response_text
 
-def opus_refine(objective, sub_task_results, filename, projectname, continuation=False):
-    print("\nCalling Opus to provide the refined final output for your objective:")
+async def haiku_summarize(previous_summary, texts, max_tokens):
+    console.print(f"\n[bold]Summarizing {len(texts)} earlier result(s) to stay within the context budget[/bold]")
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": ("Existing summary:\n" + previous_summary + "\n\n" if previous_summary else "") + "New results:\n" + "\n\n".join(texts) + f"\n\nPlease write a single concise summary that merges the existing summary (if any) with the new results. Keep every decision, fact, file name and piece of code that later sub-tasks may still need, drop repetition and filler, and stay under {max_tokens} tokens."}
+            ]
+        }
+    ]
+
+    provider_name, model = route_for("summarizer", "anthropic", SUMMARY_MODEL)[-1]
+    with metric_labels(role="summarizer"):
+        summary_response = await get_provider(provider_name).complete(
+            model=model,
+            max_tokens=max_tokens,
+            messages=messages
+        )
+
+    print_usage(summary_response, "Summary")
+    return summary_response.text.strip()
+
+async def haiku_read_chunk(objective, file_path, start, end, chunk_text):
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": f"Objective: {objective}\n\nBelow is the part of the file {os.path.basename(file_path)} from byte {start} to byte {end}. The file is too large to read at once, so other sub-agents read the other parts. Extract everything in this part that is relevant to the objective: facts, decisions, names, signatures and code the later steps will need, with enough context to use them. Be concise and do not comment on the parts you cannot see.\n\nFile part:\n{chunk_text}"}
+            ]
+        }
+    ]
+    chunk_response = await stream_completion(
+        get_provider("anthropic"), console, "[bold blue]Chunk Reader[/bold blue]", echo=False,
+        role="mapper",
+        model=SUB_AGENT_MODEL,
+        max_tokens=2048,
+        messages=messages
+    )
+    return chunk_response.text.strip()
+
+async def haiku_reduce(objective, file_path, partial_results):
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": f"Objective: {objective}\n\nThe following notes were extracted from consecutive parts of the file {os.path.basename(file_path)}, in file order. Merge them into one set of notes that keeps everything relevant to the objective, in file order, and drops repetition.\n\n" + "\n\n".join(f"Notes {index + 1}:\n{result}" for index, result in enumerate(partial_results))}
+            ]
+        }
+    ]
+    reduce_response = await stream_completion(
+        get_provider("anthropic"), console, "[bold blue]Reducer[/bold blue]", echo=False,
+        role="reducer",
+        model=SUB_AGENT_MODEL,
+        max_tokens=4096,
+        messages=messages
+    )
+    return reduce_response.text.strip()
+
+async def map_reduce_file(objective, file_path, max_workers=4, exchange_log=None, journal=None, finished=None):
+    """
+    Reads a file too large for one prompt as parallel chunk-level sub-tasks and reduces their results into one digest.
+
+    Args:
+        objective (str): The run objective the sub-agents read the file for.
+        file_path (str): The large input file.
+        max_workers (int, optional): Maximum number of sub-agents running at once. Defaults to 4.
+        exchange_log (ExchangeLog, optional): Log the partial results are recorded in. Defaults to None.
+        journal (RunJournal, optional): Journal each partial result is appended to. Defaults to None.
+        finished (dict, optional): Partial results from before a resume, keyed by ``(level, index)``. Defaults to None.
+
+    Returns:
+        str: The digest of the file that the orchestrator sees instead of its content.
+    """
+    finished = finished or {}
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def run_part(level, index, description, call):
+        if (level, index) in finished:
+            return finished[(level, index)]
+        async with semaphore:
+            result = await call()
+        console.print(f"{description} done")
+        if exchange_log:
+            exchange_log.event("task", id=f"{level}.{index + 1}", prompt=description, result=result)
+        if journal:
+            journal.append("file_part", level=level, index=index, result=result)
+        return result
+
+    with mapped_file(file_path) as data:
+        chunks = list(iter_chunks(data, CHUNK_TOKENS))
+        console.print(Panel(f"{file_path}: {len(data)} bytes, ~{estimate_file_tokens(file_path)} tokens, read as {len(chunks)} chunks of ~{CHUNK_TOKENS} tokens by up to {max_workers} sub-agents at once", title="[bold blue]Large Input File[/bold blue]", title_align="left", border_style="blue"))
+        # Each chunk is decoded only once its sub-agent starts, so at most max_workers chunks are in memory
+        partial_results = await asyncio.gather(*[
+            run_part(0, index, f"Read bytes {start}-{end} of {file_path}", lambda start=start, end=end: haiku_read_chunk(objective, file_path, start, end, read_chunk(data, start, end)))
+            for index, (start, end) in enumerate(chunks)
+        ])
+
+    # Merge the partial results a few at a time, level by level, until one digest is left
+    level = 0
+    while len(partial_results) > 1:
+        level += 1
+        groups = [partial_results[index:index + REDUCE_FAN_IN] for index in range(0, len(partial_results), REDUCE_FAN_IN)]
+        partial_results = await asyncio.gather(*[
+            run_part(level, index, f"Merge level {level}, group {index + 1} of {len(groups)}", lambda group=group: haiku_reduce(objective, file_path, group))
+            for index, group in enumerate(groups)
+        ])
+
+    digest = partial_results[0] if partial_results else ""
+    console.print(Panel(digest, title="[bold green]File Digest[/bold green]", title_align="left", border_style="green"))
+    return f"Digest of {os.path.basename(file_path)}, merged from notes that sub-agents took while reading all of it:\n{digest}"
+
+async def opus_refine(objective, sub_task_results, filename, projectname, exchange_log=None):
+    console.print("\nCalling Opus to provide the refined final output for your objective:")
     messages = [
         {
             "role": "user",
             "content": [
-                {"type": "text", "text": "Objective: " + objective + "\n\nSub-task results:\n" + "\n".join(sub_task_results) + "\n\nPlease review and refine the sub-task results into a cohesive final output. Add any missing information or details as needed. When working on code projects, ONLY AND ONLY IF THE PROJECT IS CLEARLY A CODING ONE please provide the following:\n1. Project Name: Create a concise and appropriate project name that fits the project based on what it's creating. The project name should be no more than 20 characters long.\n2. Folder Structure: Provide the folder structure as a valid JSON object, where each key represents a folder or file, and nested keys represent subfolders. Use null values for files. Ensure the JSON is properly formatted without any syntax errors. Please make sure all keys are enclosed in double quotes, and ensure objects are correctly encapsulated with braces, separating items with commas as necessary.\nWrap the JSON object in <folder_structure> tags.\n3. Code Files: For each code file, include ONLY the file name NEVER EVER USE THE FILE PATH OR ANY OTHER FORMATTING YOU ONLY USE THE FOLLOWING format 'Filename: <filename>' followed by the code block enclosed in triple backticks, with the language identifier after the opening backticks, like this:\n\nâpython\n<code>\nâ"}
+                text_block("Objective: " + objective + "\n\nSub-task results:\n" + "\n".join(sub_task_results), cache=True),
+                {"type": "text", "text": "\n\nPlease review and refine the sub-task results into a cohesive final output. Add any missing information or details as needed. When working on code projects, ONLY AND ONLY IF THE PROJECT IS CLEARLY A CODING ONE please also provide:\n1. Project Name: a concise and appropriate project name that fits the project based on what it's creating, no more than 20 characters long.\n2. Folder Structure: the folder structure, where each key represents a folder or file, and nested keys represent subfolders. Use null values for files.\n3. Code Files: every code file in full, each named by its path in the folder structure. Keep the code out of the final output text."}
             ]
         }
     ]
 
-    opus_response = client.messages.create(
+    # The project name, folder structure and files come back as fields of one JSON object instead of Markdown to scrape
+    opus_response = await stream_completion(
+        get_provider("anthropic"), console, "[bold green]Final Output[/bold green]", exchange_log,
+        role="refiner",
         model=REFINER_MODEL,
         max_tokens=4096,
+        messages=messages,
+        schema=REFINER_SCHEMA
+    )
+    print_usage(opus_response, "Refine")
+
+    # A response still cut off after its continuations is read up to its last complete field
+    return parse_refined(opus_response.text.strip())
+
+async def haiku_merge_draft(objective, draft, results):
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": f"Objective: {objective}\n\n" + (f"Current draft of the final output:\n{draft}\n\n" if draft else "") + "New sub-task results:\n" + "\n\n".join(results) + f"\n\nPlease merge the new sub-task results {'into the current draft' if draft else 'into one draft'} of the final output for the objective. Keep every fact, decision, file name and complete code file, with each code file given as 'Filename: <filename>' followed by its code block; replace outdated versions of code with the newer ones and drop repetition. Return only the updated draft."}
+            ]
+        }
+    ]
+    draft_response = await stream_completion(
+        get_provider("anthropic"), console, "[bold blue]Draft[/bold blue]", echo=False,
+        role="drafter",
+        model=SUB_AGENT_MODEL,
+        max_tokens=4096,
         messages=messages
     )
+    console.print(f"Merged {len(results)} result(s) into the draft")
+    return draft_response.text.strip()
+
+def load_input_file(file_path):
+    """
+    Reads a small input file, or leaves a large one to be read chunk by chunk in map-reduce mode.
+
+    Returns:
+        str: The file content, or None if the file is too large to paste into the prompts.
+    """
+    if estimate_file_tokens(file_path) > LARGE_FILE_TOKENS:
+        return None
+    return read_file(file_path)
+
+async def main():
+    # parse args
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plan', action='store_true', help='Plan the whole objective as a dependency graph in one orchestrator call and run independent sub-tasks concurrently')
+    parser.add_argument('--max-workers', type=int, default=MAX_WORKERS, help='Maximum number of sub-agents running at once in plan mode')
+    parser.add_argument('--cache', choices=['on', 'off', 'refresh'], help='Use the on-disk response cache, bypass it, or refresh it with new responses (defaults to MAESTRO_CACHE or on)')
+    parser.add_argument('--resume', metavar='RUN_ID', help='Continue an interrupted run from its journal instead of starting a new one')
+    args = parser.parse_args()
+    if args.cache:
+        set_cache_mode(args.cache)
+
+    if args.resume:
+        journal = RunJournal(args.resume)
+        if not journal.exists():
+            console.print(Panel(f"No journal found for run {args.resume} in {journal.directory}", title="[bold red]Resume Error[/bold red]", title_align="left", border_style="red"))
+            return
+        start = journal.records()[0]
+        console.print(Panel(f"Resuming run {args.resume}: {start['objective']}", title="[bold blue]Resuming Run[/bold blue]", title_align="left", border_style="blue"))
+        result = await run_objective(start["objective"], start["file_content"], start["use_search"], start["plan"], args.max_workers, start["log_filename"], start["output_dir"], run_id=args.resume, resume=True, file_path=start.get("file_path"))
+        await finish_run(result, start["use_search"])
+        return
 
-    response_text = opus_response.content[0].text.strip()
-    console.print(f"Input Tokens: {opus_response.usage.input_tokens}, Output Tokens: {opus_response.usage.output_tokens}")
-    total_cost = calculate_subagent_cost(REFINER_MODEL, opus_response.usage.input_tokens, opus_response.usage.output_tokens)
-    console.print(f"Refine Cost: ${total_cost:.4f}")
+    # Get the objective from user input
+    objective = input("Please enter your objective with or without a text file path: ")
+
+    # Check if the input contains a file path
+    if "./" in objective or "/" in objective:
+        # Extract the file path from the objective
+        file_path = re.findall(r'[./\w]+\.[\w]+', objective)[0]
+        # Read the file content, unless it is too large to fit in the prompts
+        file_content = load_input_file(file_path)
+        # Update the objective string to remove the file path
+        objective = objective.split(file_path)[0].strip()
+    else:
+        file_content = None
+        file_path = None
 
-    if opus_response.usage.output_tokens >= 4000 and not continuation:  # Threshold set to 4000 as a precaution
-        console.print("[bold yellow]Warning:[/bold yellow] Output may be truncated. Attempting to continue the response.")
-        continuation_response_text = opus_refine(objective, sub_task_results + [response_text], filename, projectname, continuation=True)
-        response_text += "\n" + continuation_response_text
+    # Ask the user if they want to use search
+    use_search = input("Do you want to use search? (y/n): ").lower() == 'y'
 
-    console.print(Panel(response_text, title="[bold green]Final Output[/bold green]", title_align="left", border_style="green"))
-    return response_text
+    result = await run_objective(objective, file_content, use_search, args.plan, args.max_workers, file_path=file_path)
+    await finish_run(result, use_search)
 
-def create_folder_structure(project_name, folder_structure, code_blocks):
-    # Create the project folder
-    try:
-        os.makedirs(project_name, exist_ok=True)
-        console.print(Panel(f"Created project folder: [bold]{project_name}[/bold]", title="[bold green]Project Folder[/bold green]", title_align="left", border_style="green"))
-    except OSError as e:
-        console.print(Panel(f"Error creating project folder: [bold]{project_name}[/bold]\nError: {e}", title="[bold red]Project Folder Creation Error[/bold red]", title_align="left", border_style="red"))
-        return
+async def finish_run(result, use_search):
+    console.print(f"\n[bold]Refined Final output:[/bold]\n{result['refined_output']}")
+    print(f"\nFull exchange log saved to {result['exchange_log']}")
 
-    # Recursively create the folder structure and files
-    create_folders_and_files(project_name, folder_structure, code_blocks)
-
-def create_folders_and_files(current_path, structure, code_blocks):
-    for key, value in structure.items():
-        path = os.path.join(current_path, key)
-        if isinstance(value, dict):
-            try:
-                os.makedirs(path, exist_ok=True)
-                console.print(Panel(f"Created folder: [bold]{path}[/bold]", title="[bold blue]Folder Creation[/bold blue]", title_align="left", border_style="blue"))
-                create_folders_and_files(path, value, code_blocks)
-            except OSError as e:
-                console.print(Panel(f"Error creating folder: [bold]{path}[/bold]\nError: {e}", title="[bold red]Folder Creation Error[/bold red]", title_align="left", border_style="red"))
-        else:
-            code_content = next((code for file, code in code_blocks if file == key), None)
-            if code_content:
+    if use_search:
+        console.print(get_search_service().stats())
+    console.print(Panel(get_recorder().format_summary(result["run_id"]), title="[bold]Calls per role[/bold]", title_align="left", border_style="white"))
+    get_recorder().export()
+    await close_providers()
+
+async def run_objective(objective, file_content=None, use_search=False, plan=False, max_workers=MAX_WORKERS, log_filename=None, output_dir=".", run_id=None, resume=False, file_path=None):
+    """
+    Runs one orchestration session from objective to refined output and project files.
+
+    Args:
+        objective (str): The objective to achieve.
+        file_content (str, optional): Content of a file given with the objective. Defaults to None.
+        use_search (bool, optional): Whether sub-agents may search the web. Defaults to False.
+        plan (bool, optional): Whether to plan the objective as a task graph first. Defaults to False.
+        max_workers (int, optional): Maximum number of sub-agents running at once in plan mode. Defaults to MAX_WORKERS.
+        log_filename (str, optional): Path of the exchange log. Defaults to a timestamped name in the working directory.
+        output_dir (str, optional): Directory the project folder is created in. Defaults to ".".
+        run_id (str, optional): The id the session's journal and metrics are recorded under. Defaults to a random id.
+        resume (bool, optional): Whether to continue the run's journal, skipping every step it already holds. Defaults to False.
+        file_path (str, optional): Path of the input file, indexed so every sub-agent gets the passages relevant to its task.
+            Without ``file_content`` the file is too large to paste into the prompts, and it is read chunk by chunk by
+            parallel sub-agents and reduced to a digest that takes the place of ``file_content``. Defaults to None.
+
+    Returns:
+        dict: The run id, the refined output, the exchange log path, the project folder and the sub-task results.
+    """
+    run_id = run_id or uuid.uuid4().hex[:12]
+    # Every call made during the session is recorded under this run
+    with metric_labels(run_id=run_id):
+        # Create the .md filename
+        sanitized_objective = re.sub(r'\W+', '_', objective)
+        timestamp = datetime.now().strftime("%H-%M-%S")
+
+        # Truncate the sanitized_objective to a maximum of 50 characters
+        max_length = 25
+        truncated_objective = sanitized_objective[:max_length] if len(sanitized_objective) > max_length else sanitized_objective
+
+        # The event log and the Markdown rendered from it are written while the run progresses, so they are on disk before the run ends
+        filename = log_filename or f"{timestamp}_{truncated_objective}.md"
+        exchange_log = ExchangeLog(filename, objective, append=resume, run_id=run_id)
+        # A run that is cancelled or fails still closes its log, and stops the background work it started
+        status = "failed"
+        refiner = None
+        # Every finished step is journaled, so an interrupted run can be resumed without repeating paid calls
+        journal = RunJournal(run_id)
+        try:
+
+            history = journal.records() if resume else []
+            if not resume:
+                journal.append("start", objective=objective, file_content=file_content, file_path=file_path, use_search=use_search, plan=plan, log_filename=filename, output_dir=output_dir)
+                console.print(f"Run id: {run_id} (continue an interrupted run with --resume {run_id})")
+
+            task_exchanges = [(record["prompt"], record["result"]) for record in history if record["type"] == "sub_agent"]
+            haiku_tasks = [{"task": prompt, "result": result} for prompt, result in task_exchanges]
+            # An orchestrator reply whose sub-task had not finished yet; compactions and background drafts may be
+            # journaled after it
+            pending_orchestrator = None
+            for record in history:
+                if record["type"] == "sub_agent":
+                    pending_orchestrator = None
+                elif record["type"] == "orchestrator":
+                    pending_orchestrator = record
+            refine_record = next((record for record in history if record["type"] == "refine"), None)
+
+            if file_path and file_content is None and not refine_record:
+                file_parts = {(record["level"], record["index"]): record["result"] for record in history if record["type"] == "file_part"}
+                file_content = await map_reduce_file(objective, file_path, max_workers, exchange_log, journal, file_parts)
+
+            if file_path and not refine_record:
+                if await get_retrieval_index().index_file(file_path):
+                    console.print(f"Indexed {file_path} for passage retrieval")
+
+                async def retrieve(prompt):
+                    passages = await get_retrieval_index().search(prompt, [file_path], RETRIEVAL_TOP_K)
+                    return f"{prompt}\n\nRelevant passages from the input file:\n{format_passages(passages)}" if passages else prompt
+            else:
+                retrieve = None
+
+            # Sub-task results are merged into a running draft in the background, overlapping with the next steps
+            if INCREMENTAL_REFINE and not refine_record:
+                refiner = IncrementalRefiner(
+                    lambda draft, results: haiku_merge_draft(objective, draft, results), REDUCE_FAN_IN,
+                    on_draft=lambda draft, merged_keys: journal.append("draft", draft=draft, merged_keys=merged_keys),
+                )
+                draft_record = next((record for record in reversed(history) if record["type"] == "draft"), None)
+                if draft_record:
+                    refiner.restore(draft_record["draft"], draft_record["merged_keys"])
+                for number, (_, result) in enumerate(task_exchanges, start=1):
+                    refiner.add(f"task-{number}", result)
+
+            plan_executed = False
+            plan_record = next((record for record in history if record["type"] == "plan"), None)
+            if plan and not refine_record:
                 try:
-                    with open(path, 'w') as file:
-                        file.write(code_content)
-                    console.print(Panel(f"Created file: [bold]{path}[/bold]", title="[bold green]File Creation[/bold green]", title_align="left", border_style="green"))
-                except IOError as e:
-                    console.print(Panel(f"Error creating file: [bold]{path}[/bold]\nError: {e}", title="[bold red]File Creation Error[/bold red]", title_align="left", border_style="red"))
+                    if plan_record:
+                        tasks = plan_record["tasks"]
+                    else:
+                        tasks = await opus_plan(objective, file_content, use_search, exchange_log)
+                        journal.append("plan", tasks=tasks)
+                    finished = {record["id"]: (record["prompt"], record["result"]) for record in history if record["type"] == "plan_task"}
+                    task_exchanges = await execute_plan(tasks, file_content, use_search, max_workers, exchange_log, journal, finished, retrieve, refiner)
+                    plan_executed = True
+                except ValueError as e:
+                    console.print(Panel(f"Error parsing the task plan: {e}", title="[bold red]Plan Parsing Error[/bold red]", title_align="left", border_style="red"))
+                    console.print(Panel("Falling back to one sub-task per orchestrator call.", title="[bold yellow]Plan Mode Skipped[/bold yellow]", title_align="left", border_style="yellow"))
+
+            # Keep recent results verbatim and fold older ones into a rolling summary once a role's history goes over budget
+            orchestrator_context = ContextCompactor(haiku_summarize, ORCHESTRATOR_CONTEXT_TOKENS, KEEP_RECENT_RESULTS)
+            sub_agent_context = ContextCompactor(haiku_summarize, SUB_AGENT_CONTEXT_TOKENS, KEEP_RECENT_RESULTS, to_text=lambda task: f"Task: {task['task']}\nResult: {task['result']}")
+            compactors = {"orchestrator": orchestrator_context, "sub_agent": sub_agent_context}
+            for record in history:
+                if record["type"] == "compaction":
+                    compactors[record["role"]].summary = record["summary"]
+                    compactors[record["role"]].summarized_count = record["summarized_count"]
+
+            async def compact(role, entries):
+                compactor = compactors[role]
+                summarized_count = compactor.summarized_count
+                result = await compactor.compact(entries)
+                if compactor.summarized_count != summarized_count:
+                    journal.append("compaction", role=role, summary=compactor.summary, summarized_count=compactor.summarized_count)
+                return result
+
+            file_content_for_haiku = file_content if not task_exchanges else None
+            iteration = len(task_exchanges)
+            while not plan_executed and not refine_record:
+                iteration += 1
+                with metric_labels(iteration=iteration):
+                    # Call Orchestrator to break down the objective into the next sub-task or provide the final output
+                    if pending_orchestrator:
+                        step = {"complete": pending_orchestrator["complete"], "prompt": pending_orchestrator["response"], "search_query": pending_orchestrator["search_query"]} if "complete" in pending_orchestrator else parse_orchestrator(pending_orchestrator["response"])
+                        step["search_query"] = step["search_query"] or pending_orchestrator["search_query"]
+                        pending_orchestrator = None
+                    else:
+                        summary, recent_results = await compact("orchestrator", [result for _, result in task_exchanges])
+                        previous_results = ([f"Summary of earlier sub-task results:\n{summary}"] if summary else []) + recent_results
+                        if not task_exchanges:
+                            # Pass the file content only in the first iteration if available
+                            step, file_content_for_haiku = await opus_orchestrator(objective, file_content, previous_results, use_search, exchange_log)
+                        else:
+                            step, _ = await opus_orchestrator(objective, previous_results=previous_results, use_search=use_search, exchange_log=exchange_log)
+                        journal.append("orchestrator", iteration=iteration, response=step["prompt"], complete=step["complete"], search_query=step["search_query"])
+                    search_query = step["search_query"]
+
+                    if step["complete"]:
+                        # If Opus indicates the task is complete, exit the loop
+                        break
+                    else:
+                        sub_task_prompt = step["prompt"]
+                        agent_prompt = sub_task_prompt
+                        if retrieve:
+                            # Every sub-agent gets the passages of the input file most relevant to its task, not the whole file
+                            agent_prompt = await retrieve(sub_task_prompt)
+                        elif file_content_for_haiku and not haiku_tasks:
+                            # Append file content to the prompt for the initial call to haiku_sub_agent, if applicable
+                            sub_task_prompt = agent_prompt = f"{sub_task_prompt}\n\nFile content:\n{file_content_for_haiku}"
+                        # Call haiku_sub_agent with the prepared prompt, search query, and record the result
+                        summary, recent_tasks = await compact("sub_agent", haiku_tasks)
+                        previous_haiku_tasks = ([{"task": "Earlier tasks (summarized)", "result": summary}] if summary else []) + recent_tasks
+                        sub_task_result = await haiku_sub_agent(agent_prompt, search_query, previous_haiku_tasks, use_search, exchange_log=exchange_log, log_heading=f"Task {len(task_exchanges) + 1}:\nPrompt: {sub_task_prompt}\nResult: ")
+                        # Log the task and its result for future reference
+                        haiku_tasks.append({"task": sub_task_prompt, "result": sub_task_result})
+                        # Record the exchange for processing and output generation
+                        task_exchanges.append((sub_task_prompt, sub_task_result))
+                        journal.append("sub_agent", iteration=iteration, prompt=sub_task_prompt, result=sub_task_result)
+                        if refiner:
+                            # Merged into the draft while the orchestrator works out the next step
+                            refiner.add(f"task-{len(task_exchanges)}", sub_task_result)
+                        # Prevent file content from being included in future haiku_sub_agent calls
+                        file_content_for_haiku = None
+
+                        saved_tokens = orchestrator_context.last_saved_tokens + sub_agent_context.last_saved_tokens
+                        if saved_tokens:
+                            console.print(f"Context compaction saved ~{saved_tokens} input tokens this iteration (~{orchestrator_context.total_saved_tokens + sub_agent_context.total_saved_tokens} so far)")
+
+            # Call Opus to review and refine the sub-task results
+            if refine_record:
+                refined_output = refine_record["refined_output"]
+                project = refine_record.get("project") or parse_refined(refined_output)
             else:
-                console.print(Panel(f"Code content not found for file: [bold]{key}[/bold]", title="[bold yellow]Missing Code Content[/bold yellow]", title_align="left", border_style="yellow"))
-
-def read_file(file_path):
-    with open(file_path, 'r') as file:
-        content = file.read()
-    return content
-
-# Get the objective from user input
-objective = input("Please enter your objective with or without a text file path: ")
-
-# Check if the input contains a file path
-if "./" in objective or "/" in objective:
-    # Extract the file path from the objective
-    file_path = re.findall(r'[./\w]+\.[\w]+', objective)[0]
-    # Read the file content
-    with open(file_path, 'r') as file:
-        file_content = file.read()
-    # Update the objective string to remove the file path
-    objective = objective.split(file_path)[0].strip()
-else:
-    file_content = None
-
-# Ask the user if they want to use search
-use_search = input("Do you want to use search? (y/n): ").lower() == 'y'
-
-task_exchanges = []
-haiku_tasks = []
-
-while True:
-    # Call Orchestrator to break down the objective into the next sub-task or provide the final output
-    previous_results = [result for _, result in task_exchanges]
-    if not task_exchanges:
-        # Pass the file content only in the first iteration if available
-        opus_result, file_content_for_haiku, search_query = opus_orchestrator(objective, file_content, previous_results, use_search)
-    else:
-        opus_result, _, search_query = opus_orchestrator(objective, previous_results=previous_results, use_search=use_search)
-
-    if "The task is complete:" in opus_result:
-        # If Opus indicates the task is complete, exit the loop
-        final_output = opus_result.replace("The task is complete:", "").strip()
-        break
-    else:
-        sub_task_prompt = opus_result
-        # Append file content to the prompt for the initial call to haiku_sub_agent, if applicable
-        if file_content_for_haiku and not haiku_tasks:
-            sub_task_prompt = f"{sub_task_prompt}\n\nFile content:\n{file_content_for_haiku}"
-        # Call haiku_sub_agent with the prepared prompt, search query, and record the result
-        sub_task_result = haiku_sub_agent(sub_task_prompt, search_query, haiku_tasks, use_search)
-        # Log the task and its result for future reference
-        haiku_tasks.append({"task": sub_task_prompt, "result": sub_task_result})
-        # Record the exchange for processing and output generation
-        task_exchanges.append((sub_task_prompt, sub_task_result))
-        # Prevent file content from being included in future haiku_sub_agent calls
-        file_content_for_haiku = None
-
-# Create the .md filename
-sanitized_objective = re.sub(r'\W+', '_', objective)
-timestamp = datetime.now().strftime("%H-%M-%S")
-
-# Call Opus to review and refine the sub-task results
-refined_output = opus_refine(objective, [result for _, result in task_exchanges], timestamp, sanitized_objective)
-
-# Extract the project name from the refined output
-project_name_match = re.search(r'Project Name: (.*)', refined_output)
-project_name = project_name_match.group(1).strip() if project_name_match else sanitized_objective
-
-# Extract the folder structure from the refined output
-folder_structure_match = re.search(r'<folder_structure>(.*?)</folder_structure>', refined_output, re.DOTALL)
-folder_structure = {}
-if folder_structure_match:
-    json_string = folder_structure_match.group(1).strip()
-    try:
-        folder_structure = json.loads(json_string)
-    except json.JSONDecodeError as e:
-        console.print(Panel(f"Error parsing JSON: {e}", title="[bold red]JSON Parsing Error[/bold red]", title_align="left", border_style="red"))
-        console.print(Panel(f"Invalid JSON string: [bold]{json_string}[/bold]", title="[bold red]Invalid JSON String[/bold red]", title_align="left", border_style="red"))
-
-# Extract code files from the refined output
-code_blocks = re.findall(r'Filename: (\S+)\s*```[\w]*\n(.*?)\n```', refined_output, re.DOTALL)
-
-# Create the folder structure and code files
-create_folder_structure(project_name, folder_structure, code_blocks)
-
-# Truncate the sanitized_objective to a maximum of 50 characters
-max_length = 25
-truncated_objective = sanitized_objective[:max_length] if len(sanitized_objective) > max_length else sanitized_objective
-
-# Update the filename to include the project name
-filename = f"{timestamp}_{truncated_objective}.md"
-
-# Prepare the full exchange log
-exchange_log = f"Objective: {objective}\n\n"
-exchange_log += "=" * 40 + " Task Breakdown " + "=" * 40 + "\n\n"
-for i, (prompt, result) in enumerate(task_exchanges, start=1):
-    exchange_log += f"Task {i}:\n"
-    exchange_log += f"Prompt: {prompt}\n"
-    exchange_log += f"Result: {result}\n\n"
-
-exchange_log += "=" * 40 + " Refined Final Output " + "=" * 40 + "\n\n"
-exchange_log += refined_output
-
-console.print(f"\n[bold]Refined Final output:[/bold]\n{refined_output}")
-
-with open(filename, 'w') as file:
-    file.write(exchange_log)
-print(f"\nFull exchange log saved to {filename}")
+                sub_task_results = [result for _, result in task_exchanges]
+                if refiner and len(sub_task_results) > 1:
+                    try:
+                        # The final refine only sees the compact draft, not every result
+                        sub_task_results = [f"Draft merged from all {len(sub_task_results)} sub-task results:\n{await refiner.draft()}"]
+                    except Exception as e:
+                        console.print(Panel(f"Error merging the draft: {e}\nRefining from all sub-task results instead.", title="[bold yellow]Draft Skipped[/bold yellow]", title_align="left", border_style="yellow"))
+                exchange_log.section("Refined Final Output")
+                project = await opus_refine(objective, sub_task_results, timestamp, sanitized_objective, exchange_log=exchange_log)
+                # Rendered as readable text for the console, the logs and batch results
+                refined_output = render_refined(project)
+                exchange_log.event("refined", text=refined_output)
+                journal.append("refine", refined_output=refined_output, project=project)
+
+            if project["error"]:
+                console.print(Panel(f"Error parsing JSON: {project['error']}", title="[bold red]JSON Parsing Error[/bold red]", title_align="left", border_style="red"))
+
+            # Create the folder structure and code files
+            project_folder = os.path.join(output_dir, project["project_name"] or sanitized_objective)
+            create_folder_structure(project_folder, project["folder_structure"], project["files"])
+
+            journal.append("done")
+            status = "done"
+            return {
+                "run_id": run_id,
+                "refined_output": refined_output,
+                "exchange_log": filename,
+                "event_log": exchange_log.events_path,
+                "project_folder": project_folder,
+                "sub_task_results": [result for _, result in task_exchanges],
+            }
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            if refiner:
+                await refiner.aclose()
+            if use_search:
+                await get_search_service().release_run(run_id)
+            exchange_log.close(status)
+            # The records are written in the background; once the run returns, its journal is complete on disk
+            await asyncio.to_thread(journal.flush)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,379 @@
+"""
+Structured per-call metrics.
+
+Every provider and search call is recorded as one event carrying its provider,
+model, role, iteration, latency, time to first token, token counts and cost.
+Call sites label their calls with ``metric_labels`` (for example
+``role="orchestrator"``); the labels travel with the asyncio context, so calls
+made from concurrent sub-agents keep their own. Events are appended to a JSONL
+file as they happen and can be aggregated into per-role summaries (p50/p95
+latency, tokens and spend) and a Prometheus textfile. The appends happen on a
+background thread (see ``appender.py``), so recording never blocks the event
+loop.
+"""
+import contextvars
+import json
+import math
+import os
+import time
+from contextlib import contextmanager
+
+import config
+from appender import get_appender
+
+# Price per million tokens; cache writes cost 1.25x the input price and cache reads 0.1x on Anthropic.
+# Models missing from the table (such as local Ollama models) are counted as free.
+MODEL_PRICING = {
+    "claude-3-opus-20240229": {"input": 15.00, "output": 75.00, "cache_write": 18.75, "cache_read": 1.50},
+    "claude-3-sonnet-20240229": {"input": 3.00, "output": 15.00, "cache_write": 3.75, "cache_read": 0.30},
+    "claude-3-haiku-20240307": {"input": 0.25, "output": 1.25, "cache_write": 0.30, "cache_read": 0.03},
+    "gpt-4-0125-preview": {"input": 10.00, "output": 30.00},
+    "mixtral-8x7b-32768": {"input": 0.24, "output": 0.24},
+    "llama3-70b-8192": {"input": 0.59, "output": 0.79},
+    "llama3-8b-8192": {"input": 0.05, "output": 0.08},
+    "gpt-3.5-turbo-0125": {"input": 0.50, "output": 1.50},
+}
+
+_labels = contextvars.ContextVar("metric_labels", default={})
+
+
+@contextmanager
+def metric_labels(**labels):
+    """
+    Labels every call made inside the block, e.g. ``with metric_labels(role="refiner"):``.
+
+    Labels nest: inner blocks add to or override the labels of outer ones.
+    """
+    token = _labels.set({**_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def current_labels() -> dict:
+    """Returns the labels of the current context."""
+    return _labels.get()
+
+
+def calculate_cost(model: str, input_tokens: int, output_tokens: int, cache_write_tokens: int = 0, cache_read_tokens: int = 0) -> float:
+    """
+    Calculates the price of a call in dollars.
+
+    Args:
+        model (str): The model identifier.
+        input_tokens (int): Uncached input tokens.
+        output_tokens (int): Output tokens.
+        cache_write_tokens (int, optional): Input tokens written to the prompt cache. Defaults to 0.
+        cache_read_tokens (int, optional): Input tokens read from the prompt cache. Defaults to 0.
+
+    Returns:
+        float: The cost of the call.
+    """
+    pricing = MODEL_PRICING.get(model)
+    if not pricing:
+        return 0.0
+    return (
+        input_tokens * pricing["input"]
+        + output_tokens * pricing["output"]
+        + cache_write_tokens * pricing.get("cache_write", pricing["input"])
+        + cache_read_tokens * pricing.get("cache_read", pricing["input"])
+    ) / 1_000_000
+
+
+def completion_cost(completion) -> float:
+    """Returns the price of a ``Completion`` in dollars; responses served from the response cache cost nothing."""
+    if completion.cached:
+        return 0.0
+    return calculate_cost(completion.model, completion.input_tokens, completion.output_tokens, completion.cache_creation_input_tokens, completion.cache_read_input_tokens)
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Returns the nearest-rank percentile of a list of numbers (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class MetricsRecorder:
+    """
+    Collects call events, appending each one to a JSONL file as it is recorded.
+
+    Events are also indexed by run, so a run's summary does not scan every event recorded. A long-running
+    process drops the events of a finished run with ``forget``; their totals stay in the Prometheus counters.
+
+    Args:
+        path (str, optional): The JSONL file to append events to, or None to keep them in memory only. Defaults to None.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self._file = get_appender(path) if path else None
+        self.events = []
+        self._runs = {}
+        # Prometheus counter values of the forgotten runs' events, per series and labels
+        self._retired = {}
+
+    def record(self, kind: str, provider: str, model: str, latency: float, **fields) -> dict:
+        """
+        Records one call with the labels of the current context.
+
+        Args:
+            kind (str): ``llm``, ``search`` or ``route`` (the routing decision of a cascaded call).
+            provider (str): The provider or search backend.
+            model (str): The model identifier (or the backend name for searches).
+            latency (float): Seconds the call took.
+            **fields: Token counts, cost, cache status and other measurements.
+
+        Returns:
+            dict: The recorded event.
+        """
+        event = {"timestamp": time.time(), "kind": kind, "provider": provider, "model": model, "latency": latency, **_labels.get(), **fields}
+        self.events.append(event)
+        self._runs.setdefault(event.get("run_id"), []).append(event)
+        if self._file:
+            self._file.append(json.dumps(event) + "\n")
+        return event
+
+    def record_completion(self, provider: str, completion) -> dict:
+        """Records a provider call from its ``Completion``."""
+        return self.record(
+            "llm", provider, completion.model, completion.latency,
+            time_to_first_token=completion.time_to_first_token,
+            input_tokens=completion.input_tokens,
+            output_tokens=completion.output_tokens,
+            cache_write_tokens=completion.cache_creation_input_tokens,
+            cache_read_tokens=completion.cache_read_input_tokens,
+            cached=completion.cached,
+            stop_reason=completion.stop_reason,
+            cost=completion_cost(completion),
+            **(completion.sizing or {}),
+        )
+
+    def run_events(self, run_id: str = None) -> list:
+        """Returns the events labelled with a run, or every event when ``run_id`` is None."""
+        return self.events if run_id is None else self._runs.get(run_id, [])
+
+    def forget(self, run_id: str) -> None:
+        """
+        Drops the events of a finished run from memory; the JSONL file keeps them.
+
+        Their counts, tokens, cost and latency totals are kept for the Prometheus textfile, so its counters never go
+        down, but they no longer count towards its latency quantiles.
+
+        Args:
+            run_id (str): The run.
+        """
+        events = self._runs.pop(run_id, None)
+        if not events:
+            return
+        forgotten = {id(event) for event in events}
+        self.events = [event for event in self.events if id(event) not in forgotten]
+        for key, value in self._counters(events).items():
+            self._retired[key] = self._retired.get(key, 0) + value
+
+    def summarize(self, run_id: str = None) -> dict:
+        """
+        Aggregates the events per role.
+
+        Args:
+            run_id (str, optional): Only include events labelled with this run. Defaults to None (all events).
+
+        Returns:
+            dict: Per role, the number of calls, p50/p95 latency and time to first token, token totals and cost.
+        """
+        groups = {}
+        for event in self.run_events(run_id):
+            if event["kind"] != "route":
+                groups.setdefault(event.get("role") or event["kind"], []).append(event)
+        summary = {}
+        for role, events in groups.items():
+            latencies = [event["latency"] for event in events]
+            first_tokens = [event["time_to_first_token"] for event in events if event.get("time_to_first_token") is not None]
+            summary[role] = {
+                "calls": len(events),
+                "latency_p50": percentile(latencies, 0.5),
+                "latency_p95": percentile(latencies, 0.95),
+                "ttft_p50": percentile(first_tokens, 0.5),
+                "ttft_p95": percentile(first_tokens, 0.95),
+                "input_tokens": sum(event.get("input_tokens", 0) for event in events),
+                "output_tokens": sum(event.get("output_tokens", 0) for event in events),
+                "cached_tokens": sum(event.get("cache_read_tokens", 0) for event in events),
+                "cost": sum(event.get("cost", 0.0) for event in events),
+            }
+        return summary
+
+    def summarize_routing(self, run_id: str = None) -> dict:
+        """
+        Aggregates the routing decisions of cascaded calls per role.
+
+        Args:
+            run_id (str, optional): Only include events labelled with this run. Defaults to None (all events).
+
+        Returns:
+            dict: Per role, the number of routed calls, how many the first tier answered, the escalations,
+                the calls answered per model and the cost saved compared with the top tier.
+        """
+        summary = {}
+        for event in self.run_events(run_id):
+            if event["kind"] == "route":
+                stats = summary.setdefault(event.get("role") or "unlabelled", {"calls": 0, "first_tier": 0, "escalations": 0, "models": {}, "savings": 0.0})
+                stats["calls"] += 1
+                stats["first_tier"] += event["tier"] == 0
+                stats["escalations"] += event["escalations"]
+                stats["models"][event["model"]] = stats["models"].get(event["model"], 0) + 1
+                stats["savings"] += event["savings"]
+        return summary
+
+    def summarize_sizing(self, run_id: str = None) -> dict:
+        """
+        Aggregates the context-window sizing of Ollama calls (see ``ollama_sizing.py``).
+
+        Args:
+            run_id (str, optional): Only include events labelled with this run. Defaults to None (all events).
+
+        Returns:
+            dict: The number of sized calls, the smallest and largest ``num_ctx``, the average KV cache saved
+                against the baseline window, the context reloads and their loading time, the reloads avoided and
+                the time they would have taken, and the prompts too long for the largest window. Empty when no
+                call was sized.
+        """
+        events = [
+            event for event in self.run_events(run_id)
+            if event["kind"] == "llm" and "num_ctx" in event and not event.get("cached")
+        ]
+        if not events:
+            return {}
+        reload_times = [event["load_time"] for event in events if event["context_reload"]]
+        # An avoided reload is counted at the time a load of the model took, or the longest load seen
+        load_time = max(reload_times or [event["load_time"] for event in events])
+        avoided = sum(event["reload_avoided"] for event in events)
+        return {
+            "calls": len(events),
+            "num_ctx_min": min(event["num_ctx"] for event in events),
+            "num_ctx_max": max(event["num_ctx"] for event in events),
+            "kv_saved_mb": sum(event["kv_saved_mb"] for event in events) / len(events),
+            "reloads": len(reload_times),
+            "reload_time": sum(reload_times),
+            "reloads_avoided": avoided,
+            "time_saved": avoided * load_time,
+            "overflows": sum(event["overflow"] for event in events),
+        }
+
+    def format_summary(self, run_id: str = None) -> str:
+        """Formats ``summarize``, ``summarize_routing`` and ``summarize_sizing`` as one line per role for the console."""
+        lines = []
+        for role, stats in sorted(self.summarize(run_id).items()):
+            lines.append(
+                f"{role}: {stats['calls']} calls, latency p50 {stats['latency_p50']:.2f}s / p95 {stats['latency_p95']:.2f}s, "
+                f"tokens {stats['input_tokens']} in / {stats['output_tokens']} out / {stats['cached_tokens']} cached, ${stats['cost']:.4f}"
+            )
+        for role, stats in sorted(self.summarize_routing(run_id).items()):
+            models = ", ".join(f"{model} {count}" for model, count in sorted(stats["models"].items()))
+            lines.append(
+                f"{role} routing: {stats['first_tier']}/{stats['calls']} on the first tier, {stats['escalations']} escalations "
+                f"({models}), saved ${stats['savings']:.4f}"
+            )
+        sizing = self.summarize_sizing(run_id)
+        if sizing:
+            lines.append(
+                f"ollama sizing: {sizing['calls']} calls, num_ctx {sizing['num_ctx_min']}-{sizing['num_ctx_max']}, "
+                f"{sizing['kv_saved_mb']:.0f} MB KV cache saved per call vs num_ctx {config.OLLAMA_BASELINE_NUM_CTX}, "
+                f"{sizing['reloads']} context reloads ({sizing['reload_time']:.1f}s), {sizing['reloads_avoided']} avoided (~{sizing['time_saved']:.1f}s saved), "
+                f"{sizing['overflows']} prompts over the largest window"
+            )
+        return "\n".join(lines)
+
+    @staticmethod
+    def _counters(events: list) -> dict:
+        """Sums the Prometheus counters of some events, keyed by series name, provider, model and role."""
+        counters = {}
+
+        def add(name, labels, value):
+            counters[(name, *labels)] = counters.get((name, *labels), 0) + value
+
+        for event in events:
+            labels = (event["provider"], event["model"], event.get("role") or event["kind"])
+            if event["kind"] == "route":
+                add("maestro_routed_calls_total", labels, 1)
+                add("maestro_route_escalations_total", labels, event["escalations"])
+                add("maestro_route_savings_dollars_total", labels, event["savings"])
+                continue
+            add("maestro_calls_total", labels, 1)
+            add("maestro_input_tokens_total", labels, event.get("input_tokens", 0))
+            add("maestro_output_tokens_total", labels, event.get("output_tokens", 0))
+            add("maestro_cached_tokens_total", labels, event.get("cache_read_tokens", 0))
+            add("maestro_cost_dollars_total", labels, event.get("cost", 0.0))
+            add("maestro_latency_seconds_sum", labels, event["latency"])
+            add("maestro_latency_seconds_count", labels, 1)
+            if "num_ctx" in event and not event.get("cached"):
+                add("maestro_ollama_kv_saved_megabytes_total", labels, event["kv_saved_mb"])
+                add("maestro_ollama_context_reloads_total", labels, event["context_reload"])
+                add("maestro_ollama_load_seconds_total", labels, event["load_time"])
+        return counters
+
+    def write_prometheus(self, path: str) -> None:
+        """
+        Writes the aggregated metrics in the Prometheus textfile collector format.
+
+        The file is written to a temporary name and renamed, so the collector never
+        reads a partial file.
+
+        Args:
+            path (str): The ``.prom`` file to write.
+        """
+        counters = self._counters(self.events)
+        for key, value in self._retired.items():
+            counters[key] = counters.get(key, 0) + value
+        series = {}
+        for (name, *labels), value in counters.items():
+            series.setdefault(name, {})[tuple(labels)] = value
+        latencies = {}
+        for event in self.events:
+            if event["kind"] != "route":
+                latencies.setdefault((event["provider"], event["model"], event.get("role") or event["kind"]), []).append(event["latency"])
+
+        def format_labels(provider, model, role):
+            return f'provider="{provider}",model="{model}",role="{role}"'
+
+        lines = ["# HELP maestro_calls_total Provider and search calls."]
+        for name in ("maestro_calls_total", "maestro_input_tokens_total", "maestro_output_tokens_total", "maestro_cached_tokens_total", "maestro_cost_dollars_total"):
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(series.get(name, {}).items()):
+                lines.append(f"{name}{{{format_labels(*labels)}}} {value}")
+        lines.append("# TYPE maestro_latency_seconds summary")
+        for labels, count in sorted(series.get("maestro_latency_seconds_count", {}).items()):
+            for quantile in (0.5, 0.95):
+                if labels in latencies:
+                    lines.append(f'maestro_latency_seconds{{{format_labels(*labels)},quantile="{quantile}"}} {percentile(latencies[labels], quantile):.6f}')
+            lines.append(f"maestro_latency_seconds_sum{{{format_labels(*labels)}}} {series['maestro_latency_seconds_sum'][labels]:.6f}")
+            lines.append(f"maestro_latency_seconds_count{{{format_labels(*labels)}}} {count}")
+        for name in (
+            "maestro_routed_calls_total", "maestro_route_escalations_total", "maestro_route_savings_dollars_total",
+            "maestro_ollama_kv_saved_megabytes_total", "maestro_ollama_context_reloads_total", "maestro_ollama_load_seconds_total",
+        ):
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(series.get(name, {}).items()):
+                lines.append(f"{name}{{{format_labels(*labels)}}} {value}")
+
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, 'w') as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(temporary_path, path)
+
+    def export(self) -> None:
+        """Writes the Prometheus textfile configured in ``config``, if any."""
+        if config.METRICS_PROMETHEUS_FILE:
+            self.write_prometheus(config.METRICS_PROMETHEUS_FILE)
+
+
+_recorder = None
+
+
+def get_recorder() -> MetricsRecorder:
+    """Returns the process-wide metrics recorder, creating it on first use."""
+    global _recorder
+    if _recorder is None:
+        _recorder = MetricsRecorder(config.METRICS_FILE or None)
+    return _recorder
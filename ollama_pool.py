@@ -0,0 +1,167 @@
+"""
+A pool of Ollama hosts.
+
+Every Ollama call used to go to the single host in ``OLLAMA_HOST``, so
+concurrent sub-agent calls and batch sessions queued behind one server while
+other machines running Ollama sat idle. ``OllamaPool`` spreads the calls over
+the hosts listed in ``MAESTRO_OLLAMA_HOSTS``:
+
+- Each host is probed with ``/api/ps`` in the background, which tells whether
+  it is up and which models it has loaded. A host that fails a probe or a
+  connection is left out until it answers again.
+- A call goes to the healthy host with the fewest calls in flight, counting a
+  host that would first have to load the model as ``MAESTRO_OLLAMA_LOAD_PENALTY``
+  calls busier, so calls stick to hosts that already hold their model.
+- Each host keeps its own ``ModelResidency`` (availability cache, warm-up and
+  per-model call ordering), since each has its own memory.
+
+With a single host nothing is probed and every call goes straight to it.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+import httpx
+
+import config
+from residency import ModelResidency, normalize_model
+
+
+class OllamaHost:
+    """
+    One Ollama server of the pool.
+
+    Args:
+        url (str): The host URL.
+        timeout (float): Seconds to wait on a request.
+    """
+
+    def __init__(self, url: str, timeout: float):
+        from ollama import AsyncClient
+        self.url = url
+        self.client = AsyncClient(host=url, timeout=timeout)
+        self.residency = ModelResidency(self.client, url)
+        self.healthy = True
+        # Models the host has loaded, least recently used first
+        self.loaded = {}
+        self.outstanding = 0
+        self.calls = 0
+
+    async def probe(self) -> bool:
+        """Checks that the host answers and refreshes the models it has loaded."""
+        try:
+            response = await asyncio.wait_for(self.client.ps(), config.OLLAMA_PROBE_TIMEOUT)
+        except Exception:
+            self.healthy = False
+            return False
+        self.healthy = True
+        self.loaded = dict.fromkeys(normalize_model(model.model) for model in response.models)
+        return True
+
+    def mark_loaded(self, model: str) -> None:
+        """Records that the host loads a model for a call, evicting the least recently used beyond its resident limit."""
+        self.loaded.pop(model, None)
+        self.loaded[model] = None
+        while len(self.loaded) > self.residency.scheduler.max_loaded:
+            del self.loaded[next(iter(self.loaded))]
+
+
+class OllamaPool:
+    """
+    Routes Ollama calls over several hosts.
+
+    Args:
+        urls (list): The host URLs; duplicates are ignored.
+        timeout (float): Seconds to wait on a request.
+    """
+
+    def __init__(self, urls: list, timeout: float):
+        self.hosts = [OllamaHost(url, timeout) for url in dict.fromkeys(urls)]
+        self._first_probe = None
+        self._prober = None
+
+    async def probe(self) -> None:
+        """Probes every host at once."""
+        await asyncio.gather(*[host.probe() for host in self.hosts])
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await asyncio.sleep(config.OLLAMA_PROBE_INTERVAL)
+            await self.probe()
+
+    async def _ensure_probed(self) -> None:
+        if len(self.hosts) == 1:
+            return
+        if self._first_probe is None:
+            self._first_probe = asyncio.create_task(self.probe())
+            self._prober = asyncio.create_task(self._probe_loop())
+        await self._first_probe
+
+    def choose(self, model: str) -> OllamaHost:
+        """
+        Picks the host for a call: the healthy host with the fewest calls in flight, preferring hosts with the model loaded.
+
+        Args:
+            model (str): The model of the call.
+
+        Returns:
+            OllamaHost: The chosen host; when no host is healthy, the least busy of all of them.
+        """
+        model = normalize_model(model)
+        candidates = [host for host in self.hosts if host.healthy] or self.hosts
+        return min(candidates, key=lambda host: host.outstanding + (0 if model in host.loaded else config.OLLAMA_LOAD_PENALTY))
+
+    @asynccontextmanager
+    async def route(self, model: str):
+        """
+        Holds a call slot for the model on the chosen host for the duration of the block.
+
+        Yields:
+            OllamaHost: The host to send the call to.
+        """
+        await self._ensure_probed()
+        host = self.choose(model)
+        host.outstanding += 1
+        host.calls += 1
+        try:
+            async with host.residency.call(model):
+                # Later calls for the model prefer this host, and calls for a model it evicts look elsewhere
+                host.mark_loaded(normalize_model(model))
+                yield host
+        except (httpx.TransportError, ConnectionError):
+            # Left out until a probe finds it up again; the retry goes to another host
+            if len(self.hosts) > 1:
+                host.healthy = False
+            raise
+        finally:
+            host.outstanding -= 1
+
+    def start(self, models: dict) -> None:
+        """Makes the models available and preloads the first ones on every host in the background (see ``ModelResidency.start``)."""
+        for host in self.hosts:
+            host.residency.start(models)
+
+    async def ensure(self, model: str) -> None:
+        """Pulls a model on every host that does not have it."""
+        await asyncio.gather(*[host.residency.ensure(model) for host in self.hosts])
+
+    def stats(self) -> str:
+        """Calls and model loads per host."""
+        if len(self.hosts) == 1:
+            return self.hosts[0].residency.stats()
+        return "Ollama hosts: " + "; ".join(
+            f"{host.url} {host.calls} calls, {host.residency.scheduler.switches} model loads{'' if host.healthy else ' (down)'}" for host in self.hosts
+        )
+
+    @property
+    def calls(self) -> int:
+        return sum(host.residency.scheduler.calls for host in self.hosts)
+
+    async def aclose(self) -> None:
+        """Stops probing, cancels running warm-ups and closes every host's client."""
+        for task in (self._prober, self._first_probe):
+            if task is not None and not task.done():
+                task.cancel()
+        await asyncio.gather(*[task for task in (self._prober, self._first_probe) if task is not None], return_exceptions=True)
+        for host in self.hosts:
+            await host.residency.aclose()
+            await host.client.close()
@@ -0,0 +1,97 @@
+"""
+Context-window and generation sizing for Ollama calls.
+
+Ollama calls used to be sent without ``options``, so every call ran with the
+model's default ``num_ctx``: long histories were silently cut to fit it, and
+short prompts reserved KV-cache memory they never used. Each call now gets:
+
+- a ``num_ctx`` with room for its prompt and its output, rounded up to one of
+  ``MAESTRO_OLLAMA_CTX_BUCKETS``. Ollama reloads a model whenever its
+  ``num_ctx`` changes, so a model already loaded with a larger window keeps it
+  rather than being reloaded for a smaller one;
+- a ``num_predict`` of the call's ``max_tokens``, bounded per role by
+  ``MAESTRO_NUM_PREDICT_<ROLE>``.
+
+Prompt sizes are estimated from their length and corrected, per model, with
+the ratio of the prompt tokens Ollama reports to the estimate.
+"""
+import math
+from typing import Optional
+
+import config
+from context import estimate_tokens
+
+# The output limit of a call that does not set max_tokens (see Provider.complete)
+DEFAULT_MAX_TOKENS = 4096
+
+
+def bucket(tokens: int) -> int:
+    """Rounds a token count up to the smallest context bucket that holds it (the largest bucket when none does)."""
+    return next((size for size in config.OLLAMA_CTX_BUCKETS if size >= tokens), config.OLLAMA_CTX_BUCKETS[-1])
+
+
+def num_predict_for(role: Optional[str], max_tokens: int = DEFAULT_MAX_TOKENS) -> int:
+    """Returns the output limit of a call: its ``max_tokens``, bounded by the limit of its role."""
+    limit = config.OLLAMA_NUM_PREDICT.get(role) if role else None
+    return min(max_tokens, limit) if limit else max_tokens
+
+
+class ContextSizer:
+    """Chooses ``num_ctx`` and ``num_predict`` for the calls to one Ollama host."""
+
+    def __init__(self):
+        # The num_ctx each loaded model runs with
+        self.context_sizes = {}
+        # Prompt tokens reported by Ollama per estimated token, per model
+        self.ratios = {}
+
+    def estimate(self, model: str, text: str) -> int:
+        """Estimates the prompt tokens of a text for a model."""
+        return math.ceil(estimate_tokens(text) * self.ratios.get(model, 1.0))
+
+    def warm_options(self, model: str, role: Optional[str]) -> dict:
+        """The options to load a model with ahead of its first call: room for the role's output and a prompt as long."""
+        num_ctx = bucket(2 * num_predict_for(role))
+        self.context_sizes[model] = num_ctx
+        return {"num_ctx": num_ctx}
+
+    def options(self, model: str, prompt: str, max_tokens: int, role: Optional[str]) -> tuple:
+        """
+        Sizes a call.
+
+        Args:
+            model (str): The model identifier.
+            prompt (str): The text of the system prompt and messages.
+            max_tokens (int): The call's output limit.
+            role (str): The call's role.
+
+        Returns:
+            tuple: The ``options`` to send, and the sizing decision to record in the metrics.
+        """
+        estimated = self.estimate(model, prompt)
+        num_predict = num_predict_for(role, max_tokens)
+        needed = bucket(estimated + num_predict)
+        loaded = self.context_sizes.get(model)
+        num_ctx = loaded if loaded and loaded >= needed else needed
+        self.context_sizes[model] = num_ctx
+        sizing = {
+            "num_ctx": num_ctx,
+            "num_predict": num_predict,
+            "prompt_estimate": estimated,
+            "context_reload": loaded is not None and loaded != num_ctx,
+            "reload_avoided": loaded is not None and needed < loaded,
+            "overflow": estimated + num_predict > num_ctx,
+        }
+        return {"num_ctx": num_ctx, "num_predict": num_predict}, sizing
+
+    def observe(self, model: str, prompt: str, prompt_tokens: int, sizing: dict) -> None:
+        """Corrects the model's estimates with the prompt tokens Ollama counted for a call."""
+        # A prompt cut to fit the window reports fewer tokens than it had
+        if not prompt_tokens or sizing["overflow"]:
+            return
+        ratio = prompt_tokens / max(estimate_tokens(prompt), 1)
+        self.ratios[model] = min(max((self.ratios.get(model, ratio) + ratio) / 2, 0.5), 3.0)
+
+    def forget(self, loaded: set) -> None:
+        """Drops the window of models that are no longer loaded, so they are sized afresh when they load again."""
+        self.context_sizes = {model: num_ctx for model, num_ctx in self.context_sizes.items() if model in loaded}
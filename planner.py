@@ -0,0 +1,109 @@
+"""
+Plan-as-DAG support: parse a dependency graph of sub-tasks returned by the
+orchestrator in a single turn and execute it with bounded concurrency.
+
+Every sub-task starts as soon as the sub-tasks it depends on have finished, so
+independent branches run side by side and the wall-clock time of a plan is the
+length of its critical path rather than the sum of all sub-tasks.
+"""
+import asyncio
+import json
+import re
+
+
+def parse_plan(response_text: str) -> list:
+    """
+    Extracts and validates the task graph from an orchestrator response.
+
+    The response is normally the JSON output of the ``task_plan`` schema (see
+    ``structured.plan_schema``); a plain-text answer is read from ``<plan>`` tags
+    when present, otherwise from the first JSON object in the text. It must look like
+    ``{"tasks": [{"id": "1", "prompt": "...", "depends_on": []}, ...]}``.
+
+    Args:
+        response_text (str): The raw orchestrator response.
+
+    Returns:
+        list: The tasks in a valid execution (topological) order. Each task is a dict
+            with ``id``, ``prompt``, ``depends_on`` and an optional ``search_query``.
+
+    Raises:
+        ValueError: If the plan is missing, malformed, references unknown tasks or has a cycle.
+    """
+    tag_match = re.search(r'<plan>(.*?)</plan>', response_text, re.DOTALL)
+    json_match = tag_match or re.search(r'{.*}', response_text, re.DOTALL)
+    if not json_match:
+        raise ValueError("No task plan found in the orchestrator response")
+    json_string = tag_match.group(1) if tag_match else json_match.group()
+    try:
+        plan = json.loads(json_string)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid task plan JSON: {e}") from e
+
+    tasks = {}
+    try:
+        for raw_task in plan["tasks"]:
+            task_id = str(raw_task["id"])
+            if task_id in tasks:
+                raise ValueError(f"Duplicate task id in plan: {task_id}")
+            tasks[task_id] = {
+                "id": task_id,
+                "prompt": raw_task["prompt"],
+                "depends_on": [str(dependency) for dependency in raw_task.get("depends_on") or []],
+                "search_query": raw_task.get("search_query"),
+            }
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Malformed task plan: {e!r}") from e
+    if not tasks:
+        raise ValueError("The task plan does not contain any tasks")
+
+    for task in tasks.values():
+        unknown = [dependency for dependency in task["depends_on"] if dependency not in tasks]
+        if unknown:
+            raise ValueError(f"Task {task['id']} depends on unknown tasks: {', '.join(unknown)}")
+
+    # Kahn's algorithm: keeps the orchestrator's ordering among ready tasks and detects cycles
+    ordered = []
+    remaining = {task_id: set(task["depends_on"]) for task_id, task in tasks.items()}
+    while remaining:
+        ready = [task_id for task_id, dependencies in remaining.items() if not dependencies]
+        if not ready:
+            raise ValueError(f"The task plan contains a dependency cycle between: {', '.join(remaining)}")
+        for task_id in ready:
+            ordered.append(tasks[task_id])
+            del remaining[task_id]
+        for dependencies in remaining.values():
+            dependencies.difference_update(ready)
+    return ordered
+
+
+async def run_plan(tasks: list, execute, max_workers: int = 4) -> dict:
+    """
+    Runs a task graph, starting each task once its dependencies have completed.
+
+    Args:
+        tasks (list): Tasks in topological order, as returned by ``parse_plan``.
+        execute (callable): Coroutine function called as ``execute(task, dependency_results)``,
+            where ``dependency_results`` maps each dependency id to its result.
+        max_workers (int, optional): Maximum number of tasks executing at once. Defaults to 4.
+
+    Returns:
+        dict: The result of every task, keyed by task id.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+    futures = {}
+
+    async def run(task):
+        dependency_results = {dependency: await futures[dependency] for dependency in task["depends_on"]}
+        async with semaphore:
+            return await execute(task, dependency_results)
+
+    for task in tasks:
+        futures[task["id"]] = asyncio.ensure_future(run(task))
+    try:
+        await asyncio.gather(*futures.values())
+    except BaseException:
+        for future in futures.values():
+            future.cancel()
+        raise
+    return {task_id: future.result() for task_id, future in futures.items()}
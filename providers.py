@@ -0,0 +1,692 @@
+"""
+Async provider layer shared by every maestro entry point.
+
+Each provider wraps the vendor's async SDK client behind the same ``complete``
+coroutine, so the orchestrator, sub-agent and refiner calls look identical
+whether they go to Anthropic, OpenAI, Groq or Ollama. A provider builds its
+client once and keeps it for the life of the process; the client's connection
+pool and keep-alive sockets are therefore shared by every call, and any number
+of requests can be awaited concurrently on a single event loop.
+"""
+import asyncio
+import importlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Optional
+
+import config
+from metrics import get_recorder
+
+if TYPE_CHECKING:
+    from ratelimit import RateLimiter
+
+
+def _console():
+    """Returns the shared rich console, imported on first use so loading the providers does not import rich."""
+    from utils import console
+    return console
+
+
+@dataclass
+class Completion:
+    """The normalized result of a single provider call."""
+    text: str
+    model: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    stop_reason: Optional[str] = None
+    cache_creation_input_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    latency: float = 0.0
+    time_to_first_token: Optional[float] = None
+    cached: bool = False
+    # The num_ctx/num_predict decision of an Ollama call and what it saved (see ollama_sizing.py)
+    sizing: Optional[dict] = None
+
+    @property
+    def truncated(self) -> bool:
+        """Whether the response was cut off at the output limit (Anthropic ``max_tokens``, OpenAI/Groq/Ollama ``length``)."""
+        return self.stop_reason in ("max_tokens", "length")
+
+    @property
+    def tokens_per_second(self) -> float:
+        """Output tokens per second of generation, excluding the wait for the first token when streamed."""
+        generation_time = self.latency - (self.time_to_first_token or 0.0)
+        return self.output_tokens / generation_time if generation_time > 0 else 0.0
+
+
+# Anthropic accepts at most this many cache_control breakpoints per request
+MAX_CACHE_BREAKPOINTS = 4
+
+
+def text_block(text: str, cache: bool = False) -> dict:
+    """
+    Builds a text content block, optionally marked as a prompt-cache breakpoint.
+
+    Everything up to and including a marked block is cached by Anthropic and re-read
+    at a fraction of the input price when the next request starts with the same
+    blocks. Other providers ignore the marker.
+
+    Args:
+        text (str): The block text.
+        cache (bool, optional): Whether to end a cacheable prefix at this block. Defaults to False.
+
+    Returns:
+        dict: The content block.
+    """
+    block = {"type": "text", "text": text}
+    if cache:
+        block["cache_control"] = {"type": "ephemeral"}
+    return block
+
+
+def flatten_content(content) -> str:
+    """
+    Converts Anthropic-style content blocks into plain text.
+
+    Args:
+        content (str | list): A message content string or a list of ``{"type": "text"}`` blocks.
+
+    Returns:
+        str: The concatenated text of the content.
+    """
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if block.get("type") == "text")
+
+
+def to_chat_messages(messages: list, system: str = None) -> list:
+    """
+    Converts maestro messages into the flat chat format used by OpenAI, Groq and Ollama.
+
+    Args:
+        messages (list): Messages whose content may be a string or a list of text blocks.
+        system (str | list, optional): A system prompt to prepend. Defaults to None.
+
+    Returns:
+        list: Messages with plain string content.
+    """
+    chat_messages = [{"role": "system", "content": flatten_content(system)}] if system else []
+    chat_messages.extend({"role": message["role"], "content": flatten_content(message["content"])} for message in messages)
+    return chat_messages
+
+
+class Provider:
+    """Base class for an async LLM provider with a lazily created, reusable client."""
+
+    name = ""
+    # The SDK module the client comes from, imported when the client is first built
+    sdk = ""
+
+    def __init__(self, api_key: str = None, base_url: str = None, timeout: float = None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout or config.REQUEST_TIMEOUT
+        self._client = None
+        self._limiters = {}
+        # Wall-clock time the client was built, once its SDK had been imported
+        self.ready_at = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._create_client()
+            self.ready_at = self.ready_at or time.time()
+        return self._client
+
+    def _create_client(self):
+        raise NotImplementedError
+
+    @staticmethod
+    def _http_client(client_class):
+        """Builds the SDK's default httpx client with a hook reporting rate-limit headers to the limiter."""
+        # Imported with the client, as ratelimit imports httpx
+        from ratelimit import record_response_headers
+        return client_class(event_hooks={"response": [record_response_headers]})
+
+    def limiter(self, model: str) -> "RateLimiter":
+        """Returns the rate limiter shared by every call to a model of this provider."""
+        from ratelimit import RateLimiter
+        if model not in self._limiters:
+            self._limiters[model] = RateLimiter(config.REQUESTS_PER_MINUTE, config.TOKENS_PER_MINUTE, config.MAX_CONCURRENCY)
+        return self._limiters[model]
+
+    async def complete(self, model: str, messages: list, system: str = None, max_tokens: int = 4096, on_token: Callable[[str], None] = None, schema: dict = None) -> Completion:
+        """
+        Sends a chat request and returns the full completion.
+
+        When ``on_token`` is given the response is streamed and the callback receives each
+        text fragment as it arrives; the returned completion then also carries the time to
+        first token.
+
+        When ``schema`` is given the model is made to answer with a JSON object matching it, through
+        forced tool use on Anthropic, OpenAI and Groq and a ``format`` schema on Ollama. The completion
+        text is then the JSON document, and streamed fragments are pieces of it.
+
+        Args:
+            model (str): The model identifier.
+            messages (list): The conversation messages.
+            system (str | list, optional): The system prompt, as a string or a list of text blocks. Defaults to None.
+            max_tokens (int, optional): The output token limit. Defaults to 4096.
+            on_token (callable, optional): Called with every streamed text fragment. Defaults to None.
+            schema (dict, optional): ``name``, ``description`` and JSON Schema ``parameters`` of the structured
+                output to request (see ``structured.py``). Defaults to None.
+
+        Returns:
+            Completion: The normalized response, including latency measurements.
+        """
+        started = time.perf_counter()
+        response_cache = get_response_cache()
+        if response_cache:
+            from response_cache import cache_key
+            key = cache_key(self.name, model, messages, system, max_tokens=max_tokens, **({"schema": schema} if schema else {}))
+            completion = response_cache.get(key)
+            if completion:
+                # Replay the cached text so streaming callers still see the output
+                if on_token is not None and completion.text:
+                    on_token(completion.text)
+                completion.cached = True
+                completion.time_to_first_token = time.perf_counter() - started if on_token is not None else None
+                completion.latency = time.perf_counter() - started
+                get_recorder().record_completion(self.name, completion)
+                return completion
+
+        from ratelimit import backoff_delay, classify_error, current_limiter
+        limiter = self.limiter(model)
+        estimated_tokens = (len(flatten_content(system or "")) + sum(len(flatten_content(message["content"])) for message in messages)) // 4
+        first_token_at = None
+
+        def timed_on_token(token):
+            nonlocal first_token_at
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            on_token(token)
+
+        for attempt in range(config.MAX_RETRIES + 1):
+            await limiter.acquire(estimated_tokens)
+            limiter_token = current_limiter.set(limiter)
+            # The slot is released however the call ends; a cancelled call neither grows nor shrinks the limit
+            outcome = {"cancelled": True}
+            delay = None
+            try:
+                if on_token is None:
+                    completion = await self._create(model, messages, system, max_tokens, schema)
+                else:
+                    completion = await self._stream(model, messages, system, max_tokens, timed_on_token, schema)
+                outcome = {"extra_tokens": completion.input_tokens + completion.output_tokens - estimated_tokens}
+            except Exception as e:
+                retryable, throttled, retry_after = classify_error(e)
+                outcome = {"throttled": throttled}
+                # A stream that already produced output cannot be replayed without duplicating it
+                if not retryable or attempt == config.MAX_RETRIES or first_token_at is not None:
+                    raise
+                delay = backoff_delay(attempt, retry_after)
+                _console().print(f"{self.name} {model}: {'rate limited' if throttled else type(e).__name__}, retrying in {delay:.1f}s (attempt {attempt + 1} of {config.MAX_RETRIES})")
+            finally:
+                current_limiter.reset(limiter_token)
+                await limiter.release(**outcome)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+
+        if first_token_at is not None:
+            completion.time_to_first_token = first_token_at - started
+        completion.latency = time.perf_counter() - started
+        if response_cache:
+            response_cache.put(key, completion)
+        get_recorder().record_completion(self.name, completion)
+        return completion
+
+    async def complete_continued(self, model: str, messages: list, system: str = None, max_tokens: int = 4096, on_token: Callable[[str], None] = None, schema: dict = None, max_continuations: int = None) -> Completion:
+        """
+        Like ``complete``, but an answer cut off at the output limit is continued until it ends.
+
+        Each continuation sends the answer so far as the start of the assistant's reply (see ``prefill``), so the
+        model picks up mid-sentence and only the new tokens are generated. Continuations are sent without the
+        schema, because forced tool use cannot be prefilled: the model carries on the JSON document as text.
+        The other arguments are those of ``complete``.
+
+        Args:
+            max_continuations (int, optional): Most continuations to send. Defaults to ``config.MAX_CONTINUATIONS``.
+
+        Returns:
+            Completion: The whole answer, with the token counts and latency of all the calls added up and the
+                stop reason of the last one.
+        """
+        completion = await self.complete(model, messages, system, max_tokens, on_token, schema)
+        parts = [completion]
+        text = completion.text
+        for _ in range(config.MAX_CONTINUATIONS if max_continuations is None else max_continuations):
+            if not completion.truncated or not text.strip():
+                break
+            # Anthropic rejects a prefill that ends in whitespace; the model writes it again
+            text = text.rstrip()
+            completion = await self.complete(model, self.prefill(messages, text), system, max_tokens, on_token)
+            parts.append(completion)
+            text += completion.text
+        if len(parts) == 1:
+            return completion
+        return Completion(
+            text=text,
+            model=model,
+            input_tokens=sum(part.input_tokens for part in parts),
+            output_tokens=sum(part.output_tokens for part in parts),
+            stop_reason=completion.stop_reason,
+            cache_creation_input_tokens=sum(part.cache_creation_input_tokens for part in parts),
+            cache_read_input_tokens=sum(part.cache_read_input_tokens for part in parts),
+            latency=sum(part.latency for part in parts),
+            time_to_first_token=parts[0].time_to_first_token,
+            cached=all(part.cached for part in parts),
+        )
+
+    def prefill(self, messages: list, partial: str) -> list:
+        """
+        Returns the messages of a call that continues a truncated answer: the answer so far as the start of the
+        assistant's reply, which Anthropic, Groq and Ollama continue in place.
+
+        Args:
+            messages (list): The messages of the truncated call.
+            partial (str): The answer so far.
+
+        Returns:
+            list: The messages to send.
+        """
+        return messages + [{"role": "assistant", "content": partial}]
+
+    async def _create(self, model, messages, system, max_tokens, schema) -> Completion:
+        raise NotImplementedError
+
+    async def _stream(self, model, messages, system, max_tokens, on_token, schema) -> Completion:
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        """Closes the underlying client and its connection pool."""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+class AnthropicProvider(Provider):
+    name = "anthropic"
+    sdk = "anthropic"
+
+    def _create_client(self):
+        from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+        # Retries are handled by complete(), so the limiter sees every throttled attempt
+        return AsyncAnthropic(api_key=self.api_key, base_url=self.base_url, timeout=self.timeout, max_retries=0, http_client=self._http_client(DefaultAsyncHttpxClient))
+
+    def _params(self, model, messages, system, max_tokens, schema):
+        params = {"model": model, "max_tokens": max_tokens, "messages": messages}
+        if system:
+            params["system"] = system
+        if schema:
+            # A single tool the model is forced to call; its input is the structured output
+            params["tools"] = [{"name": schema["name"], "description": schema["description"], "input_schema": schema["parameters"]}]
+            params["tool_choice"] = {"type": "tool", "name": schema["name"]}
+        self._limit_cache_breakpoints(params)
+        return params
+
+    @staticmethod
+    def _limit_cache_breakpoints(params):
+        """Drops the earliest cache markers beyond MAX_CACHE_BREAKPOINTS, since later ones cover longer prefixes."""
+        system = params.get("system") if isinstance(params.get("system"), list) else []
+        contents = [message["content"] for message in params["messages"] if isinstance(message["content"], list)]
+        excess = sum("cache_control" in block for blocks in [system, *contents] for block in blocks) - MAX_CACHE_BREAKPOINTS
+        if excess <= 0:
+            return
+
+        def strip(blocks):
+            nonlocal excess
+            stripped = []
+            for block in blocks:
+                if excess > 0 and "cache_control" in block:
+                    block = {key: value for key, value in block.items() if key != "cache_control"}
+                    excess -= 1
+                stripped.append(block)
+            return stripped
+
+        # Prefix order is system first, then messages
+        if system:
+            params["system"] = strip(system)
+        params["messages"] = [{**message, "content": strip(message["content"])} if isinstance(message["content"], list) else message for message in params["messages"]]
+
+    def _to_completion(self, model, response, tool_json=None):
+        tool_inputs = [block.input for block in response.content if block.type == "tool_use"]
+        if tool_inputs and response.stop_reason == "max_tokens" and tool_json is not None:
+            # The SDK's partial parse of a cut-off tool input drops the unfinished field, so the raw JSON is kept
+            # for the continuation to pick up where it stopped
+            text = tool_json
+        elif tool_inputs:
+            text = json.dumps(tool_inputs[0])
+        else:
+            text = "".join(block.text for block in response.content if block.type == "text")
+        return Completion(
+            text=text,
+            model=model,
+            input_tokens=response.usage.input_tokens,
+            output_tokens=response.usage.output_tokens,
+            stop_reason=response.stop_reason,
+            cache_creation_input_tokens=getattr(response.usage, "cache_creation_input_tokens", None) or 0,
+            cache_read_input_tokens=getattr(response.usage, "cache_read_input_tokens", None) or 0,
+        )
+
+    async def _create(self, model, messages, system, max_tokens, schema):
+        if schema:
+            # Only a stream carries the raw JSON of a tool input cut off at the output limit
+            return await self._stream(model, messages, system, max_tokens, lambda token: None, schema)
+        response = await self.client.messages.create(**self._params(model, messages, system, max_tokens, schema))
+        return self._to_completion(model, response)
+
+    async def _stream(self, model, messages, system, max_tokens, on_token, schema):
+        tool_json = []
+        async with self.client.messages.stream(**self._params(model, messages, system, max_tokens, schema)) as stream:
+            async for event in stream:
+                if event.type == "text":
+                    on_token(event.text)
+                elif event.type == "input_json":
+                    tool_json.append(event.partial_json)
+                    on_token(event.partial_json)
+            response = await stream.get_final_message()
+        return self._to_completion(model, response, "".join(tool_json))
+
+
+class OpenAIProvider(Provider):
+    name = "openai"
+    sdk = "openai"
+    # Asks for a final usage chunk at the end of a stream
+    stream_options = {"stream_options": {"include_usage": True}}
+
+    def _create_client(self):
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        return AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, timeout=self.timeout, max_retries=0, http_client=self._http_client(DefaultAsyncHttpxClient))
+
+    @staticmethod
+    def _tool_params(schema):
+        """Forces a call of a single function whose arguments are the structured output."""
+        if not schema:
+            return {}
+        return {
+            "tools": [{"type": "function", "function": {"name": schema["name"], "description": schema["description"], "parameters": schema["parameters"]}}],
+            "tool_choice": {"type": "function", "function": {"name": schema["name"]}},
+        }
+
+    def prefill(self, messages, partial):
+        # OpenAI chat models answer a trailing assistant message with a new turn instead of continuing it
+        return super().prefill(messages, partial) + [{"role": "user", "content": "Your reply was cut off at the output limit. Continue it exactly where it stops, without repeating any of it."}]
+
+    async def _create(self, model, messages, system, max_tokens, schema):
+        response = await self.client.chat.completions.create(
+            model=model,
+            messages=to_chat_messages(messages, system),
+            max_tokens=max_tokens,
+            **self._tool_params(schema)
+        )
+        choice = response.choices[0]
+        usage = response.usage
+        tool_calls = choice.message.tool_calls or []
+        return Completion(
+            text=tool_calls[0].function.arguments if tool_calls else choice.message.content or "",
+            model=model,
+            input_tokens=usage.prompt_tokens if usage else 0,
+            output_tokens=usage.completion_tokens if usage else 0,
+            stop_reason=choice.finish_reason,
+        )
+
+    async def _stream(self, model, messages, system, max_tokens, on_token, schema):
+        stream = await self.client.chat.completions.create(
+            model=model,
+            messages=to_chat_messages(messages, system),
+            max_tokens=max_tokens,
+            stream=True,
+            **self.stream_options,
+            **self._tool_params(schema)
+        )
+        parts = []
+        usage = None
+        stop_reason = None
+        async for chunk in stream:
+            # Groq reports usage on its own extension field instead of the chunk itself
+            usage = chunk.usage or getattr(getattr(chunk, "x_groq", None), "usage", None) or usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.delta and choice.delta.content:
+                parts.append(choice.delta.content)
+                on_token(choice.delta.content)
+            # The arguments of the forced function call arrive in pieces, like text
+            for tool_call in (choice.delta.tool_calls or []) if choice.delta else []:
+                if tool_call.function and tool_call.function.arguments:
+                    parts.append(tool_call.function.arguments)
+                    on_token(tool_call.function.arguments)
+            stop_reason = choice.finish_reason or stop_reason
+        return Completion(
+            text="".join(parts),
+            model=model,
+            input_tokens=usage.prompt_tokens if usage else 0,
+            output_tokens=usage.completion_tokens if usage else 0,
+            stop_reason=stop_reason,
+        )
+
+
+class GroqProvider(OpenAIProvider):
+    name = "groq"
+    sdk = "groq"
+    stream_options = {}
+    # Groq continues a trailing assistant message
+    prefill = Provider.prefill
+
+    def _create_client(self):
+        from groq import AsyncGroq, DefaultAsyncHttpxClient
+        return AsyncGroq(api_key=self.api_key, base_url=self.base_url, timeout=self.timeout, max_retries=0, http_client=self._http_client(DefaultAsyncHttpxClient))
+
+
+class OllamaProvider(Provider):
+    name = "ollama"
+    sdk = "ollama"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = None
+
+    @property
+    def pool(self):
+        """The ``OllamaPool`` of the hosts in ``OLLAMA_HOSTS``, each with its own residency."""
+        if self._pool is None:
+            from ollama_pool import OllamaPool
+            self._pool = OllamaPool(config.OLLAMA_HOSTS, self.timeout)
+        return self._pool
+
+    def _create_client(self):
+        return self.pool.hosts[0].client
+
+    def _chat_params(self, host, model, messages, system, max_tokens, schema):
+        chat_messages = to_chat_messages(messages, system)
+        prompt = "\n".join(message["content"] for message in chat_messages)
+        # A context window fitted to the prompt and output, and the role's output limit
+        options, sizing = host.residency.size(model, prompt, max_tokens)
+        # Ollama constrains the output to a JSON schema passed as the format
+        params = dict(model=model, messages=chat_messages, format=schema["parameters"] if schema else None, keep_alive=host.residency.keep_alive(), options=options)
+        return params, prompt, sizing
+
+    def _to_completion(self, host, model, text, response, prompt, sizing):
+        host.residency.sizer.observe(model, prompt, response.get("prompt_eval_count"), sizing)
+        return Completion(
+            text=text,
+            model=model,
+            input_tokens=response.get("prompt_eval_count") or 0,
+            output_tokens=response.get("eval_count") or 0,
+            stop_reason=response.get("done_reason"),
+            sizing={
+                **sizing,
+                "load_time": (response.get("load_duration") or 0) / 1e9,
+                "kv_saved_mb": (config.OLLAMA_BASELINE_NUM_CTX - sizing["num_ctx"]) * config.OLLAMA_KV_BYTES_PER_TOKEN / 2 ** 20,
+            },
+        )
+
+    async def _create(self, model, messages, system, max_tokens, schema):
+        async with self.pool.route(model) as host:
+            params, prompt, sizing = self._chat_params(host, model, messages, system, max_tokens, schema)
+            response = await host.client.chat(**params)
+        return self._to_completion(host, model, response["message"]["content"], response, prompt, sizing)
+
+    async def _stream(self, model, messages, system, max_tokens, on_token, schema):
+        parts = []
+        chunk = None
+        # Sent to the least busy host, preferring one with the model loaded; on each host, calls for the model
+        # that is loaded go first, so models are not swapped on every call
+        async with self.pool.route(model) as host:
+            params, prompt, sizing = self._chat_params(host, model, messages, system, max_tokens, schema)
+            async for chunk in await host.client.chat(**params, stream=True):
+                content = chunk["message"]["content"]
+                if content:
+                    parts.append(content)
+                    on_token(content)
+        if chunk is None:
+            # Nothing came back, not even the final chunk; retried like a dropped connection
+            raise ConnectionError(f"Ollama returned an empty stream for {model} on {host.url}")
+        # The last chunk (done=True) carries the token counts and stop reason
+        return self._to_completion(host, model, "".join(parts), chunk, prompt, sizing)
+
+    async def ensure_model(self, model: str) -> None:
+        """
+        Pulls a model from the Ollama library on every host that does not have it.
+
+        Args:
+            model (str): The model identifier.
+        """
+        await self.pool.ensure(model)
+
+    async def aclose(self) -> None:
+        # The client belongs to the pool's first host, so the pool closes it
+        self._client = None
+        if self._pool is not None:
+            await self._pool.aclose()
+            if self._pool.calls:
+                _console().print(self._pool.stats())
+            self._pool = None
+
+
+# Backend factories by name; a backend's SDK is only imported when its client is first built. More backends are
+# registered with register_provider or loaded on first use from MAESTRO_PROVIDER_PLUGINS.
+PROVIDERS = {
+    "anthropic": lambda: AnthropicProvider(config.ANTHROPIC_API_KEY, config.ANTHROPIC_BASE_URL),
+    "openai": lambda: OpenAIProvider(config.OPENAI_API_KEY, config.OPENAI_BASE_URL),
+    "groq": lambda: GroqProvider(config.GROQ_API_KEY, config.GROQ_BASE_URL),
+    "ollama": lambda: OllamaProvider(base_url=config.OLLAMA_HOST),
+}
+
+_instances = {}
+_response_cache = None
+
+
+def get_response_cache():
+    """
+    Returns the shared on-disk response cache, or None when caching is turned off.
+
+    The cache mode, location, TTL and size limit come from ``config``; ``set_cache_mode``
+    overrides the mode for the current process.
+
+    Returns:
+        ResponseCache: The process-wide response cache, or None.
+    """
+    global _response_cache
+    if config.RESPONSE_CACHE == "off":
+        return None
+    if _response_cache is None:
+        from response_cache import ResponseCache
+        _response_cache = ResponseCache(config.RESPONSE_CACHE_PATH, config.RESPONSE_CACHE_TTL, config.RESPONSE_CACHE_MAX_MB * 1024 * 1024, config.RESPONSE_CACHE)
+    return _response_cache
+
+
+def set_cache_mode(mode: str) -> None:
+    """
+    Sets the response cache mode for this process.
+
+    Args:
+        mode (str): ``on`` to use the cache, ``off`` to bypass it or ``refresh`` to ignore
+            cached entries but store the fresh responses.
+    """
+    from response_cache import CACHE_MODES
+    if mode not in CACHE_MODES:
+        raise ValueError(f"Unknown cache mode: {mode}. Expected one of: {', '.join(CACHE_MODES)}")
+    config.RESPONSE_CACHE = mode
+    if _response_cache is not None:
+        _response_cache.mode = mode
+
+
+def register_provider(name: str, factory: Callable[[], Provider]) -> None:
+    """
+    Adds a backend to the registry.
+
+    Args:
+        name (str): The backend name, as used in ``--provider`` and routes.
+        factory (callable): Builds the backend's ``Provider``; called when the backend is first used.
+    """
+    PROVIDERS[name] = factory
+
+
+def provider_names() -> list:
+    """Names of the registered backends and of the plugins that can be loaded."""
+    return [*PROVIDERS, *(name for name in config.PROVIDER_PLUGINS if name not in PROVIDERS)]
+
+
+def get_provider(name: str) -> Provider:
+    """
+    Returns the shared provider instance for a backend, creating it on first use.
+
+    A backend named in ``MAESTRO_PROVIDER_PLUGINS`` (``name=module:factory``) has its module imported and its
+    factory registered here, the first time it is asked for.
+
+    Args:
+        name (str): ``anthropic``, ``openai``, ``groq``, ``ollama`` or the name of a plugin.
+
+    Returns:
+        Provider: The process-wide provider for that backend.
+    """
+    if name not in PROVIDERS and name in config.PROVIDER_PLUGINS:
+        module_name, _, attribute = config.PROVIDER_PLUGINS[name].partition(":")
+        register_provider(name, getattr(importlib.import_module(module_name), attribute))
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown provider: {name}. Expected one of: {', '.join(provider_names())}")
+    if name not in _instances:
+        _instances[name] = PROVIDERS[name]()
+    return _instances[name]
+
+
+def preload_providers(names) -> None:
+    """
+    Imports the SDKs of the named backends on a background thread.
+
+    Importing an SDK is most of the start-up time before the first request. Started before waiting on the user,
+    the import overlaps with the wait; a client built before it has finished waits for it on Python's import
+    lock.
+
+    Args:
+        names (iterable): The backends the run will use.
+    """
+    modules = list(dict.fromkeys(get_provider(name).sdk for name in names if get_provider(name).sdk))
+
+    def preload():
+        for module in modules:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                # Raised again, with its context, when the client is built
+                pass
+
+    threading.Thread(target=preload, name="preload-sdks", daemon=True).start()
+
+
+async def close_providers() -> None:
+    """Closes every provider created by ``get_provider`` and reports the response cache statistics."""
+    global _response_cache
+    while _instances:
+        _, provider = _instances.popitem()
+        await provider.aclose()
+    if _response_cache is not None:
+        if _response_cache.hits or _response_cache.misses:
+            _console().print(_response_cache.stats())
+        _response_cache.close()
+        _response_cache = None
@@ -0,0 +1,259 @@
+"""
+Provider-aware rate limiting, adaptive concurrency and retry with backoff.
+
+Every provider call passes through a ``RateLimiter`` for its provider and
+model. The limiter keeps two token buckets, one for requests per minute and
+one for tokens per minute, whose sizes are taken from the rate-limit headers
+of each response when the provider sends them. It also bounds the number of
+requests in flight with AIMD (additive increase on success, multiplicative
+decrease on throttling), so a burst of concurrent sub-agents backs off instead
+of failing. Throttled and transient errors are retried with jittered
+exponential backoff, honouring ``retry-after``.
+"""
+import asyncio
+import contextvars
+import random
+import re
+import time
+from datetime import datetime
+from typing import Optional
+
+import httpx
+
+# Statuses worth retrying; 429 (rate limited) and 529 (Anthropic overloaded) also shrink the concurrency limit
+THROTTLE_STATUSES = {429, 529}
+RETRYABLE_STATUSES = {408, 409, 500, 502, 503, 504} | THROTTLE_STATUSES
+
+# The limiter of the call in progress, so response hooks can report headers without knowing the model
+current_limiter = contextvars.ContextVar("current_limiter", default=None)
+
+
+class TokenBucket:
+    """
+    A bucket refilled continuously at ``capacity`` units per minute.
+
+    The level may go negative when a call turns out to use more than was reserved;
+    later acquisitions then wait for the debt to be refilled.
+
+    Args:
+        capacity (float, optional): Units per minute, or None for no limit. Defaults to None.
+    """
+
+    def __init__(self, capacity: Optional[float] = None):
+        self.capacity = capacity
+        self.level = capacity or 0.0
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Returns the seconds until ``amount`` units are available."""
+        if not self.capacity:
+            return 0.0
+        self._refill()
+        # A request larger than the whole bucket only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount
+
+    def update(self, limit: Optional[float], remaining: Optional[float]) -> None:
+        """Adopts the limit and remaining allowance reported by the provider."""
+        self._refill()
+        if limit:
+            if not self.capacity:
+                self.level = limit
+            self.capacity = limit
+        if remaining is not None and self.capacity:
+            self.level = min(self.level, remaining)
+
+
+class RateLimiter:
+    """
+    Rate limits and adaptively bounds the concurrency of calls to one provider model.
+
+    Args:
+        requests_per_minute (float, optional): Initial request limit until the provider reports one. Defaults to None.
+        tokens_per_minute (float, optional): Initial token limit until the provider reports one. Defaults to None.
+        max_concurrency (int, optional): Upper bound for the adaptive concurrency limit. Defaults to 16.
+    """
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None, max_concurrency: int = 16):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        # Start at half the bound and let successes grow it
+        self.concurrency = max(1.0, max_concurrency / 2)
+        self.in_flight = 0
+        self.throttled = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        """
+        Waits for a concurrency slot, one request and ``estimated_tokens`` tokens.
+
+        Args:
+            estimated_tokens (int): The tokens the call is expected to use.
+        """
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.concurrency))
+            self.in_flight += 1
+        try:
+            while True:
+                delay = max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+        except BaseException:
+            # Cancelled while waiting for the buckets: give the slot back
+            await self.release(cancelled=True)
+            raise
+        self.requests.take(1)
+        self.tokens.take(estimated_tokens)
+
+    async def release(self, throttled: bool = False, extra_tokens: int = 0, cancelled: bool = False) -> None:
+        """
+        Frees the call's concurrency slot and adjusts the concurrency limit.
+
+        Args:
+            throttled (bool, optional): Whether the provider throttled the call. Defaults to False.
+            extra_tokens (int, optional): Tokens used beyond the estimate, charged to the bucket. Defaults to 0.
+            cancelled (bool, optional): Whether the call was cancelled, which leaves the limit as it is. Defaults to False.
+        """
+        if extra_tokens > 0:
+            self.tokens.take(extra_tokens)
+        async with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self.concurrency = max(1.0, self.concurrency / 2)
+            elif not cancelled:
+                # Grows by about one slot for every full window of successful calls
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self._condition.notify_all()
+
+    def update_from_headers(self, headers) -> None:
+        """Adopts the request and token limits advertised in a response's headers."""
+        limits = parse_rate_limit_headers(headers)
+        self.requests.update(limits["requests_limit"], limits["requests_remaining"])
+        self.tokens.update(limits["tokens_limit"], limits["tokens_remaining"])
+
+
+def _header_number(headers, *names) -> Optional[float]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                continue
+    return None
+
+
+def parse_rate_limit_headers(headers) -> dict:
+    """
+    Reads request and token limits from Anthropic or OpenAI-style (OpenAI, Groq) headers.
+
+    Args:
+        headers (Mapping): The response headers.
+
+    Returns:
+        dict: ``requests_limit``, ``requests_remaining``, ``tokens_limit`` and ``tokens_remaining``
+            (None where the provider does not report them).
+    """
+    return {
+        "requests_limit": _header_number(headers, "anthropic-ratelimit-requests-limit", "x-ratelimit-limit-requests"),
+        "requests_remaining": _header_number(headers, "anthropic-ratelimit-requests-remaining", "x-ratelimit-remaining-requests"),
+        "tokens_limit": _header_number(headers, "anthropic-ratelimit-input-tokens-limit", "anthropic-ratelimit-tokens-limit", "x-ratelimit-limit-tokens"),
+        "tokens_remaining": _header_number(headers, "anthropic-ratelimit-input-tokens-remaining", "anthropic-ratelimit-tokens-remaining", "x-ratelimit-remaining-tokens"),
+    }
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """
+    Reads how long the provider asks clients to wait before retrying.
+
+    Understands ``retry-after-ms``, ``retry-after`` in seconds or as an HTTP date, and
+    OpenAI-style reset durations such as ``1m30s`` or ``250ms``.
+
+    Args:
+        headers (Mapping): The response headers.
+
+    Returns:
+        float: The delay in seconds, or None if the headers do not say.
+    """
+    if headers is None:
+        return None
+    retry_after_ms = _header_number(headers, "retry-after-ms")
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                from email.utils import parsedate_to_datetime
+                return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now().astimezone()).total_seconds())
+            except (TypeError, ValueError):
+                pass
+    reset = headers.get("x-ratelimit-reset-requests") or headers.get("x-ratelimit-reset-tokens")
+    if reset:
+        units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+        parts = re.findall(r'([\d.]+)(ms|h|m|s)', reset)
+        if parts:
+            return sum(float(number) * units[unit] for number, unit in parts)
+    return None
+
+
+def classify_error(error: BaseException) -> tuple:
+    """
+    Decides whether a failed call should be retried.
+
+    Args:
+        error (BaseException): The error raised by the SDK.
+
+    Returns:
+        tuple: ``(retryable, throttled, retry_after)``, where ``retry_after`` is the delay the
+            provider asked for, if any.
+    """
+    status = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    retry_after = parse_retry_after(getattr(response, "headers", None))
+    if status in RETRYABLE_STATUSES:
+        return True, status in THROTTLE_STATUSES, retry_after
+    # Connection failures and timeouts, raised as SDK-specific subclasses of APIConnectionError (the ollama client
+    # raises the builtin ConnectionError)
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError, ConnectionError)) or any(cls.__name__ == "APIConnectionError" for cls in type(error).__mro__):
+        return True, False, None
+    return False, False, None
+
+
+def backoff_delay(attempt: int, retry_after: float = None, base: float = 1.0, cap: float = 60.0) -> float:
+    """
+    Returns the delay before a retry, using exponential backoff with full jitter.
+
+    Args:
+        attempt (int): The number of the retry, starting at 0.
+        retry_after (float, optional): A delay requested by the provider, used as the minimum. Defaults to None.
+        base (float, optional): The delay scale in seconds. Defaults to 1.0.
+        cap (float, optional): The maximum backoff in seconds. Defaults to 60.0.
+
+    Returns:
+        float: Seconds to wait.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    return max(delay, retry_after or 0.0)
+
+
+async def record_response_headers(response: httpx.Response) -> None:
+    """An httpx response hook that feeds rate-limit headers to the limiter of the current call."""
+    limiter = current_limiter.get()
+    if limiter is not None:
+        limiter.update_from_headers(response.headers)
@@ -0,0 +1,102 @@
+"""
+Incremental, pipelined refinement.
+
+Refining used to wait until the last sub-task had finished and then send every
+sub-task result in one prompt, so the final call grew with the run and nothing
+overlapped with it. An ``IncrementalRefiner`` merges each result into a running
+draft in the background as soon as it arrives, while the orchestrator works on
+the next step. Results that arrive together (as in plan mode) are first merged
+a few at a time in parallel, level by level, before they are folded into the
+draft, so the final refine only needs the compact draft.
+"""
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+
+class IncrementalRefiner:
+    """
+    Keeps a running draft of the final output, merging results into it in the background.
+
+    Args:
+        merge (callable): Coroutine function called as ``merge(draft, results)`` that returns a new draft covering
+            the draft (None for none yet) and the given results.
+        fan_in (int, optional): Maximum number of results merged by one call. Defaults to 4.
+        on_draft (callable, optional): Called as ``on_draft(draft, merged_keys)`` after every update, e.g. to journal it.
+            Defaults to None.
+    """
+
+    def __init__(self, merge: Callable[[Optional[str], list], Awaitable[str]], fan_in: int = 4, on_draft: Callable = None):
+        self.merge = merge
+        self.fan_in = max(fan_in, 2)
+        self.on_draft = on_draft
+        self.draft_text = None
+        self.merged_keys = []
+        self._pending = []
+        self._worker = None
+
+    def restore(self, draft: str, merged_keys: list) -> None:
+        """Continues from a draft saved before a resume."""
+        self.draft_text = draft
+        self.merged_keys = list(merged_keys)
+
+    def add(self, key: str, result: str) -> None:
+        """
+        Queues a result to be merged into the draft, without waiting for the merge.
+
+        Args:
+            key (str): Identifies the result; results whose key is already merged or queued are ignored.
+            result (str): The sub-task result.
+        """
+        if key in self.merged_keys or any(key == pending_key for pending_key, _ in self._pending):
+            return
+        self._pending.append((key, result))
+        # A failed worker is left in place, so that draft() raises its error
+        if self._worker is None or (self._worker.done() and self._worker.exception() is None):
+            self._worker = asyncio.create_task(self._run())
+
+    async def _merge_group(self, group: list) -> str:
+        return group[0] if len(group) == 1 else await self.merge(None, group)
+
+    async def _reduce(self, results: list) -> list:
+        # Tree reduce: merge groups of results in parallel until one merge call can take the rest
+        while len(results) > self.fan_in:
+            groups = [results[index:index + self.fan_in] for index in range(0, len(results), self.fan_in)]
+            results = await asyncio.gather(*[self._merge_group(group) for group in groups])
+        return results
+
+    async def _run(self) -> None:
+        while self._pending:
+            batch, self._pending = self._pending, []
+            keys = [key for key, _ in batch]
+            results = await self._reduce([result for _, result in batch])
+            if self.draft_text is None and len(results) == 1:
+                # The first result is the draft; there is nothing to merge it with yet
+                self.draft_text = results[0]
+            else:
+                self.draft_text = await self.merge(self.draft_text, results)
+            self.merged_keys.extend(keys)
+            if self.on_draft:
+                self.on_draft(self.draft_text, self.merged_keys)
+
+    async def aclose(self) -> None:
+        """Cancels the merge in progress and drops the queued results, for a run that ends without the draft."""
+        self._pending = []
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+
+    async def draft(self) -> Optional[str]:
+        """
+        Waits for every queued result to be merged and returns the draft.
+
+        Raises:
+            Exception: Whatever a background merge raised.
+        """
+        if self._worker is not None and self._worker.done():
+            # Surface an error from a merge that failed while nobody was waiting
+            self._worker.result()
+        while self._pending or (self._worker is not None and not self._worker.done()):
+            if self._worker is None or self._worker.done():
+                self._worker = asyncio.create_task(self._run())
+            await self._worker
+        return self.draft_text
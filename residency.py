@@ -0,0 +1,277 @@
+"""
+Ollama model residency.
+
+maestro-ollama.py used to check each model with ``ollama.show`` one after the
+other on every launch, pulling any missing one before doing anything else, and
+the large orchestrator/refiner model and the small sub-agent model were then
+swapped in and out of memory as the calls alternated. ``ModelResidency`` keeps
+the models where they are needed:
+
+- Which models a host has is read with one ``/api/tags`` call and cached on
+  disk, so a launch normally makes no availability calls at all.
+- The required models are pulled and loaded concurrently in the background at
+  startup; a call only waits for its own model.
+- Every call sends the ``keep_alive`` of its role, so models stay loaded
+  between calls for as long as the role needs them.
+- Calls are admitted per model: while a model is loaded, queued calls for it
+  go first, and another model is only loaded once the current one is idle (or
+  has had a burst of calls while others waited). With the default of one
+  resident model, concurrent calls for two models no longer make them swap on
+  every call.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import config
+from metrics import current_labels
+from ollama_sizing import ContextSizer
+from utils import console
+
+
+def normalize_model(model: str) -> str:
+    """Adds Ollama's implicit ``:latest`` tag to a model name without one."""
+    return model if ":" in model else f"{model}:latest"
+
+
+def keep_alive_for(role: Optional[str]) -> Optional[str]:
+    """Returns the ``keep_alive`` for a call of a role (None for Ollama's default)."""
+    return config.OLLAMA_KEEP_ALIVE.get(role) if role else None
+
+
+class ModelScheduler:
+    """
+    Admits calls so that at most ``max_loaded`` different models are in use at once.
+
+    Calls for a model already in use are admitted straight away, unless other models are waiting and it has
+    already had ``burst`` calls in a row. Otherwise calls wait, and when a model goes idle the model that has
+    waited longest is admitted with all of its queued calls.
+
+    Args:
+        max_loaded (int, optional): Number of models that may be in use at once. Defaults to 1.
+        burst (int, optional): Calls a model may start while other models wait before it has to yield. Defaults to 8.
+    """
+
+    def __init__(self, max_loaded: int = 1, burst: int = 8):
+        self.max_loaded = max(max_loaded, 1)
+        self.burst = max(burst, 1)
+        self.calls = 0
+        self.switches = 0
+        self._active = {}
+        self._streak = {}
+        self._waiting = OrderedDict()
+        self._last_model = None
+        # The models taken to be loaded, least recently admitted first
+        self.resident = OrderedDict()
+
+    def _admit(self, model: str, count: int = 1) -> None:
+        if model not in self._active and model != self._last_model:
+            self.switches += 1
+        self._active[model] = self._active.get(model, 0) + count
+        self._streak[model] = self._streak.get(model, 0) + count
+        self._last_model = model
+        self.calls += count
+        self.resident.pop(model, None)
+        self.resident[model] = None
+        while len(self.resident) > self.max_loaded:
+            self.resident.popitem(last=False)
+
+    def _admissible(self, model: str) -> bool:
+        others_waiting = any(waiting != model for waiting in self._waiting)
+        if model in self._active:
+            return not (others_waiting and self._streak[model] >= self.burst)
+        return len(self._active) < self.max_loaded and not self._waiting
+
+    def _dispatch(self) -> None:
+        # Oldest waiting model first; models still in use are waiting for their burst to end
+        for model in list(self._waiting):
+            if model in self._active or len(self._active) >= self.max_loaded:
+                continue
+            futures = [future for future in self._waiting.pop(model) if not future.done()]
+            if futures:
+                self._admit(model, len(futures))
+                for future in futures:
+                    future.set_result(None)
+
+    async def acquire(self, model: str) -> None:
+        if self._admissible(model):
+            self._admit(model)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(model, []).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just as it was cancelled: give the slot back
+                self.release(model)
+            elif model in self._waiting:
+                self._waiting[model] = [waiting for waiting in self._waiting[model] if waiting is not future]
+                if not self._waiting[model]:
+                    del self._waiting[model]
+            raise
+
+    def release(self, model: str) -> None:
+        self._active[model] -= 1
+        if not self._active[model]:
+            del self._active[model]
+            del self._streak[model]
+            self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, model: str):
+        """Holds one of the model's call slots for the duration of the block."""
+        await self.acquire(model)
+        try:
+            yield
+        finally:
+            self.release(model)
+
+
+class ModelResidency:
+    """
+    Availability cache, background warm-up and per-model call scheduling for one Ollama host.
+
+    Args:
+        client: The host's ``ollama.AsyncClient``.
+        host (str): The host URL, which the availability cache is keyed on.
+    """
+
+    def __init__(self, client, host: str):
+        self.client = client
+        self.host = host or "default"
+        self.scheduler = ModelScheduler(config.OLLAMA_MAX_LOADED_MODELS, config.OLLAMA_MODEL_BURST)
+        self._available = None
+        self._warming = {}
+        self.warm_times = {}
+        self.sizer = ContextSizer()
+
+    def _read_cache(self) -> Optional[set]:
+        path = config.OLLAMA_MODELS_CACHE
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path) as file:
+                entry = json.load(file).get(self.host)
+        except (OSError, ValueError):
+            return None
+        if not entry or time.time() - entry["checked_at"] > config.OLLAMA_MODELS_TTL:
+            return None
+        return set(entry["models"])
+
+    def _write_cache(self) -> None:
+        path = config.OLLAMA_MODELS_CACHE
+        if not path:
+            return
+        try:
+            with open(path) as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            entries = {}
+        entries[self.host] = {"checked_at": time.time(), "models": sorted(self._available)}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump(entries, file)
+        os.replace(temporary_path, path)
+
+    async def available_models(self, refresh: bool = False) -> set:
+        """Returns the models the host has, from the cache unless it is stale or ``refresh`` is set."""
+        if self._available is None and not refresh:
+            self._available = self._read_cache()
+        if self._available is None or refresh:
+            response = await self.client.list()
+            self._available = {normalize_model(model.model) for model in response.models}
+            self._write_cache()
+        return self._available
+
+    async def ensure(self, model: str) -> None:
+        """
+        Pulls a model from the Ollama library if the host does not have it.
+
+        Args:
+            model (str): The model identifier.
+        """
+        if normalize_model(model) in await self.available_models():
+            return
+        # The cache may be behind a model pulled by hand, so look again before pulling
+        if normalize_model(model) in await self.available_models(refresh=True):
+            return
+        console.print(f"Pulling model from ollama: {model}")
+        await self.client.pull(model)
+        self._available.add(normalize_model(model))
+        self._write_cache()
+
+    @asynccontextmanager
+    async def _slot(self, model: str):
+        async with self.scheduler.slot(model):
+            # Models this one pushed out are sized afresh when they load again
+            self.sizer.forget(set(self.scheduler.resident))
+            yield
+
+    async def _warm(self, model: str, role: Optional[str], load: bool) -> None:
+        started = time.perf_counter()
+        await self.ensure(model)
+        if load:
+            try:
+                # An empty prompt loads the model without generating anything, with the window its calls will use
+                async with self._slot(model):
+                    await self.client.generate(model=model, prompt="", keep_alive=keep_alive_for(role), options=self.sizer.warm_options(model, role))
+            except Exception as e:
+                # The model then loads with its first call instead
+                console.print(f"Could not preload {model}: {e}", markup=False)
+                return
+        self.warm_times[model] = time.perf_counter() - started
+
+    def start(self, models: dict) -> None:
+        """
+        Makes the models available and loads them in the background, without waiting.
+
+        Only as many models as may be resident at once are loaded, in the given order; the others are only pulled
+        if missing, so warming up does not evict a model that is needed first.
+
+        Args:
+            models (dict): The role of each model, in order of first use; it sets the ``keep_alive`` and context window
+                the model is loaded with.
+        """
+        for index, (model, role) in enumerate(models.items()):
+            if model not in self._warming:
+                self._warming[model] = asyncio.create_task(self._warm(model, role, load=index < self.scheduler.max_loaded))
+
+    async def ready(self, model: str) -> None:
+        """Waits until a model started by ``start`` is available, raising whatever its warm-up raised."""
+        if model in self._warming:
+            await self._warming[model]
+
+    @asynccontextmanager
+    async def call(self, model: str):
+        """Waits for the model to be ready and for a call slot, then holds the slot for the block."""
+        await self.ready(model)
+        async with self._slot(model):
+            yield
+
+    def keep_alive(self) -> Optional[str]:
+        """The ``keep_alive`` of the role of the current call."""
+        return keep_alive_for(current_labels().get("role"))
+
+    def size(self, model: str, prompt: str, max_tokens: int) -> tuple:
+        """Sizes the context window and output of a call of the current role (see ``ContextSizer.options``)."""
+        return self.sizer.options(model, prompt, max_tokens, current_labels().get("role"))
+
+    def stats(self) -> str:
+        """One-line summary of the warm-up and of the model switches."""
+        warmed = ", ".join(f"{model} in {seconds:.1f}s" for model, seconds in self.warm_times.items())
+        return f"Ollama residency: {self.scheduler.switches} model loads for {self.scheduler.calls} calls" + (f", warmed {warmed}" if warmed else "")
+
+    async def aclose(self) -> None:
+        """Cancels warm-ups that are still running."""
+        for task in self._warming.values():
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*self._warming.values(), return_exceptions=True)
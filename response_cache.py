@@ -0,0 +1,167 @@
+"""
+Persistent on-disk cache of provider responses.
+
+Re-running an objective otherwise pays for every orchestrator, sub-agent and
+refine call again. ``ResponseCache`` stores completed responses in a SQLite
+file keyed by a hash of the provider, model, normalized messages, system prompt
+and sampling parameters, and evicts entries by age (TTL) and by total size
+(least recently used first). ``Provider.complete`` consults it on every call,
+so no call site needs to know about it.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from dataclasses import asdict
+from typing import Optional
+
+from providers import Completion, flatten_content
+
+# Cache modes: use and fill the cache, ignore it entirely, or skip lookups but store fresh responses
+CACHE_MODES = ("on", "off", "refresh")
+
+
+def normalize_content(content) -> str:
+    """
+    Normalizes message content so that equivalent requests share a cache key.
+
+    Content blocks are flattened to text (dropping prompt-cache markers, which do not
+    change the response) and runs of trailing whitespace on each line are removed.
+
+    Args:
+        content (str | list): A message content string or a list of text blocks.
+
+    Returns:
+        str: The normalized text.
+    """
+    return re.sub(r'[ \t]+\n', '\n', flatten_content(content)).strip()
+
+
+def cache_key(provider: str, model: str, messages: list, system=None, **params) -> str:
+    """
+    Computes the content address of a request.
+
+    Args:
+        provider (str): The provider name.
+        model (str): The model identifier.
+        messages (list): The conversation messages.
+        system (str | list, optional): The system prompt. Defaults to None.
+        **params: Sampling parameters such as ``max_tokens``.
+
+    Returns:
+        str: A SHA-256 hex digest identifying the request.
+    """
+    request = {
+        "provider": provider,
+        "model": model,
+        "system": normalize_content(system) if system else None,
+        "messages": [[message["role"], normalize_content(message["content"])] for message in messages],
+        "params": params,
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    A SQLite-backed response cache with TTL and size-based eviction.
+
+    Args:
+        path (str): Path of the SQLite database file.
+        ttl (float, optional): Seconds an entry stays valid; 0 disables expiry. Defaults to 7 days.
+        max_bytes (int, optional): Maximum total size of the stored responses. Defaults to 256 MB.
+        mode (str, optional): One of ``on``, ``off`` or ``refresh``. Defaults to ``on``.
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_bytes: int = 256 * 1024 * 1024, mode: str = "on"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode: {mode}. Expected one of: {', '.join(CACHE_MODES)}")
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        return self._connection
+
+    def get(self, key: str) -> Optional[Completion]:
+        """
+        Looks up a cached response, counting the hit or miss.
+
+        Args:
+            key (str): The request's cache key.
+
+        Returns:
+            Completion: The cached completion, or None on a miss or when lookups are disabled.
+        """
+        if self.mode != "on":
+            # Refreshed requests always go to the provider
+            self.misses += self.mode == "refresh"
+            return None
+        row = self.connection.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or (self.ttl and now - row[1] > self.ttl):
+            self.misses += 1
+            return None
+        with self.connection:
+            self.connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return Completion(**json.loads(row[0]))
+
+    def put(self, key: str, completion: Completion) -> None:
+        """
+        Stores a response and evicts expired and least recently used entries.
+
+        Args:
+            key (str): The request's cache key.
+            completion (Completion): The completed call.
+        """
+        if self.mode == "off":
+            return
+        value = json.dumps(asdict(completion))
+        now = time.time()
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now)
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        if self.ttl:
+            self.connection.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        freed = 0
+        evicted = []
+        for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if total_size - freed <= self.max_bytes:
+                break
+            evicted.append((key,))
+            freed += size
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def stats(self) -> str:
+        """Returns a one-line summary of the hits and misses so far."""
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups else 0.0
+        return f"Response cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0f}% hit rate)"
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,247 @@
+"""
+Local retrieval index over the input documents.
+
+The file given with the objective used to be pasted whole into the first
+sub-agent prompt and then dropped, so later sub-agents never saw the source
+material again. ``RetrievalIndex`` splits each input file into passages, indexes
+them for BM25 ranking (and, when ``MAESTRO_EMBED_MODEL`` names an Ollama
+embedding model, for embedding similarity) and stores everything in a SQLite
+file. A file is only re-indexed when its size, modification time or content
+hash changed. Every sub-agent call then gets the top-k passages for its prompt,
+which keeps the source material in reach while the tokens per call stay bounded.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+from typing import Optional
+
+import config
+from chunking import iter_chunks, mapped_file, read_chunk
+from providers import get_provider
+from search import STOPWORDS
+
+# BM25 term-frequency saturation and length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Rank offset of reciprocal rank fusion when BM25 and embedding rankings are combined
+RRF_K = 60
+# Embedding requests sent to Ollama at once while indexing
+EMBED_CONCURRENCY = 4
+
+
+def tokenize(text: str) -> list:
+    """Splits text into lowercase terms for BM25, dropping stopwords and one-letter terms."""
+    return [term for term in re.findall(r'\w+', text.lower()) if len(term) > 1 and term not in STOPWORDS]
+
+
+def cosine_similarity(left: list, right: list) -> float:
+    dot = sum(a * b for a, b in zip(left, right))
+    norm = math.sqrt(sum(a * a for a in left)) * math.sqrt(sum(b * b for b in right))
+    return dot / norm if norm else 0.0
+
+
+def file_digest(path: str) -> str:
+    """Returns the SHA-256 of a file, reading it in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RetrievalIndex:
+    """
+    Persistent passage index with BM25 and optional embedding ranking.
+
+    Args:
+        path (str): Path of the SQLite database file.
+        passage_tokens (int, optional): Target size of a passage in tokens. Defaults to 400.
+        embed_model (str, optional): Ollama embedding model, or None for BM25 only. Defaults to None.
+    """
+
+    def __init__(self, path: str, passage_tokens: int = 400, embed_model: str = None):
+        self.path = path
+        self.passage_tokens = passage_tokens
+        self.embed_model = embed_model or None
+        self._connection = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, sha256 TEXT NOT NULL, "
+                "passage_tokens INTEGER NOT NULL, embed_model TEXT);"
+                "CREATE TABLE IF NOT EXISTS passages ("
+                "id INTEGER PRIMARY KEY, path TEXT NOT NULL, start INTEGER NOT NULL, end INTEGER NOT NULL, "
+                "length INTEGER NOT NULL, text TEXT NOT NULL, embedding TEXT);"
+                "CREATE INDEX IF NOT EXISTS passages_path ON passages (path);"
+                "CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, passage_id INTEGER NOT NULL, frequency INTEGER NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS postings_term ON postings (term);"
+                "CREATE INDEX IF NOT EXISTS postings_passage ON postings (passage_id);"
+            )
+        return self._connection
+
+    async def index_file(self, path: str) -> bool:
+        """
+        Indexes a file, unless it is already indexed with the same content and settings.
+
+        Args:
+            path (str): The file to index.
+
+        Returns:
+            bool: Whether the file was (re-)indexed.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.connection.execute("SELECT size, mtime, sha256, passage_tokens, embed_model FROM documents WHERE path = ?", (path,)).fetchone()
+        settings_match = row is not None and row[3] == self.passage_tokens and row[4] == self.embed_model
+        if settings_match and (row[0], row[1]) == (stat.st_size, stat.st_mtime):
+            return False
+        sha256 = file_digest(path)
+        if settings_match and row[2] == sha256:
+            # Touched but unchanged: only the recorded modification time is stale
+            with self.connection:
+                self.connection.execute("UPDATE documents SET mtime = ? WHERE path = ?", (stat.st_mtime, path))
+            return False
+
+        passages = []
+        with mapped_file(path) as data:
+            for start, end in iter_chunks(data, self.passage_tokens):
+                passages.append((start, end, read_chunk(data, start, end)))
+        embeddings = await self._embed([text for _, _, text in passages]) if self.embed_model else [None] * len(passages)
+
+        with self.connection:
+            self._remove(path)
+            for (start, end, text), embedding in zip(passages, embeddings):
+                terms = tokenize(text)
+                cursor = self.connection.execute(
+                    "INSERT INTO passages (path, start, end, length, text, embedding) VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, start, end, len(terms), text, json.dumps(embedding) if embedding else None)
+                )
+                frequencies = {}
+                for term in terms:
+                    frequencies[term] = frequencies.get(term, 0) + 1
+                self.connection.executemany(
+                    "INSERT INTO postings (term, passage_id, frequency) VALUES (?, ?, ?)",
+                    [(term, cursor.lastrowid, frequency) for term, frequency in frequencies.items()]
+                )
+            self.connection.execute(
+                "INSERT INTO documents (path, size, mtime, sha256, passage_tokens, embed_model) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime, sha256, self.passage_tokens, self.embed_model)
+            )
+        return True
+
+    def _remove(self, path: str) -> None:
+        self.connection.execute("DELETE FROM postings WHERE passage_id IN (SELECT id FROM passages WHERE path = ?)", (path,))
+        self.connection.execute("DELETE FROM passages WHERE path = ?", (path,))
+        self.connection.execute("DELETE FROM documents WHERE path = ?", (path,))
+
+    async def _embed(self, texts: list) -> list:
+        provider = get_provider("ollama")
+        semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+        async def embed(text):
+            # Scheduled with the chat calls, so embedding does not keep swapping the chat models out
+            async with semaphore, provider.pool.route(self.embed_model) as host:
+                response = await host.client.embeddings(model=self.embed_model, prompt=text)
+            return response["embedding"]
+
+        return await asyncio.gather(*[embed(text) for text in texts])
+
+    def _bm25(self, query_terms: list, paths: list) -> dict:
+        placeholders = ", ".join("?" for _ in paths)
+        count, total_length = self.connection.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM passages WHERE path IN ({placeholders})", paths
+        ).fetchone()
+        if not count or not query_terms:
+            return {}
+        average_length = total_length / count or 1
+        scores = {}
+        for term in set(query_terms):
+            postings = self.connection.execute(
+                f"SELECT postings.passage_id, postings.frequency, passages.length FROM postings "
+                f"JOIN passages ON passages.id = postings.passage_id WHERE postings.term = ? AND passages.path IN ({placeholders})",
+                (term, *paths)
+            ).fetchall()
+            if not postings:
+                continue
+            inverse_frequency = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for passage_id, frequency, length in postings:
+                saturation = frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+                scores[passage_id] = scores.get(passage_id, 0.0) + inverse_frequency * saturation
+        return scores
+
+    async def _embedding_scores(self, query: str, paths: list) -> dict:
+        [query_embedding] = await self._embed([query])
+        placeholders = ", ".join("?" for _ in paths)
+        rows = self.connection.execute(
+            f"SELECT id, embedding FROM passages WHERE embedding IS NOT NULL AND path IN ({placeholders})", paths
+        )
+        return {passage_id: cosine_similarity(query_embedding, json.loads(embedding)) for passage_id, embedding in rows}
+
+    async def search(self, query: str, paths: list, top_k: int = 5) -> list:
+        """
+        Finds the passages of the given files most relevant to a query.
+
+        With an embedding model, the BM25 and embedding rankings are combined by reciprocal rank fusion.
+
+        Args:
+            query (str): The query, typically a sub-task prompt.
+            paths (list): The indexed files to search.
+            top_k (int, optional): Number of passages to return. Defaults to 5.
+
+        Returns:
+            list: Dicts with ``path``, ``start``, ``end`` and ``text``, best first, then in file order for ties.
+                When no passage matches the query, the first passages of the files are returned.
+        """
+        paths = [os.path.abspath(path) for path in paths]
+        if not paths:
+            return []
+        rankings = [self._bm25(tokenize(query), paths)]
+        if self.embed_model:
+            rankings.append(await self._embedding_scores(query, paths))
+        fused = {}
+        for scores in rankings:
+            for rank, passage_id in enumerate(sorted(scores, key=scores.get, reverse=True)):
+                fused[passage_id] = fused.get(passage_id, 0.0) + 1 / (RRF_K + rank + 1)
+        best = sorted(fused, key=lambda passage_id: (-fused[passage_id], passage_id))[:top_k]
+        if not best:
+            # Nothing matched the query, so fall back to the start of the files
+            placeholders = ", ".join("?" for _ in paths)
+            best = [row[0] for row in self.connection.execute(f"SELECT id FROM passages WHERE path IN ({placeholders}) ORDER BY id LIMIT ?", (*paths, top_k))]
+            if not best:
+                return []
+        placeholders = ", ".join("?" for _ in best)
+        rows = {row[0]: row for row in self.connection.execute(f"SELECT id, path, start, end, text FROM passages WHERE id IN ({placeholders})", best)}
+        return [{"path": rows[passage_id][1], "start": rows[passage_id][2], "end": rows[passage_id][3], "text": rows[passage_id][4]} for passage_id in best]
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def format_passages(passages: list) -> str:
+    """Formats retrieved passages for a sub-agent prompt."""
+    return "\n\n".join(f"[{os.path.basename(passage['path'])}, bytes {passage['start']}-{passage['end']}]\n{passage['text']}" for passage in passages)
+
+
+_index: Optional[RetrievalIndex] = None
+
+
+def get_retrieval_index() -> RetrievalIndex:
+    """Returns the process-wide retrieval index, creating it on first use."""
+    global _index
+    if _index is None:
+        _index = RetrievalIndex(config.RETRIEVAL_INDEX_PATH, config.PASSAGE_TOKENS, config.EMBED_MODEL)
+    return _index
@@ -0,0 +1,139 @@
+"""
+Per-role model cascades.
+
+Every script hard-codes one model per role. The routing layer lets each role
+(orchestrator, planner, sub_agent, refiner, ...) run on a cascade of
+provider/model tiers, cheapest first: a call goes to the first tier, and moves
+up to the next one only when the response fails the role's validation check
+(empty, truncated, a refusal, unbalanced code fences or an unparsable plan or
+folder structure) or the call errors. The last tier's response is always
+accepted.
+
+Cascades are configured per role with ``MAESTRO_ROUTE_<ROLE>``, for example::
+
+    MAESTRO_ROUTE_SUB_AGENT="groq:llama3-8b-8192,anthropic:claude-3-haiku-20240307,anthropic:claude-3-sonnet-20240229"
+
+Roles listed in ``MAESTRO_CASCADE_ROLES`` (default ``sub_agent``) that have no
+route of their own try the cheap model of the script's provider first and fall
+back to the script's model. Every routed call is recorded in the run metrics
+with the tier that answered, the escalations and the cost saved compared with
+running it on the top tier.
+"""
+import json
+import re
+from typing import Optional
+
+import config
+from metrics import calculate_cost, completion_cost, get_recorder
+from planner import parse_plan
+
+# The cheap, fast model of each provider, tried first for the roles in CASCADE_ROLES
+CHEAP_MODELS = {
+    "anthropic": "claude-3-haiku-20240307",
+    "openai": "gpt-3.5-turbo-0125",
+    "groq": "llama3-8b-8192",
+    "ollama": "llama3:8b",
+}
+
+# Openings of a response that declines the task
+REFUSALS = re.compile(r"^\s*(I'm sorry|I am sorry|I apologize|I cannot|I can't|As an AI)", re.IGNORECASE)
+
+
+def parse_route(value: str) -> list:
+    """
+    Parses a cascade such as ``"groq:llama3-8b-8192,anthropic:claude-3-opus-20240229"``.
+
+    Returns:
+        list: ``(provider, model)`` tiers, cheapest first.
+
+    Raises:
+        ValueError: If a tier is not written as ``provider:model``.
+    """
+    tiers = []
+    for tier in filter(None, (part.strip() for part in value.split(","))):
+        provider, separator, model = tier.partition(":")
+        if not separator or not model:
+            raise ValueError(f"Invalid route tier: {tier}. Expected provider:model")
+        tiers.append((provider, model))
+    return tiers
+
+
+def route_for(role: Optional[str], provider: str, model: str) -> list:
+    """
+    Returns the cascade for a call.
+
+    Args:
+        role (str): The call's role, or None for an unrouted call.
+        provider (str): The provider the script chose for the role.
+        model (str): The model the script chose for the role.
+
+    Returns:
+        list: ``(provider, model)`` tiers, cheapest first; a single tier when the role is not cascaded.
+    """
+    if role and role in config.ROUTES:
+        return parse_route(config.ROUTES[role])
+    cheap_model = CHEAP_MODELS.get(provider)
+    if role in config.CASCADE_ROLES and cheap_model and cheap_model != model:
+        return [(provider, cheap_model), (provider, model)]
+    return [(provider, model)]
+
+
+def validate(role: Optional[str], completion, structured: bool = False) -> Optional[str]:
+    """
+    Checks whether a response from a lower tier is good enough to keep.
+
+    Args:
+        role (str): The call's role.
+        completion (Completion): The response.
+        structured (bool, optional): Whether the call asked for schema-constrained JSON output. Defaults to False.
+
+    Returns:
+        str: Why the response was rejected, or None if it passed.
+    """
+    text = completion.text.strip()
+    if not text:
+        return "empty response"
+    if completion.truncated:
+        return "truncated response"
+    if REFUSALS.match(text):
+        return "refusal"
+    if structured:
+        try:
+            return None if isinstance(json.loads(text), dict) else "structured output is not an object"
+        except json.JSONDecodeError:
+            return "invalid structured output"
+    if text.count("```") % 2:
+        return "unbalanced code fences"
+    if role == "planner":
+        try:
+            parse_plan(text)
+        except ValueError as e:
+            return f"invalid plan ({e})"
+    if role == "refiner":
+        folder_structure = re.search(r'<folder_structure>(.*?)</folder_structure>', text, re.DOTALL)
+        if folder_structure:
+            try:
+                json.loads(folder_structure.group(1).strip())
+            except json.JSONDecodeError:
+                return "invalid folder structure JSON"
+    return None
+
+
+def record_routing(tiers: list, attempts: list, completion) -> None:
+    """
+    Records a cascaded call in the run metrics, under the labels (such as the role) of the current context.
+
+    Args:
+        tiers (list): The cascade that was used.
+        attempts (list): The ``Completion`` of every tier that was called, in order (None for a tier that errored).
+        completion (Completion): The accepted response.
+    """
+    _, top_model = tiers[-1]
+    spent = sum(completion_cost(attempt) for attempt in attempts if attempt)
+    # What the accepted response would have cost on the top tier, minus what all attempts cost
+    savings = calculate_cost(top_model, completion.input_tokens, completion.output_tokens) - spent
+    tier = len(attempts) - 1
+    get_recorder().record(
+        "route", tiers[tier][0], tiers[tier][1], sum(attempt.latency for attempt in attempts if attempt),
+        tier=tier, tiers=len(tiers), escalations=tier, top_model=top_model, savings=savings,
+    )
@@ -0,0 +1,295 @@
+"""
+Structured run log.
+
+Every run writes an append-only JSONL event log next to its Markdown exchange
+log: one event when the run starts, one per completed model call (with its
+prompt role, model, tokens, cost and output), one per plan task and section
+heading, and one when the run ends. Events are appended as each step finishes,
+so the log is on disk while the run is still going. The Markdown exchange log
+is rendered from these events, either live by ``ExchangeLog`` or later with::
+
+    python runlog.py render 12-00-00_Build_a_todo_app.jsonl
+
+Finished and running sessions are listed in a small SQLite index, which can be
+searched by objective, cost and duration::
+
+    python runlog.py search --objective todo --min-cost 0.05
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+import uuid
+from typing import Callable, Iterator
+
+import config
+
+# Callbacks receiving every event of a run as it is written, per run id
+_listeners = {}
+
+
+def add_listener(run_id: str, callback: Callable[[dict], None]) -> None:
+    """Calls ``callback`` with every event the run's exchange log writes from now on, e.g. to stream its progress."""
+    _listeners.setdefault(run_id, []).append(callback)
+
+
+def remove_listener(run_id: str, callback: Callable[[dict], None]) -> None:
+    """Stops calling a callback added with ``add_listener``."""
+    callbacks = _listeners.get(run_id, [])
+    if callback in callbacks:
+        callbacks.remove(callback)
+    if not callbacks:
+        _listeners.pop(run_id, None)
+
+
+def events_path_for(filename: str) -> str:
+    """Returns the path of the JSONL event log that belongs to a Markdown exchange log."""
+    return os.path.splitext(filename)[0] + ".jsonl"
+
+
+def read_events(path: str) -> Iterator[dict]:
+    """
+    Streams the events of a log one at a time, oldest first.
+
+    Args:
+        path (str): The JSONL event log.
+
+    Yields:
+        dict: Each complete event; a line cut short by a crash ends the stream.
+    """
+    with open(path, 'r') as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                return
+
+
+def render_event(event: dict) -> str:
+    """
+    Renders one event as Markdown.
+
+    Args:
+        event (dict): An event from the log.
+
+    Returns:
+        str: The event's part of the exchange log (empty for bookkeeping events).
+    """
+    if event["type"] == "run_start":
+        return f"Objective: {event['objective']}\n\n" + "=" * 40 + " Task Breakdown " + "=" * 40 + "\n\n"
+    if event["type"] == "completion":
+        # A structured answer is raw JSON; its caller logs what it parsed as a step, a plan or the refined output
+        return "" if event.get("structured") else f"{event.get('heading') or ''}{event['text']}\n\n"
+    if event["type"] == "step":
+        return f"Orchestrator:\n{event['prompt']}\n" + (f"Search query: {event['search_query']}\n" if event.get("search_query") else "") + "\n"
+    if event["type"] == "plan":
+        return "Plan:\n" + "".join(
+            f"Task {task['id']} (depends on {', '.join(task['depends_on']) or 'nothing'}):\n{task['prompt']}\n"
+            + (f"Search query: {task['search_query']}\n" if task.get("search_query") else "")
+            for task in event["tasks"]
+        ) + "\n"
+    if event["type"] == "refined":
+        return f"{event['text']}\n\n"
+    if event["type"] == "task":
+        return f"Task {event['id']}:\nPrompt: {event['prompt']}\nResult: {event['result']}\n\n"
+    if event["type"] == "section":
+        return "=" * 40 + f" {event['title']} " + "=" * 40 + "\n\n"
+    return ""
+
+
+def render_markdown(path: str) -> Iterator[str]:
+    """Streams the Markdown exchange log of an event log without loading it into memory."""
+    for event in read_events(path):
+        yield render_event(event)
+
+
+def summarize_events(path: str) -> dict:
+    """
+    Totals the calls, cost and duration of a run from its event log.
+
+    Args:
+        path (str): The JSONL event log.
+
+    Returns:
+        dict: ``calls``, ``cost``, ``started_at`` and ``duration`` (seconds from the first to the last event).
+    """
+    summary = {"calls": 0, "cost": 0.0, "started_at": None, "duration": 0.0}
+    for event in read_events(path):
+        if summary["started_at"] is None:
+            summary["started_at"] = event["timestamp"]
+        summary["duration"] = event["timestamp"] - summary["started_at"]
+        if event["type"] == "completion":
+            summary["calls"] += 1
+            summary["cost"] += event.get("cost", 0.0)
+    return summary
+
+
+class RunIndex:
+    """
+    SQLite index of runs, searchable by objective, cost and duration.
+
+    Args:
+        path (str): Path of the SQLite database file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "run_id TEXT PRIMARY KEY, objective TEXT NOT NULL, status TEXT NOT NULL, "
+                "started_at REAL NOT NULL, duration REAL NOT NULL DEFAULT 0, calls INTEGER NOT NULL DEFAULT 0, "
+                "cost REAL NOT NULL DEFAULT 0, log_path TEXT NOT NULL, events_path TEXT NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at)")
+        return self._connection
+
+    def start(self, run_id: str, objective: str, log_path: str, events_path: str) -> None:
+        """Adds a run, or marks a resumed one as running again."""
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO runs (run_id, objective, status, started_at, log_path, events_path) VALUES (?, ?, 'running', ?, ?, ?) "
+                "ON CONFLICT (run_id) DO UPDATE SET status = 'running'",
+                (run_id, objective, time.time(), os.path.abspath(log_path), os.path.abspath(events_path))
+            )
+
+    def finish(self, run_id: str, status: str, calls: int, cost: float, duration: float) -> None:
+        """Records the final status and totals of a run."""
+        with self.connection:
+            self.connection.execute(
+                "UPDATE runs SET status = ?, calls = ?, cost = ?, duration = ? WHERE run_id = ?",
+                (status, calls, cost, duration, run_id)
+            )
+
+    def search(self, objective: str = None, min_cost: float = None, max_cost: float = None, min_duration: float = None, max_duration: float = None, limit: int = 20) -> list:
+        """
+        Finds runs, newest first.
+
+        Args:
+            objective (str, optional): Text the objective must contain (case-insensitive). Defaults to None.
+            min_cost (float, optional): Minimum cost in dollars. Defaults to None.
+            max_cost (float, optional): Maximum cost in dollars. Defaults to None.
+            min_duration (float, optional): Minimum duration in seconds. Defaults to None.
+            max_duration (float, optional): Maximum duration in seconds. Defaults to None.
+            limit (int, optional): Maximum number of runs returned. Defaults to 20.
+
+        Returns:
+            list: One dict per matching run.
+        """
+        conditions, parameters = [], []
+        for condition, value in (
+            ("objective LIKE ?", f"%{objective}%" if objective else None),
+            ("cost >= ?", min_cost),
+            ("cost <= ?", max_cost),
+            ("duration >= ?", min_duration),
+            ("duration <= ?", max_duration),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = self.connection.execute(f"SELECT * FROM runs {where} ORDER BY started_at DESC LIMIT ?", (*parameters, limit))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class ExchangeLog:
+    """
+    The event log of a run, with its Markdown exchange log rendered alongside as events are written.
+
+    Args:
+        filename (str): Path of the Markdown log file; the event log is written next to it with a ``.jsonl`` suffix.
+        objective (str): The run objective.
+        append (bool, optional): Continue an existing log (when resuming a run) instead of starting a new one. Defaults to False.
+        run_id (str, optional): The id the run is indexed under. Defaults to a random id.
+    """
+
+    def __init__(self, filename: str, objective: str, append: bool = False, run_id: str = None):
+        self.filename = filename
+        self.events_path = events_path_for(filename)
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self._markdown = open(filename, 'a' if append else 'w')
+        self._events = open(self.events_path, 'a' if append else 'w')
+        self._index = RunIndex(config.RUN_INDEX_PATH) if config.RUN_INDEX_PATH else None
+        if self._index:
+            self._index.start(self.run_id, objective, filename, self.events_path)
+        self.event("run_resumed" if append else "run_start", run_id=self.run_id, objective=objective)
+
+    def event(self, event_type: str, **fields) -> None:
+        """
+        Appends an event to the log and its Markdown rendering to the exchange log, flushing both to disk.
+
+        Args:
+            event_type (str): The kind of event, stored as ``type``.
+            **fields: The event's data; must be JSON serializable.
+        """
+        event = {"type": event_type, "timestamp": time.time(), **fields}
+        self._events.write(json.dumps(event) + "\n")
+        self._events.flush()
+        self._markdown.write(render_event(event))
+        self._markdown.flush()
+        for listener in list(_listeners.get(self.run_id, ())):
+            listener(event)
+
+    def section(self, title: str) -> None:
+        """Starts a new section of the exchange log, such as the refined output."""
+        self.event("section", title=title)
+
+    def close(self, status: str = "done") -> None:
+        """Ends the log and records the run's totals in the run index."""
+        self.event("run_end", status=status)
+        self._markdown.close()
+        self._events.close()
+        if self._index:
+            summary = summarize_events(self.events_path)
+            self._index.finish(self.run_id, status, summary["calls"], summary["cost"], summary["duration"])
+            self._index.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render run event logs and search the run index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    render = commands.add_parser("render", help="Render an event log as the Markdown exchange log")
+    render.add_argument("events", help="The .jsonl event log")
+    search = commands.add_parser("search", help="Search past runs")
+    search.add_argument("--objective", help="Text the objective must contain")
+    search.add_argument("--min-cost", type=float)
+    search.add_argument("--max-cost", type=float)
+    search.add_argument("--min-duration", type=float, help="Seconds")
+    search.add_argument("--max-duration", type=float, help="Seconds")
+    search.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == "render":
+        for text in render_markdown(args.events):
+            sys.stdout.write(text)
+        return
+
+    if not config.RUN_INDEX_PATH or not os.path.exists(config.RUN_INDEX_PATH):
+        print("No run index found")
+        return
+    index = RunIndex(config.RUN_INDEX_PATH)
+    for run in index.search(args.objective, args.min_cost, args.max_cost, args.min_duration, args.max_duration, args.limit):
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["started_at"]))
+        print(f"{run['run_id']}  {started}  {run['status']:<8} {run['duration']:8.1f}s {run['calls']:4d} calls ${run['cost']:.4f}  {run['objective'][:60]}  {run['log_path']}")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
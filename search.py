@@ -0,0 +1,225 @@
+"""
+Shared web search service for sub-agents.
+
+One ``SearchService`` per process reuses a single backend client, caches answers
+by normalized query for a configurable TTL and collapses near-duplicate queries
+into one lookup. ``prefetch`` starts a search in the background as soon as a
+query is known, so the lookup overlaps with the rest of the iteration and the
+sub-agent only waits for whatever is left of it.
+"""
+import asyncio
+import re
+import time
+
+import config
+from metrics import current_labels, get_recorder
+
+# Words that do not change what a search query is about
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i",
+    "in", "is", "it", "of", "on", "or", "the", "to", "what", "when", "where", "which", "who", "why", "with",
+}
+
+# Queries whose word sets overlap at least this much (Jaccard similarity) share one lookup
+NEAR_DUPLICATE_SIMILARITY = 0.8
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a search query so that trivially different phrasings share a cache entry.
+
+    Args:
+        query (str): The raw query.
+
+    Returns:
+        str: The lowercased, de-punctuated query without stopwords, with its words sorted.
+    """
+    words = re.findall(r'\w+', query.lower())
+    return " ".join(sorted(set(word for word in words if word not in STOPWORDS) or words))
+
+
+class TavilyBackend:
+    """
+    Answers queries with Tavily's QnA search.
+
+    Args:
+        api_key (str): The Tavily API key.
+    """
+
+    name = "tavily"
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self._client = None
+
+    def search(self, query: str) -> str:
+        if self._client is None:
+            from tavily import TavilyClient
+            self._client = TavilyClient(api_key=self.api_key)
+        return self._client.qna_search(query=query)
+
+
+class StubBackend:
+    """
+    A local backend that answers from a fixed table, for tests and offline runs.
+
+    Args:
+        answers (dict, optional): Canned answers keyed by normalized query. Defaults to None.
+        latency (float, optional): Seconds each lookup takes. Defaults to 0.
+    """
+
+    name = "stub"
+
+    def __init__(self, answers: dict = None, latency: float = 0.0):
+        self.answers = {normalize_query(query): answer for query, answer in (answers or {}).items()}
+        self.latency = latency
+        self.calls = 0
+
+    def search(self, query: str) -> str:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.answers.get(normalize_query(query), f"No results found for: {query}")
+
+
+class SearchService:
+    """
+    Caches, deduplicates and prefetches searches against a backend.
+
+    Args:
+        backend: An object with a blocking ``search(query) -> str`` method.
+        ttl (float, optional): Seconds a cached answer stays valid. Defaults to 3600.
+    """
+
+    def __init__(self, backend, ttl: float = 3600):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        # Normalized query -> (time the lookup started, task resolving to the answer)
+        self._entries = {}
+        # Lookups started by a prefetch that no search has used yet
+        self._unclaimed = set()
+        # Unfinished lookup -> the runs waiting for it
+        self._runs = {}
+
+    @property
+    def backend_name(self) -> str:
+        return getattr(self.backend, "name", type(self.backend).__name__)
+
+    def _find(self, key: str):
+        now = time.monotonic()
+        words = set(key.split())
+        for cached_key, (started, task) in list(self._entries.items()):
+            if now - started > self.ttl:
+                del self._entries[cached_key]
+                self._unclaimed.discard(task)
+                continue
+            cached_words = set(cached_key.split())
+            union = words | cached_words
+            if cached_key == key or (union and len(words & cached_words) / len(union) >= NEAR_DUPLICATE_SIMILARITY):
+                return task
+        return None
+
+    def prefetch(self, query: str) -> asyncio.Task:
+        """
+        Starts looking up a query in the background, unless it or a near duplicate already is.
+
+        Args:
+            query (str): The search query.
+
+        Returns:
+            asyncio.Task: A task resolving to the answer.
+        """
+        return self._start(query, prefetch=True)
+
+    def _start(self, query: str, prefetch: bool) -> asyncio.Task:
+        key = normalize_query(query)
+        task = self._find(key)
+        if task is not None and not (task.done() and (task.cancelled() or task.exception())):
+            if not prefetch and task in self._unclaimed:
+                # The search the lookup was prefetched for: it was counted and recorded as a lookup when it started
+                self._unclaimed.discard(task)
+                self.prefetched += 1
+            else:
+                self.hits += 1
+                get_recorder().record("search", self.backend_name, self.backend_name, 0.0, role="search", cached=True, cost=0.0)
+            self._track(task)
+            return task
+        if task is not None:
+            # A failed or cancelled lookup is replaced below
+            self._unclaimed.discard(task)
+        self.misses += 1
+        task = asyncio.ensure_future(self._lookup(query))
+        self._entries[key] = (time.monotonic(), task)
+        if prefetch:
+            self._unclaimed.add(task)
+        self._track(task)
+        return task
+
+    def _track(self, task: asyncio.Task) -> None:
+        if not task.done():
+            self._runs.setdefault(task, set()).add(current_labels().get("run_id"))
+            task.add_done_callback(lambda done: self._runs.pop(done, None))
+
+    async def release_run(self, run_id: str) -> None:
+        """
+        Cancels the unfinished lookups that only a run was waiting for, once the run has ended or been cancelled.
+
+        Args:
+            run_id (str): The run.
+        """
+        abandoned = []
+        for task, runs in list(self._runs.items()):
+            runs.discard(run_id)
+            if not runs:
+                task.cancel()
+                abandoned.append(task)
+        await asyncio.gather(*abandoned, return_exceptions=True)
+
+    async def _lookup(self, query: str) -> str:
+        started = time.perf_counter()
+        answer = await asyncio.to_thread(self.backend.search, query)
+        get_recorder().record("search", self.backend_name, self.backend_name, time.perf_counter() - started, role="search", cached=False, cost=0.0)
+        return answer
+
+    async def search(self, query: str) -> str:
+        """
+        Returns the answer for a query, reusing a cached or in-flight lookup when possible.
+
+        Args:
+            query (str): The search query.
+
+        Returns:
+            str: The search answer.
+        """
+        return await self._start(query, prefetch=False)
+
+    def stats(self) -> str:
+        """Returns a one-line summary of the lookups saved so far."""
+        return f"Search: {self.misses} lookups ({self.prefetched} prefetched), {self.hits} served from cache or shared with a similar query"
+
+
+_service = None
+
+
+def get_search_service() -> SearchService:
+    """
+    Returns the process-wide search service, creating it on first use.
+
+    The backend is chosen with ``MAESTRO_SEARCH_BACKEND`` (``tavily`` or ``stub``).
+
+    Returns:
+        SearchService: The shared search service.
+    """
+    global _service
+    if _service is None:
+        if config.SEARCH_BACKEND == "stub":
+            backend = StubBackend()
+        elif config.SEARCH_BACKEND == "tavily":
+            backend = TavilyBackend(config.TAVILY_API_KEY)
+        else:
+            raise ValueError(f"Unknown search backend: {config.SEARCH_BACKEND}. Expected tavily or stub")
+        _service = SearchService(backend, config.SEARCH_CACHE_TTL)
+    return _service
@@ -0,0 +1,416 @@
+"""
+Long-running orchestration server.
+
+Every objective used to start a fresh ``python maestro.py`` process, which
+imports the SDKs, builds the provider clients and reads the objective from
+``input()`` before the first request goes out. The server keeps one process
+running and takes objectives over a small local HTTP API instead. Jobs run on a
+bounded pool of workers inside that process, so every job shares the warm
+provider clients with their connection pools, the response and search caches
+and the rate limiters.
+
+API (JSON unless noted):
+
+- ``POST /jobs`` submits an objective: ``{"objective": ..., "file": ..., "search": false, "plan": false,
+  "priority": 0}``. Jobs with a higher ``priority`` start first. Returns the job with its ``id``.
+- ``GET /jobs`` lists the jobs, ``GET /jobs/<id>`` returns one with its result once it is done.
+- ``GET /jobs/<id>/events`` streams the job's progress as server-sent events: its status changes and every
+  event of its run log (model calls, plan tasks, sections), from the start. It ends when the job does.
+  Reconnecting with ``Last-Event-ID`` resumes after the last event received. Only the most recent
+  ``MAESTRO_SERVER_MAX_JOB_EVENTS`` events of a job are kept, so a stream replays from the oldest one kept.
+- ``GET /jobs/<id>/log`` returns the Markdown exchange log (``text/markdown``).
+- ``GET /jobs/<id>/files`` lists the generated project files; ``GET /jobs/<id>/files/<path>`` returns one.
+- ``DELETE /jobs/<id>`` cancels a queued or running job.
+
+Finished jobs are forgotten, along with their metric events, once more than ``MAESTRO_SERVER_MAX_FINISHED_JOBS``
+have finished after them or ``MAESTRO_SERVER_JOB_RETENTION`` seconds after they finished; their files stay in the
+jobs directory.
+
+Usage:
+    python server.py --port 8420 --workers 4
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import mimetypes
+import os
+import time
+import uuid
+from collections import deque
+from urllib.parse import unquote, urlsplit
+
+from rich.console import Console
+
+import maestro
+import utils
+from config import MAX_WORKERS, SERVER_JOB_RETENTION, SERVER_MAX_FINISHED_JOBS, SERVER_MAX_JOB_EVENTS
+from metrics import get_recorder
+from providers import close_providers, get_provider, set_cache_mode
+from runlog import add_listener, remove_listener
+
+console = Console()
+
+# Largest request body accepted, in bytes
+MAX_BODY = 1024 * 1024
+# Seconds between keep-alive comments on an idle event stream
+HEARTBEAT_INTERVAL = 15
+STATUS_TEXT = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Job:
+    """
+    One submitted objective and its progress.
+
+    Args:
+        request (dict): The submitted JSON body.
+        jobs_dir (str): Directory the job's exchange log and project folder are written to.
+    """
+
+    def __init__(self, request: dict, jobs_dir: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.objective = request["objective"]
+        self.file = request.get("file")
+        self.search = bool(request.get("search", False))
+        self.plan = bool(request.get("plan", False))
+        self.priority = int(request.get("priority", 0))
+        self.max_workers = int(request.get("max_workers", MAX_WORKERS))
+        self.directory = os.path.join(jobs_dir, self.id)
+        self.log_filename = os.path.join(self.directory, "exchange_log.md")
+        self.status = "queued"
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.task = None
+        # The most recent events, and the number ever published, which the id of the next one is
+        self.events = deque(maxlen=SERVER_MAX_JOB_EVENTS)
+        self.published = 0
+        self.updated = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def publish(self, event: dict) -> None:
+        """Adds an event to the job's stream and wakes up its subscribers."""
+        self.events.append(event)
+        self.published += 1
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    def set_status(self, status: str, **fields) -> None:
+        self.status = status
+        self.publish({"type": "job_status", "timestamp": time.time(), "status": status, **fields})
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "objective": self.objective,
+            "status": self.status,
+            "priority": self.priority,
+            "plan": self.plan,
+            "search": self.search,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "result": self.result,
+        }
+
+    def project_folder(self) -> str:
+        if not self.result:
+            raise HTTPError(409, f"Job {self.id} has no project files yet")
+        return self.result["project_folder"]
+
+
+class JobQueue:
+    """
+    Runs submitted jobs on a bounded pool of workers, highest priority first and in submission order otherwise.
+
+    Args:
+        workers (int): Number of jobs running at once.
+        jobs_dir (str): Directory each job's files are written to.
+    """
+
+    def __init__(self, workers: int, jobs_dir: str):
+        self.jobs = {}
+        self.jobs_dir = jobs_dir
+        self._queue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(max(1, workers))]
+
+    def submit(self, request: dict) -> Job:
+        if not isinstance(request, dict) or not str(request.get("objective") or "").strip():
+            raise HTTPError(400, "An objective is required")
+        try:
+            job = Job(request, self.jobs_dir)
+        except (TypeError, ValueError) as e:
+            raise HTTPError(400, f"Invalid job: {e}")
+        self._evict()
+        self.jobs[job.id] = job
+        job.set_status("queued")
+        self._queue.put_nowait((-job.priority, next(self._order), job))
+        console.print(f"{job.id}: queued (priority {job.priority}): {job.objective[:60]}")
+        return job
+
+    def get(self, job_id: str) -> Job:
+        if job_id not in self.jobs:
+            raise HTTPError(404, f"No job {job_id}")
+        return self.jobs[job_id]
+
+    def cancel(self, job_id: str) -> Job:
+        job = self.get(job_id)
+        if job.finished:
+            raise HTTPError(409, f"Job {job_id} has already {job.status}")
+        if job.task is None:
+            # Still queued: the worker that takes it skips it
+            job.finished_at = time.time()
+            job.set_status("cancelled")
+            self._evict()
+        else:
+            job.task.cancel()
+        return job
+
+    def _evict(self) -> None:
+        """Forgets the finished jobs beyond the retention limits, oldest first, along with their metric events."""
+        finished = sorted((job for job in self.jobs.values() if job.finished), key=lambda job: job.finished_at)
+        cutoff = time.time() - SERVER_JOB_RETENTION
+        for index, job in enumerate(finished):
+            if index < len(finished) - SERVER_MAX_FINISHED_JOBS or job.finished_at < cutoff:
+                del self.jobs[job.id]
+                get_recorder().forget(job.id)
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job = await self._queue.get()
+            if not job.finished:
+                job.task = asyncio.create_task(self._run(job))
+                # Waited on without being awaited, so cancelling the job does not cancel the worker
+                await asyncio.wait([job.task])
+            self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        job.started_at = time.time()
+        job.set_status("running")
+        add_listener(job.id, job.publish)
+        try:
+            os.makedirs(job.directory, exist_ok=True)
+            file_content = maestro.load_input_file(job.file) if job.file else None
+            result = await maestro.run_objective(
+                job.objective,
+                file_content,
+                use_search=job.search,
+                plan=job.plan,
+                max_workers=job.max_workers,
+                log_filename=job.log_filename,
+                output_dir=job.directory,
+                run_id=job.id,
+                file_path=job.file,
+            )
+            job.result = {key: result[key] for key in ("run_id", "refined_output", "exchange_log", "event_log", "project_folder")}
+            # The job's calls are labelled with its id as the run id
+            job.result["metrics"] = get_recorder().summarize(job.id)
+            status = "done"
+        except asyncio.CancelledError:
+            status = "cancelled"
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            status = "failed"
+        finally:
+            remove_listener(job.id, job.publish)
+        job.finished_at = time.time()
+        job.set_status(status, **({"error": job.error} if job.error else {}))
+        console.print(f"{job.id}: {status} in {job.finished_at - job.started_at:.1f}s" + (f" ({job.error})" if job.error else ""))
+        self._evict()
+
+    async def aclose(self) -> None:
+        """Stops the workers, cancelling running jobs."""
+        for job in self.jobs.values():
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, *[job.task for job in self.jobs.values() if job.task is not None], return_exceptions=True)
+
+
+async def read_line(reader: asyncio.StreamReader) -> str:
+    try:
+        return (await reader.readline()).decode("latin-1").strip()
+    except ValueError:
+        # Longer than the stream's buffer limit (64 KiB)
+        raise HTTPError(400, "Request line or header too long")
+
+
+async def read_request(reader: asyncio.StreamReader) -> tuple:
+    """Reads one HTTP/1.1 request, returning its method, path, headers and body."""
+    request_line = await read_line(reader)
+    try:
+        method, target, _ = request_line.split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    while True:
+        line = await read_line(reader)
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = headers.get("content-length") or "0"
+    # ASCII digits only, so a sign, whitespace or underscores (which int() accepts) are rejected too
+    if not (length.isascii() and length.isdigit()):
+        raise HTTPError(400, f"Invalid Content-Length: {length}")
+    length = int(length)
+    if length > MAX_BODY:
+        raise HTTPError(413, f"Request bodies are limited to {MAX_BODY} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), unquote(urlsplit(target).path), headers, body
+
+
+async def send(writer: asyncio.StreamWriter, status: int, body, content_type: str = "application/json") -> None:
+    if content_type == "application/json":
+        body = json.dumps(body)
+    data = body.encode() if isinstance(body, str) else body
+    writer.write(
+        f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\ncontent-type: {content_type}\r\n"
+        f"content-length: {len(data)}\r\nconnection: close\r\n\r\n".encode() + data
+    )
+    await writer.drain()
+
+
+async def stream_events(writer: asyncio.StreamWriter, job: Job, last_event_id: str = None) -> None:
+    """Sends the job's events as server-sent events until the job has finished and every event is sent."""
+    writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\ncache-control: no-cache\r\nconnection: close\r\n\r\n")
+    index = int(last_event_id) + 1 if last_event_id and last_event_id.isdigit() else 0
+    while True:
+        # Taken before sending, so an event published while the writer drains is not missed
+        updated = job.updated
+        # Events older than the buffer are gone; the stream continues from the oldest one kept
+        first = job.published - len(job.events)
+        index = max(index, first)
+        for event in itertools.islice(job.events, index - first, None):
+            writer.write(f"id: {index}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n".encode())
+            index += 1
+        await writer.drain()
+        if job.finished and index >= job.published:
+            return
+        try:
+            await asyncio.wait_for(updated.wait(), HEARTBEAT_INTERVAL)
+        except asyncio.TimeoutError:
+            writer.write(b": keep-alive\n\n")
+
+
+def list_files(folder: str) -> list:
+    files = []
+    for directory, _, names in os.walk(folder):
+        files.extend(os.path.relpath(os.path.join(directory, name), folder).replace(os.sep, "/") for name in names)
+    return sorted(files)
+
+
+def resolve_file(folder: str, path: str) -> str:
+    """Returns the full path of a project file, refusing paths outside the project folder."""
+    root = os.path.realpath(folder)
+    full_path = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full_path]) != root or not os.path.isfile(full_path):
+        raise HTTPError(404, f"No file {path}")
+    return full_path
+
+
+async def handle(queue: JobQueue, method: str, path: str, headers: dict, body: bytes, writer: asyncio.StreamWriter) -> None:
+    parts = [part for part in path.split("/") if part]
+    if parts == ["jobs"]:
+        if method == "POST":
+            try:
+                request = json.loads(body or b"{}")
+            except json.JSONDecodeError as e:
+                raise HTTPError(400, f"Invalid JSON: {e}")
+            return await send(writer, 202, queue.submit(request).to_dict())
+        if method == "GET":
+            return await send(writer, 200, [job.to_dict() for job in queue.jobs.values()])
+        raise HTTPError(405, f"{method} is not allowed on /jobs")
+    if len(parts) < 2 or parts[0] != "jobs":
+        raise HTTPError(404, f"No route for {path}")
+
+    job = queue.get(parts[1])
+    resource = parts[2] if len(parts) > 2 else None
+    if resource is None and method == "GET":
+        return await send(writer, 200, job.to_dict())
+    if resource is None and method == "DELETE":
+        return await send(writer, 202, queue.cancel(job.id).to_dict())
+    if method != "GET":
+        raise HTTPError(405, f"{method} is not allowed on {path}")
+    if resource == "events" and len(parts) == 3:
+        return await stream_events(writer, job, headers.get("last-event-id"))
+    if resource == "log" and len(parts) == 3:
+        if not os.path.exists(job.log_filename):
+            raise HTTPError(409, f"Job {job.id} has not started yet")
+        with open(job.log_filename, 'r') as file:
+            return await send(writer, 200, file.read(), "text/markdown; charset=utf-8")
+    if resource == "files" and len(parts) == 3:
+        return await send(writer, 200, list_files(job.project_folder()))
+    if resource == "files":
+        full_path = resolve_file(job.project_folder(), "/".join(parts[3:]))
+        with open(full_path, 'rb') as file:
+            return await send(writer, 200, file.read(), mimetypes.guess_type(full_path)[0] or "application/octet-stream")
+    raise HTTPError(404, f"No route for {path}")
+
+
+async def serve(args) -> None:
+    os.makedirs(args.jobs_dir, exist_ok=True)
+    # Built before the first job, so no job pays for importing the SDK and setting up the client
+    get_provider("anthropic").client
+    queue = JobQueue(args.workers, args.jobs_dir)
+
+    async def on_connection(reader, writer):
+        try:
+            method, path, headers, body = await read_request(reader)
+            await handle(queue, method, path, headers, body, writer)
+        except HTTPError as e:
+            await send(writer, e.status, {"error": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(on_connection, args.host, args.port)
+    console.print(f"maestro server listening on http://{args.host}:{args.port} with {args.workers} workers, jobs in {args.jobs_dir}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await queue.aclose()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Serve maestro objectives over a local HTTP API")
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8420, help='Port to listen on')
+    parser.add_argument('--workers', type=int, default=4, help='Maximum number of jobs running at once')
+    parser.add_argument('--jobs-dir', default='maestro_jobs', help='Directory the exchange logs and project folders of the jobs are written to')
+    parser.add_argument('--cache', choices=['on', 'off', 'refresh'], help='Use the on-disk response cache, bypass it, or refresh it with new responses')
+    args = parser.parse_args()
+    if args.cache:
+        set_cache_mode(args.cache)
+
+    # Jobs run side by side, so their streamed output would interleave on the console; the event streams carry it
+    maestro.console.quiet = True
+    utils.console.quiet = True
+    try:
+        await serve(args)
+    finally:
+        get_recorder().export()
+        await close_providers()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
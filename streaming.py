@@ -0,0 +1,110 @@
+"""
+Helpers for streaming model output to the console while it is being generated,
+instead of waiting for the full completion, and recording each completed call in
+the run's exchange log.
+"""
+from rich.console import Console
+
+from metrics import completion_cost, metric_labels
+from providers import Completion, Provider, get_provider
+from routing import record_routing, route_for, validate
+from runlog import ExchangeLog
+from structured import StreamingJSONParser
+
+
+def format_timing(completion: Completion) -> str:
+    """
+    Formats the latency measurements of a completion for the console.
+
+    Args:
+        completion (Completion): The completed call.
+
+    Returns:
+        str: A one-line summary with time to first token and throughput.
+    """
+    if completion.cached:
+        return f"Served from the response cache in {completion.latency:.3f}s"
+    time_to_first_token = f"{completion.time_to_first_token:.2f}s" if completion.time_to_first_token is not None else "n/a"
+    return f"Time to first token: {time_to_first_token}, Total time: {completion.latency:.2f}s, Tokens/sec: {completion.tokens_per_second:.1f}"
+
+
+async def stream_completion(provider: Provider, console: Console, title: str, exchange_log: ExchangeLog = None, log_heading: str = None, echo: bool = True, role: str = None, **request) -> Completion:
+    """
+    Runs a completion, writing its tokens to the console as they arrive and the finished call to the exchange log.
+
+    Args:
+        provider (Provider): The provider to call.
+        console (Console): The console to stream to.
+        title (str): Heading printed above the streamed output.
+        exchange_log (ExchangeLog, optional): Log the completed call is recorded in. Defaults to None.
+        log_heading (str, optional): Text rendered before the output in the Markdown log. Defaults to None.
+        echo (bool, optional): Whether to stream to the console. Disable this when several calls
+            run concurrently, since their tokens would interleave. Defaults to True.
+        role (str, optional): The role the call is recorded under in the metrics, and whose model cascade
+            (see ``routing.py``) it runs on. Defaults to None.
+        **request: Arguments for ``Provider.complete_continued`` (model, messages, system, max_tokens, schema). ``provider``
+            and ``model`` are the top tier of the cascade. With a ``schema``, the text fields of the JSON output
+            are streamed to the console under their names instead of the raw JSON.
+
+    Returns:
+        Completion: The completed call, including time to first token and tokens/sec.
+    """
+    if echo:
+        console.rule(title, align="left")
+
+    parser = None
+    shown_path = None
+
+    def show_field(path, text):
+        nonlocal shown_path
+        if path != shown_path:
+            console.out(("" if shown_path is None else "\n") + f"[{'.'.join(str(key) for key in path)}]", highlight=False)
+            shown_path = path
+        console.out(text, end="", highlight=False)
+
+    def on_token(token):
+        if not echo:
+            return
+        if parser:
+            parser.feed(token)
+        else:
+            console.out(token, end="", highlight=False)
+
+    # The role's cascade, cheapest first; each tier is only tried when the one below fails validation
+    tiers = route_for(role, provider.name, request.pop("model"))
+    attempts = []
+    with metric_labels(**({"role": role} if role else {})):
+        for tier, (provider_name, model) in enumerate(tiers):
+            last = tier == len(tiers) - 1
+            if request.get("schema"):
+                parser = StreamingJSONParser(show_field)
+                shown_path = None
+            try:
+                # An answer cut off at the output limit is continued before it is validated
+                completion = await get_provider(provider_name).complete_continued(model=model, **request, on_token=on_token)
+            except Exception as e:
+                if last:
+                    raise
+                attempts.append(None)
+                reason = f"{type(e).__name__}: {e}"
+            else:
+                attempts.append(completion)
+                reason = None if last else validate(role, completion, structured=bool(request.get("schema")))
+            if reason is None:
+                break
+            if echo:
+                console.out("")
+            console.print(f"[yellow]{provider_name}:{model} rejected ({reason}), escalating to {tiers[tier + 1][0]}:{tiers[tier + 1][1]}[/yellow]")
+        if len(tiers) > 1:
+            record_routing(tiers, attempts, completion)
+    if echo:
+        console.out("")
+    if exchange_log:
+        exchange_log.event(
+            "completion", heading=log_heading, role=role, provider=provider_name, model=completion.model,
+            text=completion.text, latency=completion.latency, time_to_first_token=completion.time_to_first_token,
+            input_tokens=completion.input_tokens, output_tokens=completion.output_tokens, cached=completion.cached,
+            cost=completion_cost(completion), structured=bool(request.get("schema")),
+        )
+    console.print(format_timing(completion))
+    return completion
@@ -0,0 +1,405 @@
+"""
+Schema-constrained output for the orchestrator and the refiner.
+
+The orchestrator used to signal the end of a run by starting its answer with
+"The task is complete:", and its search query was cut out of the prose with a
+greedy regex; the refiner's project name, folder structure and files were
+scraped out of Markdown after the fact. A response that missed the format
+cost an iteration, or kept the loop going. Both roles, and the planner of plan
+mode, now answer through a JSON schema, sent as a forced tool call on Anthropic, OpenAI and Groq and as the
+``format`` of an Ollama chat, so the answer is one small JSON object that
+parses the same way every time. ``StreamingJSONParser`` follows the object as
+it streams in, so the console can show its text fields live and a response cut
+off at the output limit can still be read up to the last complete field.
+
+Plain-text answers (from a model without tool support, or journaled before
+this change) are still understood by ``parse_orchestrator`` and
+``parse_refined``.
+"""
+import json
+import re
+from typing import Callable
+
+# Text of the escape sequences JSON allows, besides \\uXXXX
+ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+# Marker of a finished objective in a plain-text orchestrator answer
+LEGACY_COMPLETE = "The task is complete:"
+
+
+def orchestrator_schema(use_search: bool = False) -> dict:
+    """
+    Returns the schema of an orchestrator step.
+
+    Args:
+        use_search (bool, optional): Whether to ask for a search query with the next sub-task. Defaults to False.
+
+    Returns:
+        dict: The ``name``, ``description`` and JSON Schema ``parameters`` of the output.
+    """
+    properties = {
+        "status": {
+            "type": "string",
+            "enum": ["continue", "complete"],
+            "description": "'complete' if the previous sub-task results fully achieve the objective, otherwise 'continue'.",
+        },
+        "prompt": {
+            "type": "string",
+            "description": "The concise and detailed prompt for the sub-agent that executes the next sub-task, or a short summary of the result when complete.",
+        },
+    }
+    if use_search:
+        properties["search_query"] = {
+            "type": "string",
+            "description": "A specific question that, asked online, would yield the most important information for the next sub-task.",
+        }
+    return {
+        "name": "next_step",
+        "description": "Reports whether the objective has been achieved and, if not, the next sub-task.",
+        "parameters": {"type": "object", "properties": properties, "required": ["status", "prompt"]},
+    }
+
+
+def plan_schema(use_search: bool = False) -> dict:
+    """
+    Returns the schema of a plan-mode task graph, as read by ``planner.parse_plan``.
+
+    Args:
+        use_search (bool, optional): Whether each task may come with a search query. Defaults to False.
+
+    Returns:
+        dict: The ``name``, ``description`` and JSON Schema ``parameters`` of the output.
+    """
+    task_properties = {
+        "id": {"type": "string", "description": "A short unique id for the sub-task."},
+        "prompt": {"type": "string", "description": "The concise and detailed prompt for the sub-agent that executes the sub-task."},
+        "depends_on": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "The ids of the sub-tasks whose results this one needs; empty if it needs none.",
+        },
+    }
+    if use_search:
+        task_properties["search_query"] = {
+            "type": "string",
+            "description": "A specific question that, asked online, would yield important information for the sub-task.",
+        }
+    return {
+        "name": "task_plan",
+        "description": "Breaks the whole objective down into sub-tasks and the dependencies between them.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "tasks": {
+                    "type": "array",
+                    "items": {"type": "object", "properties": task_properties, "required": ["id", "prompt", "depends_on"]},
+                },
+            },
+            "required": ["tasks"],
+        },
+    }
+
+
+REFINER_SCHEMA = {
+    "name": "final_output",
+    "description": "Returns the refined final output for the objective.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "output": {
+                "type": "string",
+                "description": "The cohesive final output in Markdown, without the contents of the code files.",
+            },
+            "project_name": {
+                "type": "string",
+                "description": "For coding projects only: a concise project name of at most 20 characters.",
+            },
+            "folder_structure": {
+                "type": "object",
+                "description": "For coding projects only: the folder structure, where each key is a folder or file, nested objects are subfolders and files are null.",
+            },
+            "files": {
+                "type": "array",
+                "description": "For coding projects only: every code file, complete.",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "path": {"type": "string", "description": "The file name, or its path within the folder structure."},
+                        "language": {"type": "string", "description": "The language identifier of the code, e.g. python."},
+                        "code": {"type": "string", "description": "The full contents of the file."},
+                    },
+                    "required": ["path", "code"],
+                },
+            },
+        },
+        "required": ["output"],
+    },
+}
+
+
+class StreamingJSONParser:
+    """
+    Incrementally parses a JSON document that arrives in fragments.
+
+    Args:
+        on_string (callable, optional): Called as ``on_string(path, text)`` with the decoded text of string values
+            as it arrives, where ``path`` is the tuple of object keys and array indices leading to the value.
+            Defaults to None.
+    """
+
+    def __init__(self, on_string: Callable[[tuple, str], None] = None):
+        self.on_string = on_string
+        self._chunks = []
+        self._length = 0
+        # One [is_object, key or index] frame per open container
+        self._stack = []
+        self._expect_key = False
+        self._in_string = False
+        self._string_is_key = False
+        self._string_path = ()
+        self._key = []
+        # None outside an escape, "" right after a backslash, "u" plus the hex digits read so far in \uXXXX
+        self._escape = None
+        self._high_surrogate = None
+        self._started = False
+        self._done = False
+        # Length of the longest prefix known to end after a complete value, and the brackets that close it
+        self._safe = (0, "")
+
+    @property
+    def text(self) -> str:
+        """The raw JSON received so far."""
+        return "".join(self._chunks)
+
+    @property
+    def done(self) -> bool:
+        """Whether the top-level object or array has been closed."""
+        return self._done
+
+    def _closers(self) -> str:
+        return "".join("}" if is_object else "]" for is_object, _ in reversed(self._stack))
+
+    def feed(self, fragment: str) -> None:
+        """Parses the next fragment, reporting the string text it contains."""
+        base = self._length
+        self._chunks.append(fragment)
+        self._length += len(fragment)
+        decoded = []
+
+        def emit(character):
+            (self._key if self._string_is_key else decoded).append(character)
+
+        for offset, character in enumerate(fragment):
+            if self._in_string:
+                if self._escape is not None:
+                    if self._escape == "":
+                        if character == "u":
+                            self._escape = "u"
+                            continue
+                        self._escape = None
+                        emit(ESCAPES.get(character, character))
+                        continue
+                    self._escape += character
+                    if len(self._escape) < 5:
+                        continue
+                    code, self._escape = int(self._escape[1:], 16), None
+                    if 0xD800 <= code < 0xDC00:
+                        self._high_surrogate = code
+                        continue
+                    if self._high_surrogate is not None and 0xDC00 <= code < 0xE000:
+                        code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+                    self._high_surrogate = None
+                    emit(chr(code))
+                elif character == "\\":
+                    self._escape = ""
+                elif character == '"':
+                    self._in_string = False
+                    if self._string_is_key:
+                        self._stack[-1][1] = "".join(self._key)
+                    else:
+                        self._flush(decoded)
+                        self._safe = (base + offset + 1, self._closers())
+                else:
+                    emit(character)
+            elif character == '"':
+                self._started = True
+                self._in_string = True
+                self._string_is_key = bool(self._stack) and self._stack[-1][0] and self._expect_key
+                self._key = []
+                self._string_path = tuple(key for _, key in self._stack)
+            elif character in "{[":
+                self._started = True
+                self._stack.append([character == "{", None if character == "{" else 0])
+                self._expect_key = character == "{"
+                self._safe = (base + offset + 1, self._closers())
+            elif character in "}]":
+                if self._stack:
+                    self._stack.pop()
+                self._expect_key = False
+                self._safe = (base + offset + 1, self._closers())
+                self._done = not self._stack
+            elif character == ":":
+                self._expect_key = False
+            elif character == "," and self._stack:
+                self._safe = (base + offset, self._closers())
+                if self._stack[-1][0]:
+                    self._expect_key = True
+                else:
+                    self._stack[-1][1] += 1
+        if self._in_string and not self._string_is_key:
+            self._flush(decoded)
+
+    def _flush(self, decoded: list) -> None:
+        if decoded and self.on_string:
+            self.on_string(self._string_path, "".join(decoded))
+        decoded.clear()
+
+    def value(self):
+        """
+        Parses the complete document.
+
+        Raises:
+            ValueError: If the document is incomplete or invalid.
+        """
+        return json.loads(self.text)
+
+    def partial(self):
+        """
+        Parses the document as far as it goes, closing whatever is still open.
+
+        A string value that was cut off is kept up to where it stopped; a key without its value and an
+        unfinished number or literal are dropped.
+
+        Returns:
+            The parsed value, or None if nothing usable has arrived.
+        """
+        if not self._started:
+            return None
+        text = self.text
+        if self._done:
+            candidate = text
+        elif self._in_string and not self._string_is_key:
+            if self._escape is not None:
+                # Drop the unfinished escape sequence, including its backslash
+                text = text[:len(text) - len(self._escape) - 1]
+            candidate = text + '"' + self._closers()
+        else:
+            length, closers = self._safe
+            candidate = text[:length] + closers
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            return None
+
+
+def _legacy_search_query(text: str) -> tuple:
+    """Finds a ``{"search_query": ...}`` object in prose, returning the query and the text without it."""
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r'\{', text):
+        try:
+            value, end = decoder.raw_decode(text, match.start())
+        except ValueError:
+            continue
+        if isinstance(value, dict) and "search_query" in value:
+            return value["search_query"], (text[:match.start()] + text[end:]).strip()
+    return None, text
+
+
+def parse_orchestrator(text: str) -> dict:
+    """
+    Reads an orchestrator step.
+
+    Args:
+        text (str): The JSON output of the ``next_step`` schema, or a plain-text answer.
+
+    Returns:
+        dict: ``complete`` (bool), ``prompt`` (the next sub-task, or the final summary) and ``search_query``
+            (None if there is none).
+    """
+    step = read_structured(text)
+    if isinstance(step, dict) and "prompt" in step:
+        return {
+            "complete": step.get("status") == "complete",
+            "prompt": str(step["prompt"]).strip(),
+            "search_query": step.get("search_query") or None,
+        }
+    search_query, text = _legacy_search_query(text)
+    complete = LEGACY_COMPLETE in text
+    return {"complete": complete, "prompt": text.replace(LEGACY_COMPLETE, "").strip() if complete else text, "search_query": search_query}
+
+
+def parse_refined(text: str) -> dict:
+    """
+    Reads the refiner's output.
+
+    Args:
+        text (str): The JSON output of the ``final_output`` schema, or a plain-text answer in the
+            ``Project Name:`` / ``<folder_structure>`` / ``Filename:`` format.
+
+    Returns:
+        dict: ``output``, ``project_name`` (None if there is none), ``folder_structure`` (a dict),
+            ``files`` (a list of ``(path, code)`` tuples) and ``error`` (why the folder structure was
+            unreadable, or None).
+    """
+    project = read_structured(text)
+    if isinstance(project, dict) and "output" in project:
+        folder_structure = project.get("folder_structure")
+        return {
+            "output": str(project["output"]).strip(),
+            "project_name": (project.get("project_name") or "").strip() or None,
+            "folder_structure": folder_structure if isinstance(folder_structure, dict) else {},
+            "files": [(file["path"], file["code"]) for file in project.get("files") or [] if isinstance(file, dict) and file.get("path") and "code" in file],
+            "error": None,
+        }
+
+    project_name_match = re.search(r'Project Name: (.*)', text)
+    folder_structure = {}
+    error = None
+    folder_structure_match = re.search(r'<folder_structure>(.*?)</folder_structure>', text, re.DOTALL)
+    if folder_structure_match:
+        try:
+            folder_structure = json.loads(folder_structure_match.group(1).strip())
+        except json.JSONDecodeError as e:
+            error = f"{e}\nInvalid JSON string: {folder_structure_match.group(1).strip()}"
+    files = re.findall(r'Filename: (\S+)\s*```[\w]*\n(.*?)\n```', text, re.DOTALL)
+    # The output is what is left around the project sections, so rendering does not repeat them
+    output = re.sub(r'Filename: (\S+)\s*```[\w]*\n(.*?)\n```|<folder_structure>.*?</folder_structure>|Project Name: [^\n]*', "", text, flags=re.DOTALL)
+    return {
+        "output": re.sub(r'\n{3,}', "\n\n", output).strip(),
+        "project_name": project_name_match.group(1).strip() if project_name_match else None,
+        "folder_structure": folder_structure,
+        "files": files,
+        "error": error,
+    }
+
+
+def render_refined(project: dict) -> str:
+    """
+    Renders a parsed refiner output as readable text, for the console, the logs and batch results.
+
+    The text keeps the ``Project Name:`` / ``<folder_structure>`` / ``Filename:`` layout, so
+    ``parse_refined`` reads the same project name, folder structure and files back from it.
+    """
+    parts = [project["output"]]
+    if project["project_name"]:
+        parts.append(f"Project Name: {project['project_name']}")
+    if project["folder_structure"]:
+        parts.append(f"<folder_structure>{json.dumps(project['folder_structure'], indent=2)}</folder_structure>")
+    parts.extend(f"Filename: {path}\n```\n{code}\n```" for path, code in project["files"])
+    return "\n\n".join(part for part in parts if part)
+
+
+def read_structured(text: str):
+    """
+    Reads the JSON object of a structured call, salvaging what it can from one that was cut off at the output limit.
+
+    Returns:
+        The parsed object, or None if the text is not a JSON object (a plain-text answer).
+    """
+    if not text.lstrip().startswith("{"):
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        parser = StreamingJSONParser()
+        parser.feed(text)
+        return parser.partial()
@@ -0,0 +1,51 @@
+"""
+Shared test setup.
+
+The tests run against the fake LLM server of the benchmarks
+(``benchmarks/fake_llm_server.py``), started once for the session. Its address
+is put in the environment before any maestro module is imported, since
+``config`` reads the provider endpoints when it is first imported. Every test
+runs in its own temporary working directory, so journals, logs and project
+folders never touch the repository.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+from fake_llm_server import FakeLLMServer, Scenario  # noqa: E402
+
+_server = FakeLLMServer().start()
+os.environ.update(
+    ANTHROPIC_API_KEY="test",
+    ANTHROPIC_BASE_URL=_server.url,
+    OPENAI_API_KEY="test",
+    OPENAI_BASE_URL=f"{_server.url}/v1",
+    GROQ_API_KEY="test",
+    GROQ_BASE_URL=_server.url,
+    OLLAMA_HOST=_server.url,
+    MAESTRO_CACHE="off",
+    MAESTRO_METRICS_FILE="",
+    MAESTRO_METRICS_PROMETHEUS_FILE="",
+    MAESTRO_RUN_INDEX="",
+    MAESTRO_SEARCH_BACKEND="stub",
+)
+
+# Fast enough that a test waits on the code under test, not on the simulated model
+FAST = dict(ttft=0.0, tokens_per_second=100000.0)
+
+
+@pytest.fixture
+def fake_server(tmp_path, monkeypatch):
+    """The fake server playing a fast default scenario, with its counters cleared; ``reset`` changes the scenario."""
+    monkeypatch.chdir(tmp_path)
+    _server.reset(Scenario(**FAST))
+    return _server
+
+
+def scenario(**fields) -> Scenario:
+    """A fast scenario with some fields changed."""
+    return Scenario(**{**FAST, **fields})
@@ -0,0 +1,83 @@
+"""Background file appends (``appender.py``) and the journal written through them."""
+import os
+import threading
+
+import pytest
+
+from appender import Appender, get_appender
+from journal import RunJournal
+
+
+def test_lines_from_concurrent_threads_are_written_whole_and_in_order(tmp_path):
+    appender = Appender(str(tmp_path / "events" / "log.jsonl"))
+
+    def append_lines(name):
+        for index in range(200):
+            appender.append(f"{name} {index}\n")
+
+    threads = [threading.Thread(target=append_lines, args=(name,)) for name in "abcd"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    appender.flush()
+
+    lines = (tmp_path / "events" / "log.jsonl").read_text().splitlines()
+    assert len(lines) == 800
+    for name in "abcd":
+        assert [line for line in lines if line.startswith(name)] == [f"{name} {index}" for index in range(200)]
+
+
+def test_lines_queued_during_a_write_share_the_next_fsync(tmp_path, monkeypatch):
+    first_write = threading.Event()
+    all_queued = threading.Event()
+    fsyncs = []
+    fsync = os.fsync
+
+    def slow_fsync(descriptor):
+        fsyncs.append(descriptor)
+        first_write.set()
+        # The first write is held until every line is queued
+        all_queued.wait(5)
+        fsync(descriptor)
+
+    monkeypatch.setattr(os, "fsync", slow_fsync)
+    appender = Appender(str(tmp_path / "journal.jsonl"), fsync=True)
+    appender.append("0\n")
+    first_write.wait(5)
+    for index in range(1, 100):
+        appender.append(f"{index}\n")
+    all_queued.set()
+    appender.flush()
+
+    assert len(fsyncs) == 2
+    assert (tmp_path / "journal.jsonl").read_text().split() == [str(index) for index in range(100)]
+
+
+def test_a_failed_write_is_raised_to_the_caller(tmp_path):
+    (tmp_path / "not_a_directory").write_text("")
+    appender = Appender(str(tmp_path / "not_a_directory" / "log.jsonl"))
+    appender.append("lost\n")
+
+    with pytest.raises(OSError):
+        appender.flush()
+    # Raised once; later lines are written again once the path works
+    appender.flush()
+
+
+def test_journal_records_include_every_appended_record(tmp_path):
+    journal = RunJournal("run", str(tmp_path))
+    for iteration in range(50):
+        journal.append("sub_agent", iteration=iteration, prompt="p", result="r")
+
+    assert [record["iteration"] for record in journal.records()] == list(range(50))
+    assert RunJournal("run", str(tmp_path)).exists()
+
+
+def test_journals_of_the_same_run_share_their_pending_records(tmp_path):
+    writer = RunJournal("run", str(tmp_path))
+    reader = RunJournal("run", str(tmp_path))
+    writer.append("start", objective="Build a thing")
+
+    assert reader.records() == [{"type": "start", "objective": "Build a thing"}]
+    assert get_appender(writer.path) is get_appender(str(tmp_path / "run.jsonl"))
@@ -0,0 +1,190 @@
+"""The provider layer (``providers.py``) against the fake server: retries, the response cache, continuations and the limiter."""
+import asyncio
+
+import pytest
+
+import config
+import providers
+import ratelimit
+from conftest import scenario
+from fake_llm_server import RESULT_MARKER
+from providers import AnthropicProvider, OllamaProvider, set_cache_mode
+
+MODEL = "claude-3-haiku-20240307"
+MESSAGES = [{"role": "user", "content": "Write one paragraph about the objective."}]
+
+
+def call(fake_server, body):
+    """Runs ``body(provider)`` with a fresh Anthropic provider pointed at the fake server, closing it afterwards."""
+    async def main():
+        provider = AnthropicProvider("test", fake_server.url)
+        try:
+            return await body(provider)
+        finally:
+            await provider.aclose()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(ratelimit, "backoff_delay", lambda attempt, retry_after=None: 0.0)
+
+
+@pytest.fixture
+def response_cache(tmp_path, monkeypatch):
+    """An empty on-disk response cache, turned on for the test."""
+    monkeypatch.setattr(config, "RESPONSE_CACHE", "on")
+    monkeypatch.setattr(config, "RESPONSE_CACHE_PATH", str(tmp_path / "cache.sqlite"))
+    yield
+    if providers._response_cache is not None:
+        providers._response_cache.close()
+        providers._response_cache = None
+
+
+def test_complete_retries_throttled_calls(fake_server, no_backoff):
+    fake_server.reset(scenario(fail_first=2, failure_status=429))
+
+    async def body(provider):
+        return await provider.complete(MODEL, MESSAGES), provider.limiter(MODEL)
+
+    completion, limiter = call(fake_server, body)
+
+    assert completion.text.endswith(RESULT_MARKER)
+    assert (fake_server.stats.requests, fake_server.stats.failures) == (3, 2)
+    assert limiter.throttled == 2
+    assert limiter.in_flight == 0
+
+
+def test_complete_does_not_retry_once_the_first_token_arrived(fake_server, no_backoff):
+    def on_token(token):
+        # A retryable error, raised after part of the answer has been shown
+        raise ConnectionError("connection reset mid-stream")
+
+    async def body(provider):
+        with pytest.raises(ConnectionError):
+            await provider.complete(MODEL, MESSAGES, on_token=on_token)
+        return provider.limiter(MODEL)
+
+    limiter = call(fake_server, body)
+
+    assert fake_server.stats.requests == 1
+    assert limiter.in_flight == 0
+
+
+def test_complete_releases_the_limiter_when_a_call_fails(fake_server):
+    fake_server.reset(scenario(failure_rate=1.0, failure_status=400))
+
+    async def body(provider):
+        from anthropic import BadRequestError
+        with pytest.raises(BadRequestError):
+            await provider.complete(MODEL, MESSAGES)
+        return provider.limiter(MODEL)
+
+    limiter = call(fake_server, body)
+
+    # Not retryable, so one request, and the slot it held is free again
+    assert fake_server.stats.requests == 1
+    assert limiter.in_flight == 0
+
+
+def test_complete_releases_the_limiter_when_retries_run_out(fake_server, no_backoff, monkeypatch):
+    monkeypatch.setattr(config, "MAX_RETRIES", 2)
+    fake_server.reset(scenario(failure_rate=1.0, failure_status=429))
+
+    async def body(provider):
+        from anthropic import RateLimitError
+        with pytest.raises(RateLimitError):
+            await provider.complete(MODEL, MESSAGES)
+        return provider.limiter(MODEL)
+
+    limiter = call(fake_server, body)
+
+    assert fake_server.stats.requests == 3
+    assert limiter.in_flight == 0
+    assert limiter.concurrency < config.MAX_CONCURRENCY / 2
+
+
+def test_response_cache_hit_miss_and_refresh(fake_server, response_cache):
+    async def body(provider):
+        completions = [await provider.complete(MODEL, MESSAGES), await provider.complete(MODEL, MESSAGES)]
+        requests_before_refresh = fake_server.stats.requests
+        set_cache_mode("refresh")
+        completions.append(await provider.complete(MODEL, MESSAGES))
+        requests_after_refresh = fake_server.stats.requests
+        set_cache_mode("on")
+        completions.append(await provider.complete(MODEL, MESSAGES))
+        return completions, requests_before_refresh, requests_after_refresh
+
+    completions, requests_before_refresh, requests_after_refresh = call(fake_server, body)
+
+    assert [completion.cached for completion in completions] == [False, True, False, True]
+    assert len({completion.text for completion in completions}) == 1
+    # The second call is served from the cache, the refreshed one goes to the server and is stored again
+    assert (requests_before_refresh, requests_after_refresh, fake_server.stats.requests) == (1, 2, 2)
+    assert (providers._response_cache.hits, providers._response_cache.misses) == (2, 2)
+
+
+def test_response_cache_off_always_calls_the_provider(fake_server, response_cache):
+    set_cache_mode("off")
+
+    async def body(provider):
+        return [await provider.complete(MODEL, MESSAGES) for _ in range(2)]
+
+    completions = call(fake_server, body)
+
+    assert not any(completion.cached for completion in completions)
+    assert fake_server.stats.requests == 2
+
+
+def test_complete_continued_finishes_a_truncated_reply(fake_server):
+    fake_server.reset(scenario(truncate_rate=1.0, output_tokens=20))
+
+    async def body(provider):
+        return await provider.complete_continued(MODEL, MESSAGES, max_tokens=1000)
+
+    completion = call(fake_server, body)
+
+    # One continuation, prefilled with the cut-off answer, finishes it
+    assert fake_server.stats.requests == 2
+    assert not completion.truncated
+    assert completion.text.startswith("lorem") and completion.text.endswith(RESULT_MARKER)
+    assert completion.output_tokens > 1000
+
+
+def test_complete_continued_stops_at_the_continuation_limit(fake_server):
+    fake_server.reset(scenario(truncate_rate=1.0, output_tokens=20))
+
+    async def body(provider):
+        return await provider.complete_continued(MODEL, MESSAGES, max_tokens=1000, max_continuations=0)
+
+    completion = call(fake_server, body)
+
+    assert fake_server.stats.requests == 1
+    assert completion.truncated
+
+
+def test_an_empty_ollama_stream_is_retried_then_raised(fake_server, no_backoff, monkeypatch):
+    monkeypatch.setattr(config, "MAX_RETRIES", 1)
+    streams = []
+
+    async def empty_stream():
+        return
+        yield
+
+    async def chat(**params):
+        streams.append(params["model"])
+        return empty_stream()
+
+    async def main():
+        provider = OllamaProvider(base_url=fake_server.url)
+        monkeypatch.setattr(provider.pool.hosts[0].client, "chat", chat)
+        try:
+            with pytest.raises(ConnectionError, match="empty stream"):
+                await provider.complete("llama3", MESSAGES, on_token=lambda token: None)
+        finally:
+            await provider.aclose()
+
+    asyncio.run(main())
+
+    assert streams == ["llama3", "llama3"]
@@ -0,0 +1,53 @@
+"""Resuming an interrupted run from its journal (``--resume``)."""
+import asyncio
+
+import pytest
+
+import maestro
+from conftest import scenario
+from journal import RunJournal
+from providers import close_providers
+
+PENDING_PROMPT = "Sub-task 1: implement part 1 of the objective and explain the result."
+
+
+def count_calls(monkeypatch, name: str) -> list:
+    """Wraps a maestro coroutine function, returning the list its calls' positional arguments are appended to."""
+    function = getattr(maestro, name)
+    calls = []
+
+    async def counted(*args, **kwargs):
+        calls.append(args)
+        return await function(*args, **kwargs)
+
+    monkeypatch.setattr(maestro, name, counted)
+    return calls
+
+
+@pytest.mark.parametrize("trailing", [
+    [("compaction", {"role": "sub_agent", "summary": "Earlier work.", "summarized_count": 0})],
+    [("draft", {"draft": "Draft so far.", "merged_keys": []})],
+    [("compaction", {"role": "sub_agent", "summary": "Earlier work.", "summarized_count": 0}), ("draft", {"draft": "Draft so far.", "merged_keys": []})],
+], ids=["compaction", "draft", "both"])
+def test_resume_reuses_the_orchestrator_reply_before_later_records(fake_server, monkeypatch, trailing):
+    fake_server.reset(scenario(subtasks=1))
+    journal = RunJournal("interrupted")
+    journal.append("start", objective="Build a thing", file_content=None, file_path=None, use_search=False, plan=False, log_filename="run.md", output_dir=".")
+    journal.append("orchestrator", iteration=1, response=PENDING_PROMPT, complete=False, search_query=None)
+    for record_type, fields in trailing:
+        journal.append(record_type, **fields)
+    orchestrator_calls = count_calls(monkeypatch, "opus_orchestrator")
+    sub_agent_calls = count_calls(monkeypatch, "haiku_sub_agent")
+
+    async def resume():
+        try:
+            return await maestro.run_objective("Build a thing", log_filename="run.md", run_id="interrupted", resume=True)
+        finally:
+            await close_providers()
+
+    asyncio.run(resume())
+
+    # The journaled reply is carried out as is, and the orchestrator is only asked once, to declare the task complete
+    assert sub_agent_calls[0][0] == PENDING_PROMPT
+    assert len(orchestrator_calls) == 1
+    assert [record["type"] for record in journal.records()].count("orchestrator") == 2
@@ -0,0 +1,116 @@
+"""The shared search service (``search.py``) on the stub backend."""
+import asyncio
+
+from metrics import metric_labels
+from search import SearchService, StubBackend
+
+
+class FailingOnceBackend(StubBackend):
+    """A stub backend whose first lookup fails."""
+
+    def search(self, query: str) -> str:
+        if not self.calls:
+            self.calls += 1
+            raise ConnectionError("search backend unreachable")
+        return super().search(query)
+
+
+def test_near_duplicate_queries_share_one_lookup():
+    backend = StubBackend({"python asyncio event loop tutorial": "Use asyncio.run."})
+    service = SearchService(backend)
+
+    async def main():
+        return await asyncio.gather(
+            service.search("Python asyncio event loop tutorial"),
+            service.search("what is the python asyncio event loop tutorial?"),
+            service.search("python asyncio event loop tutorial examples"),
+        )
+
+    answers = asyncio.run(main())
+
+    assert answers == ["Use asyncio.run."] * 3
+    assert backend.calls == 1
+    assert (service.misses, service.hits) == (1, 2)
+
+
+def test_different_queries_are_looked_up_separately():
+    backend = StubBackend()
+    service = SearchService(backend)
+
+    async def main():
+        await service.search("python asyncio tutorial")
+        await service.search("rust borrow checker")
+
+    asyncio.run(main())
+
+    assert backend.calls == 2
+    assert (service.misses, service.hits) == (2, 0)
+
+
+def test_answers_expire_after_the_ttl():
+    backend = StubBackend()
+    service = SearchService(backend, ttl=0.05)
+
+    async def main():
+        await service.search("python asyncio tutorial")
+        await service.search("python asyncio tutorial")
+        await asyncio.sleep(0.1)
+        await service.search("python asyncio tutorial")
+
+    asyncio.run(main())
+
+    assert backend.calls == 2
+    assert (service.misses, service.hits) == (2, 1)
+
+
+def test_a_prefetch_claimed_by_its_search_is_not_a_hit():
+    backend = StubBackend(latency=0.05)
+    service = SearchService(backend)
+
+    async def main():
+        service.prefetch("python asyncio tutorial")
+        await service.search("python asyncio tutorial")
+        # Another search for the same query is served from the cache
+        await service.search("python asyncio tutorial")
+
+    asyncio.run(main())
+
+    assert backend.calls == 1
+    assert (service.misses, service.prefetched, service.hits) == (1, 1, 1)
+
+
+def test_a_failed_lookup_is_replaced():
+    backend = FailingOnceBackend()
+    service = SearchService(backend)
+
+    async def main():
+        try:
+            await service.search("python asyncio tutorial")
+        except ConnectionError:
+            pass
+        return await service.search("python asyncio tutorial")
+
+    answer = asyncio.run(main())
+
+    assert answer == "No results found for: python asyncio tutorial"
+    assert backend.calls == 2
+    assert (service.misses, service.hits) == (2, 0)
+
+
+def test_release_run_only_cancels_lookups_no_other_run_waits_for():
+    service = SearchService(StubBackend(latency=0.2))
+
+    async def main():
+        with metric_labels(run_id="a"):
+            shared = service.prefetch("python asyncio tutorial")
+            own = service.prefetch("rust borrow checker")
+        with metric_labels(run_id="b"):
+            assert service.prefetch("python asyncio tutorial") is shared
+        await service.release_run("a")
+        return shared, own, await shared
+
+    shared, own, answer = asyncio.run(main())
+
+    assert own.cancelled()
+    assert not shared.cancelled()
+    assert answer == "No results found for: python asyncio tutorial"
@@ -0,0 +1,45 @@
+"""Request parsing of the job server (``server.py``)."""
+import asyncio
+
+import pytest
+
+from server import MAX_BODY, HTTPError, read_request
+
+
+def read(data: bytes):
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await read_request(reader)
+
+    return asyncio.run(main())
+
+
+def test_reads_the_method_path_headers_and_body():
+    method, path, headers, body = read(b"post /jobs%20x?wait=1 HTTP/1.1\r\nContent-Length: 2\r\nX-Test:  yes \r\n\r\n{}")
+
+    assert (method, path, body) == ("POST", "/jobs x", b"{}")
+    assert headers == {"content-length": "2", "x-test": "yes"}
+
+
+@pytest.mark.parametrize("length", ["abc", "-1", "+2", "1_0", "²"])
+def test_an_invalid_content_length_is_a_bad_request(length):
+    with pytest.raises(HTTPError) as error:
+        read(f"POST /jobs HTTP/1.1\r\nContent-Length: {length}\r\n\r\n{{}}".encode())
+
+    assert error.value.status == 400
+
+
+def test_a_body_over_the_limit_is_refused_before_it_is_read():
+    with pytest.raises(HTTPError) as error:
+        read(f"POST /jobs HTTP/1.1\r\nContent-Length: {MAX_BODY + 1}\r\n\r\n".encode())
+
+    assert error.value.status == 413
+
+
+def test_a_header_over_the_buffer_limit_is_a_bad_request():
+    with pytest.raises(HTTPError) as error:
+        read(b"GET /jobs HTTP/1.1\r\nX-Long: " + b"a" * 70000 + b"\r\n\r\n")
+
+    assert error.value.status == 400
@@ -1,10 +1,22 @@
 import os
 import json
+import time
+import tempfile
+import posixpath
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from rich.console import Console
 from rich.panel import Panel
 
 console = Console()
 
+# Permission bits of a new file under the process umask. Reading the umask means setting it, which is not safe once
+# other threads create files, so it is read once at import
+_umask = os.umask(0)
+os.umask(_umask)
+NEW_FILE_MODE = 0o666 & ~_umask
+
 def read_file(file_path: str) -> str:
     """
     Reads the content of a file and returns it as a string.
@@ -19,50 +31,167 @@ def read_file(file_path: str) -> str:
         content = file.read()
     return content
 
-def create_folder_structure(project_name: str, folder_structure: dict, code_blocks: list) -> None:
+@dataclass
+class MaterializeStats:
+    """What ``create_folder_structure`` wrote to disk."""
+    files_written: int = 0
+    files_unchanged: int = 0
+    bytes_written: int = 0
+    missing: list = field(default_factory=list)
+    errors: list = field(default_factory=list)
+    elapsed: float = 0.0
+
+def normalize_block_path(file_name: str) -> str:
+    """Normalizes a code block file name or structure path to a relative POSIX path."""
+    return posixpath.normpath(file_name.strip().replace('\\', '/')).lstrip('/')
+
+def index_code_blocks(code_blocks: list) -> dict:
+    """
+    Indexes code blocks by their normalized path.
+
+    A path named by several blocks keeps every one, in order, so files of the same
+    name in different folders each get their own block.
+
+    Args:
+        code_blocks (list): A list of tuples containing file names and their respective code content.
+
+    Returns:
+        dict: The block contents per path, in the order they appeared.
+    """
+    index = {}
+    for file_name, code in code_blocks:
+        index.setdefault(normalize_block_path(file_name), []).append(code)
+    return index
+
+def take_code_block(index: dict, relative_path: str):
+    """
+    Finds the code for a file of the folder structure.
+
+    The block named with the longest matching path suffix wins, so ``src/app.py`` is
+    preferred over ``app.py``. Each block is used once: blocks sharing a path are handed
+    out in order, and a file left without one is reported as missing.
+
+    Args:
+        index (dict): The index built by ``index_code_blocks``.
+        relative_path (str): The file's path inside the project.
+
+    Returns:
+        str: The code, or None if no block matches.
+    """
+    parts = normalize_block_path(relative_path).split('/')
+    for start in range(len(parts)):
+        blocks = index.get('/'.join(parts[start:]))
+        if blocks:
+            return blocks.pop(0)
+    return None
+
+def write_if_changed(path: str, content: str, mode: int) -> int:
+    """
+    Atomically writes a file through a temporary file and a rename, unless it already holds the content.
+
+    Args:
+        path (str): The file to write.
+        content (str): The new content.
+        mode (int): Permission bits for a newly written file.
+
+    Returns:
+        int: The number of bytes written, or -1 if the file was unchanged.
+    """
+    data = content.encode('utf-8')
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as file:
+                if file.read() == data:
+                    return -1
+    except OSError:
+        pass
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(data)
+        os.chmod(temporary_path, mode)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+    return len(data)
+
+def create_folder_structure(project_name: str, folder_structure: dict, code_blocks: list, max_workers: int = 8) -> MaterializeStats:
     """
     Creates the folder structure and code files based on the provided structure and code blocks.
 
+    Code blocks are matched to files through a path-keyed index, files are written
+    concurrently with an atomic replace, and files that already hold the same content
+    are left untouched.
+
     Args:
         project_name (str): The name of the project.
         folder_structure (dict): The folder structure as a dictionary.
         code_blocks (list): A list of tuples containing file names and their respective code content.
+        max_workers (int, optional): Maximum number of files written at once. Defaults to 8.
+
+    Returns:
+        MaterializeStats: The files and bytes written, unchanged and missing files, errors and time taken.
     """
+    started = time.perf_counter()
+    stats = MaterializeStats()
     try:
         os.makedirs(project_name, exist_ok=True)
         console.print(Panel(f"Created project folder: [bold]{project_name}[/bold]", title="[bold green]Project Folder[/bold green]", title_align="left", border_style="green"))
     except OSError as e:
         console.print(Panel(f"Error creating project folder: [bold]{project_name}[/bold]\nError: {e}", title="[bold red]Project Folder Creation Error[/bold red]", title_align="left", border_style="red"))
-        return
-
-    create_folders_and_files(project_name, folder_structure, code_blocks)
+        stats.errors.append((project_name, str(e)))
+        return stats
 
-def create_folders_and_files(current_path: str, structure: dict, code_blocks: list) -> None:
-    """
-    Recursively creates folders and files based on the provided structure and code blocks.
+    # Walk the structure once, creating folders and pairing each file with its code
+    index = index_code_blocks(code_blocks)
+    root = os.path.realpath(project_name)
+    writes = []
+    # First in, first out, so files that share a bare name take their code blocks in the order they are declared
+    pending = deque([("", folder_structure)])
+    while pending:
+        relative_folder, structure = pending.popleft()
+        for key, value in structure.items():
+            relative_path = posixpath.join(relative_folder, key)
+            path = os.path.join(project_name, *relative_path.split('/'))
+            if not os.path.realpath(path).startswith(root + os.sep):
+                stats.errors.append((path, "path is outside the project folder"))
+            elif isinstance(value, dict):
+                try:
+                    os.makedirs(path, exist_ok=True)
+                    pending.append((relative_path, value))
+                except OSError as e:
+                    stats.errors.append((path, str(e)))
+            else:
+                code_content = take_code_block(index, relative_path)
+                if code_content:
+                    writes.append((path, code_content))
+                else:
+                    stats.missing.append(path)
 
-    Args:
-        current_path (str): The current path to create folders and files in.
-        structure (dict): The folder structure as a dictionary.
-        code_blocks (list): A list of tuples containing file names and their respective code content.
-    """
-    for key, value in structure.items():
-        path = os.path.join(current_path, key)
-        if isinstance(value, dict):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # New files get the usual permissions rather than the private ones of a temporary file
+        futures = {executor.submit(write_if_changed, path, code, NEW_FILE_MODE): path for path, code in writes}
+        for future in as_completed(futures):
             try:
-                os.makedirs(path, exist_ok=True)
-                console.print(Panel(f"Created folder: [bold]{path}[/bold]", title="[bold blue]Folder Creation[/bold blue]", title_align="left", border_style="blue"))
-                create_folders_and_files(path, value, code_blocks)
+                written = future.result()
             except OSError as e:
-                console.print(Panel(f"Error creating folder: [bold]{path}[/bold]\nError: {e}", title="[bold red]Folder Creation Error[/bold red]", title_align="left", border_style="red"))
-        else:
-            code_content = next((code for file, code in code_blocks if file == key), None)
-            if code_content:
-                try:
-                    with open(path, 'w') as file:
-                        file.write(code_content)
-                    console.print(Panel(f"Created file: [bold]{path}[/bold]", title="[bold green]File Creation[/bold green]", title_align="left", border_style="green"))
-                except IOError as e:
-                    console.print(Panel(f"Error creating file: [bold]{path}[/bold]\nError: {e}", title="[bold red]File Creation Error[/bold red]", title_align="left", border_style="red"))
+                stats.errors.append((futures[future], str(e)))
+                continue
+            if written < 0:
+                stats.files_unchanged += 1
             else:
-                console.print(Panel(f"Code content not found for file: [bold]{key}[/bold]", title="[bold yellow]Missing Code Content[/bold yellow]", title_align="left", border_style="yellow"))
+                stats.files_written += 1
+                stats.bytes_written += written
+    stats.elapsed = time.perf_counter() - started
+
+    for path in stats.missing:
+        console.print(Panel(f"Code content not found for file: [bold]{path}[/bold]", title="[bold yellow]Missing Code Content[/bold yellow]", title_align="left", border_style="yellow"))
+    for path, error in stats.errors:
+        console.print(Panel(f"Error creating: [bold]{path}[/bold]\nError: {error}", title="[bold red]File Creation Error[/bold red]", title_align="left", border_style="red"))
+    console.print(Panel(
+        f"{stats.files_written} files written ({stats.bytes_written} bytes), {stats.files_unchanged} unchanged, "
+        f"{len(stats.missing)} missing, {len(stats.errors)} errors in {stats.elapsed:.3f}s",
+        title="[bold green]Project Files[/bold green]", title_align="left", border_style="green"
+    ))
+    return stats